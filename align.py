@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Offline forced alignment of (audio, transcript) pairs with SenseVoiceSmall.
+
+    python align.py --manifest pairs.jsonl --output aligned.jsonl --device cpu
+
+The manifest uses the `data/train_example.jsonl` fields: `key`, `source` (audio)
+and `target` (transcript). Batches are bucketed by duration read from the
+audio header; `source_len` (in units of `--source_len_ms`) is the fallback for
+audio whose header cannot be read.
+"""
+
+import argparse
+import json
+import os
+
+import torch
+
+from model import SenseVoiceSmall
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="align transcripts to audio")
+    parser.add_argument("--model_dir", type=str, default="iic/SenseVoiceSmall")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--manifest", type=str, required=True)
+    parser.add_argument("--output", type=str, required=True)
+    parser.add_argument("--batch_frames", type=int, default=6000, help="padded 10 ms fbank frames per batch")
+    parser.add_argument("--source_len_ms", type=float, default=10, help="duration of one source_len unit")
+    parser.add_argument("--max_batch", type=int, default=32)
+    parser.add_argument("--language", type=str, default="auto")
+    return parser.parse_args()
+
+
+def audio_frames(item, source_len_ms=10):
+    """Length of an item in 10 ms fbank frames, all items in the same unit:
+    from the audio header, else `source_len` scaled by `source_len_ms`, else
+    the file size as 16 kHz int16 samples."""
+    try:
+        import soundfile
+
+        return int(soundfile.info(item["source"]).duration * 100)
+    except Exception:
+        pass
+    if "source_len" in item:
+        return int(float(item["source_len"]) * source_len_ms / 10)
+    return os.path.getsize(item["source"]) // 320
+
+
+def length_buckets(items, batch_frames, max_batch, source_len_ms=10):
+    """Sort by length and cut batches whose padded size stays under batch_frames."""
+    lengths = {id(item): audio_frames(item, source_len_ms) for item in items}
+
+    def length(item):
+        return lengths[id(item)]
+
+    items = sorted(items, key=length)
+    batch, longest = [], 0
+    for item in items:
+        longest_new = max(longest, length(item))
+        if batch and (longest_new * (len(batch) + 1) > batch_frames or len(batch) >= max_batch):
+            yield batch
+            batch, longest_new = [], length(item)
+        batch.append(item)
+        longest = longest_new
+    if batch:
+        yield batch
+
+
+def main():
+    args = parse_args()
+    model, kwargs = SenseVoiceSmall.from_pretrained(model=args.model_dir, device=args.device)
+    model.eval()
+
+    with open(args.manifest, "r", encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    for i, item in enumerate(items):
+        item.setdefault("key", f"utt{i}")
+
+    done = 0
+    with open(args.output, "w", encoding="utf-8") as fout, torch.no_grad():
+        for batch in length_buckets(items, args.batch_frames, args.max_batch, args.source_len_ms):
+            res, meta_data = model.align(
+                data_in=[item["source"] for item in batch],
+                text=[item["target"] for item in batch],
+                key=[item["key"] for item in batch],
+                language=args.language,
+                **kwargs,
+            )
+            for r in res:
+                fout.write(json.dumps(r, ensure_ascii=False) + "\n")
+            done += len(batch)
+            print(f"aligned {done}/{len(items)}, {meta_data}")
+
+
+if __name__ == "__main__":
+    main()
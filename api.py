@@ -1,5 +1,8 @@
 # Set the device with environment, default is cuda:0
 # export SENSEVOICE_DEVICE=cuda:1
+# Set the backend (torch, automodel, onnx, onnx_int8, or auto to benchmark the
+# installed ones at startup and keep the fastest of SENSEVOICE_ACCURACY_TIER)
+# export SENSEVOICE_BACKEND=onnx
 
 import os, re
 from fastapi import FastAPI, File, Form
@@ -8,7 +11,7 @@ from typing_extensions import Annotated
 from typing import List
 from enum import Enum
 import torchaudio
-from model import SenseVoiceSmall
+from utils.backends import create_backend
 from funasr.utils.postprocess_utils import rich_transcription_postprocess
 from io import BytesIO
 
@@ -23,8 +26,12 @@ class Language(str, Enum):
     nospeech = "nospeech"
 
 model_dir = "iic/SenseVoiceSmall"
-m, kwargs = SenseVoiceSmall.from_pretrained(model=model_dir, device=os.getenv("SENSEVOICE_DEVICE", "cuda:0"))
-m.eval()
+backend = create_backend(
+    os.getenv("SENSEVOICE_BACKEND", "torch"),
+    model_dir,
+    device=os.getenv("SENSEVOICE_DEVICE", "cuda:0"),
+    tier=os.getenv("SENSEVOICE_ACCURACY_TIER", "fp32"),
+)
 
 regex = r"<\|.*\|>"
 
@@ -53,7 +60,7 @@ async def turn_audio_to_text(files: Annotated[List[bytes], File(description="wav
     for file in files:
         file_io = BytesIO(file)
         data_or_path_or_list, audio_fs = torchaudio.load(file_io)
-        data_or_path_or_list = data_or_path_or_list.mean(0)
+        data_or_path_or_list = data_or_path_or_list.mean(0).numpy()
         audios.append(data_or_path_or_list)
         file_io.close()
     if lang == "":
@@ -62,19 +69,18 @@ async def turn_audio_to_text(files: Annotated[List[bytes], File(description="wav
         key = ["wav_file_tmp_name"]
     else:
         key = keys.split(",")
-    res = m.inference(
-        data_in=audios,
+    res = backend.infer_batch(
+        audios,
         language=lang, # "zh", "en", "yue", "ja", "ko", "nospeech"
         use_itn=False,
         ban_emo_unk=False,
-        key=key,
+        keys=key,
         fs=audio_fs,
-        **kwargs,
     )
     if len(res) == 0:
         return {"result": []}
-    for it in res[0]:
+    for it in res:
         it["raw_text"] = it["text"]
         it["clean_text"] = re.sub(regex, "", it["text"], 0, re.MULTILINE)
         it["text"] = rich_transcription_postprocess(it["text"])
-    return {"result": res[0]}
+    return {"result": res}
@@ -19,7 +19,9 @@ class SenseYourVoiceApp:
         # 初始化三个模块
         self.voice_to_text = VoiceToTextModule(
             model_dir=self.config.get("model_dir", "iic/SenseVoiceSmall"),
-            device=self.config.get("device", "cuda:0" if torch.cuda.is_available() else "cpu")
+            device=self.config.get("device", "cuda:0" if torch.cuda.is_available() else "cpu"),
+            backend=self.config.get("backend", "automodel"),
+            accuracy_tier=self.config.get("accuracy_tier", "fp32")
         )
         
         self.understanding = UnderstandingModule(
@@ -98,6 +100,11 @@ def parse_args():
     parser.add_argument("--instruction", type=str, default="", help="处理指令")
     parser.add_argument("--model_dir", type=str, default="iic/SenseVoiceSmall", help="语音模型目录")
     parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu", help="设备")
+    parser.add_argument("--backend", type=str, default="automodel",
+                        choices=["auto", "torch", "automodel", "onnx", "onnx_int8"],
+                        help="推理后端，auto 表示启动时测速选择")
+    parser.add_argument("--accuracy_tier", type=str, default="fp32", choices=["reference", "fp32", "int8"],
+                        help="auto 模式下允许的最低精度等级")
     parser.add_argument("--understanding_api_key", type=str, help="理解模块API密钥")
     parser.add_argument("--understanding_api_url", type=str, help="理解模块API地址")
     parser.add_argument("--specialized_api_key", type=str, help="专业任务模块API密钥")
@@ -111,6 +118,8 @@ def main():
     config = {
         "model_dir": args.model_dir,
         "device": args.device,
+        "backend": args.backend,
+        "accuracy_tier": args.accuracy_tier,
         "understanding_api_key": args.understanding_api_key,
         "understanding_api_url": args.understanding_api_url,
         "specialized_api_key": args.specialized_api_key,
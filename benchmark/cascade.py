@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Confidence-gated int8 -> fp32 cascade: fraction re-decoded, throughput and
+error rate against the fp32-only baseline.
+
+    python -m benchmark.cascade --backend torch [--manifest data/val_example.jsonl]
+    python -m benchmark.cascade --backend onnx --onnx_dir <dir with model.onnx and model_quant.onnx>
+"""
+
+import argparse
+import os
+import time
+
+from benchmark.common import error_rate, example_wavs, load_model, read_manifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark the quantized/fp32 cascade")
+    parser.add_argument("--model_dir", type=str, default="iic/SenseVoiceSmall")
+    parser.add_argument("--backend", type=str, default="torch", choices=["torch", "onnx"])
+    parser.add_argument("--onnx_dir", type=str, default=None, help="defaults to the downloaded model dir")
+    parser.add_argument("--manifest", type=str, default=None, help="jsonl with source/target")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--thresholds", type=str, default="0.0,0.8,0.85,0.9,0.95,1.01")
+    parser.add_argument("--unit", type=str, default="char", choices=["char", "word"])
+    return parser.parse_args()
+
+
+def run_torch(model, kwargs, wavs, keys, thresholds):
+    from utils.cascade import cascade_inference, quantize_model
+
+    rows = []
+    beg = time.perf_counter()
+    baseline = model.inference(wavs, key=keys, language="auto", use_itn=True, **kwargs)[0]
+    rows.append(("fp32", 1.0, time.perf_counter() - beg, [r["text"] for r in baseline]))
+
+    quantized = quantize_model(model)
+    for threshold in thresholds:
+        beg = time.perf_counter()
+        results, redecode = cascade_inference(
+            quantized, model, wavs, key=keys, threshold=threshold, language="auto", use_itn=True, **kwargs
+        )
+        cost = time.perf_counter() - beg
+        rows.append((f"cascade@{threshold}", len(redecode) / len(wavs), cost, [r["text"] for r in results]))
+    return rows
+
+
+def run_onnx(kwargs, onnx_dir, wavs, thresholds):
+    from utils.ctc_vocab import PieceTable
+    from utils.model_bin import SenseVoiceSmallONNX
+
+    table = PieceTable(kwargs["tokenizer"])
+    language, textnorm = [0], [14]  # auto, withitn
+
+    rows = []
+    fp32 = SenseVoiceSmallONNX(onnx_dir)
+    beg = time.perf_counter()
+    ids = fp32(wavs, language, textnorm)
+    rows.append(("fp32", 1.0, time.perf_counter() - beg, table.decode_batch(ids)))
+
+    model = SenseVoiceSmallONNX(onnx_dir, cascade_threshold=thresholds[0])
+    for threshold in thresholds:
+        model.cascade_threshold = threshold
+        model.cascade_stats = {"segments": 0, "redecoded": 0}
+        beg = time.perf_counter()
+        ids = model(wavs, language, textnorm)
+        cost = time.perf_counter() - beg
+        fraction = model.cascade_stats["redecoded"] / max(model.cascade_stats["segments"], 1)
+        rows.append((f"cascade@{threshold}", fraction, cost, table.decode_batch(ids)))
+    return rows
+
+
+def main():
+    args = parse_args()
+    model, kwargs = load_model(args.model_dir, "cpu")
+    if args.manifest:
+        items = read_manifest(args.manifest, args.limit)
+        wavs, refs = [i["source"] for i in items], [i["target"] for i in items]
+        keys = [i.get("key", f"utt_{n}") for n, i in enumerate(items)]
+    else:
+        wavs, refs = list(example_wavs(kwargs).values()), None
+        keys = [os.path.basename(w) for w in wavs]
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+
+    if args.backend == "torch":
+        rows = run_torch(model, kwargs, wavs, keys, thresholds)
+    else:
+        onnx_dir = args.onnx_dir or os.path.dirname(kwargs["init_param"])
+        rows = run_onnx(kwargs, onnx_dir, wavs, thresholds)
+
+    baseline = rows[0][3]
+    print("mode\tredecoded\tutt/s\tdiff_vs_fp32\terr")
+    for name, fraction, cost, hyps in rows:
+        err = error_rate(refs, hyps, args.unit) if refs else float("nan")
+        print(
+            f"{name}\t{fraction:.3f}\t{len(wavs) / cost:.2f}\t"
+            f"{error_rate(baseline, hyps, args.unit):.4f}\t{err:.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
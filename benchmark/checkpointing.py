@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Training tokens/sec and peak memory with encoder activation checkpointing on and off.
+
+    python -m benchmark.checkpointing --device cuda:0 --frames 1000 --batch 8
+Every configuration runs in its own process so that peak RSS is comparable on CPU.
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import torch
+
+from benchmark.common import load_model, synthetic_batch
+
+configs = [
+    {"every": 0, "mode": "layer"},
+    {"every": 1, "mode": "attention"},
+    {"every": 2, "mode": "layer"},
+    {"every": 1, "mode": "layer"},
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark activation checkpointing")
+    parser.add_argument("--model_dir", type=str, default="iic/SenseVoiceSmall")
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--frames", type=int, default=1000, help="lfr frames per utterance")
+    parser.add_argument("--tokens", type=int, default=100, help="target tokens per utterance")
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--single", type=str, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def run_single(args, config):
+    model, _ = load_model(args.model_dir, args.device)
+    model.train()
+    model.encoder.set_checkpointing(config["every"], config["mode"])
+    optim = torch.optim.SGD([p for p in model.parameters() if p.requires_grad], lr=1e-6)
+    cuda = args.device.startswith("cuda")
+    if cuda:
+        torch.cuda.reset_peak_memory_stats(args.device)
+
+    costs = []
+    for step in range(args.steps + 1):
+        speech, speech_lengths, text, text_lengths = synthetic_batch(
+            model, args.batch, args.frames, args.tokens, args.device
+        )
+        beg = time.perf_counter()
+        loss, _, _ = model(speech, speech_lengths, text, text_lengths)
+        loss.backward()
+        optim.step()
+        optim.zero_grad()
+        if cuda:
+            torch.cuda.synchronize(args.device)
+        if step > 0:
+            costs.append(time.perf_counter() - beg)
+
+    if cuda:
+        peak = torch.cuda.max_memory_allocated(args.device)
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    tokens = args.batch * args.frames * len(costs)
+    return {**config, "tokens_per_s": tokens / sum(costs), "peak_mb": peak / 2**20}
+
+
+def main():
+    args = parse_args()
+    if args.single is not None:
+        print(json.dumps(run_single(args, json.loads(args.single))))
+        return
+
+    print("every\tmode\ttokens/s\tpeak_MB")
+    for config in configs:
+        cmd = [sys.executable, "-m", "benchmark.checkpointing", "--single", json.dumps(config)]
+        for k in ("model_dir", "device", "batch", "frames", "tokens", "steps"):
+            cmd += [f"--{k}", str(getattr(args, k))]
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{r['every']}\t{r['mode']}\t{r['tokens_per_s']:.1f}\t{r['peak_mb']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
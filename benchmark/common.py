@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+rich_regex = r"<\|.*?\|>"
+example_languages = ["zh", "en", "yue", "ja", "ko"]
+
+
+def load_model(model_dir="iic/SenseVoiceSmall", device="cpu", **kwargs):
+    from model import SenseVoiceSmall
+
+    model, kwargs = SenseVoiceSmall.from_pretrained(model=model_dir, device=device, **kwargs)
+    model.eval()
+    return model, kwargs
+
+
+def example_wavs(kwargs):
+    """Bundled example audio of the downloaded model, keyed by language."""
+    model_path = os.path.dirname(kwargs["init_param"])
+    return {lang: os.path.join(model_path, "example", f"{lang}.mp3") for lang in example_languages}
+
+
+def read_manifest(path, limit=None):
+    """Read a manifest in `data/train_example.jsonl` format."""
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            items.append(json.loads(line))
+            if limit is not None and len(items) >= limit:
+                break
+    return items
+
+
+def clean_text(text):
+    return re.sub(rich_regex, "", text).strip()
+
+
+def edit_distance(ref, hyp):
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h))
+        prev = cur
+    return prev[-1]
+
+
+def error_rate(refs, hyps, unit="char"):
+    """CER (unit="char") or WER (unit="word") after removing rich tags."""
+    errors, total = 0, 0
+    for ref, hyp in zip(refs, hyps):
+        ref, hyp = clean_text(ref), clean_text(hyp)
+        if unit == "word":
+            ref, hyp = ref.split(), hyp.split()
+        else:
+            ref, hyp = ref.replace(" ", ""), hyp.replace(" ", "")
+        errors += edit_distance(ref, hyp)
+        total += len(ref)
+    return errors / max(total, 1)
+
+
+def timeit(fn, repeat=5, warmup=1):
+    """Run `fn` and return (last result, list of per-run seconds)."""
+    result = None
+    for _ in range(warmup):
+        result = fn()
+    costs = []
+    for _ in range(repeat):
+        beg = time.perf_counter()
+        result = fn()
+        costs.append(time.perf_counter() - beg)
+    return result, costs
+
+
+def synthetic_batch(model, batch, frames, tokens, device="cpu"):
+    """Random fbank features and token targets with valid rich-tag prompts."""
+    import torch
+
+    speech = torch.randn(batch, frames, 560)
+    speech_lengths = torch.full((batch,), frames, dtype=torch.int32)
+    text = torch.randint(100, 20000, (batch, tokens + 4))
+    text[:, 0] = next(iter(model.lid_int_dict))
+    text[:, 1] = model.emo_dict["neutral"]
+    text[:, 2] = model.emo_dict["neutral"]
+    text[:, 3] = next(iter(model.textnorm_int_dict))
+    text_lengths = torch.full((batch,), tokens + 4, dtype=torch.int32)
+    return [t.to(device) for t in (speech, speech_lengths, text, text_lengths)]
+
+
+def summarize(costs):
+    costs = np.asarray(costs, dtype=np.float64)
+    return {
+        "mean": float(costs.mean()),
+        "p50": float(np.percentile(costs, 50)),
+        "p99": float(np.percentile(costs, 99)),
+    }
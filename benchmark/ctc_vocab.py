@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Throughput and accuracy of language-restricted CTC vocabulary pruning.
+
+    python -m benchmark.ctc_vocab --device cpu [--manifest data/val_example.jsonl]
+"""
+
+import argparse
+
+from benchmark.common import error_rate, example_wavs, load_model, read_manifest, summarize, timeit
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark prune_vocab per language")
+    parser.add_argument("--model_dir", type=str, default="iic/SenseVoiceSmall")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--manifest", type=str, default=None, help="jsonl with source/target/text_language")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    model, kwargs = load_model(args.model_dir, args.device)
+
+    if args.manifest:
+        by_lang = {}
+        for item in read_manifest(args.manifest, args.limit):
+            lang = item["text_language"].strip("<|>")
+            by_lang.setdefault(lang, ([], []))
+            by_lang[lang][0].append(item["source"])
+            by_lang[lang][1].append(item["target"])
+    else:
+        by_lang = {lang: ([wav], None) for lang, wav in example_wavs(kwargs).items()}
+
+    print("lang\tfull_s\tpruned_s\tspeedup\tvocab\tdiff_vs_full\terr_full\terr_pruned")
+    for lang, (wavs, refs) in by_lang.items():
+        def run(prune_vocab):
+            return model.inference(
+                data_in=wavs, language=lang, use_itn=True, prune_vocab=prune_vocab, **kwargs
+            )[0]
+
+        full, full_costs = timeit(lambda: run(False), repeat=args.repeat)
+        pruned, pruned_costs = timeit(lambda: run(True), repeat=args.repeat)
+        full_hyps = [r["text"] for r in full]
+        pruned_hyps = [r["text"] for r in pruned]
+        vocab = len(model.language_vocab.subsets.get(lang, [])) if hasattr(model, "language_vocab") else -1
+        unit = "word" if lang == "en" else "char"
+        err_full = error_rate(refs, full_hyps, unit) if refs else float("nan")
+        err_pruned = error_rate(refs, pruned_hyps, unit) if refs else float("nan")
+        full_s, pruned_s = summarize(full_costs)["mean"], summarize(pruned_costs)["mean"]
+        print(
+            f"{lang}\t{full_s:.3f}\t{pruned_s:.3f}\t{full_s / pruned_s:.2f}x\t{vocab}\t"
+            f"{error_rate(full_hyps, pruned_hyps, unit):.4f}\t{err_full:.4f}\t{err_pruned:.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Per-layer time/FLOPs/memory of the SenseVoiceSmall encoder.
+
+    python -m benchmark.encoder_profile --device cpu --trace encoder_trace.json
+"""
+
+import argparse
+
+import torch
+
+from benchmark.common import example_wavs, load_model
+from utils.profiler import EncoderProfiler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="profile SenseVoiceEncoderSmall layers")
+    parser.add_argument("--model_dir", type=str, default="iic/SenseVoiceSmall")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--input", type=str, nargs="*", default=None, help="audio files, default: bundled examples")
+    parser.add_argument("--top", type=int, default=30)
+    parser.add_argument("--csv", type=str, default=None)
+    parser.add_argument("--trace", type=str, default=None, help="chrome trace json")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    model, kwargs = load_model(args.model_dir, args.device)
+    wavs = args.input or list(example_wavs(kwargs).values())
+
+    with torch.no_grad():
+        model.inference(data_in=wavs[:1], language="auto", **kwargs)  # warmup
+        with EncoderProfiler(model) as prof:
+            for wav in wavs:
+                model.inference(data_in=wav, language="auto", **kwargs)
+
+    print(prof.table(top=args.top))
+    if args.csv:
+        prof.export_csv(args.csv)
+    if args.trace:
+        prof.export_chrome_trace(args.trace)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Allocations and latency of OrtInferSession with and without IO binding.
+
+    python -m benchmark.onnx_alloc --onnx_dir <exported model dir> --frames 300 --batch 4
+Every configuration runs in its own process so that peak RSS is comparable.
+Python-side bytes are counted with tracemalloc (numpy reports to it), RSS
+growth after warmup covers the ORT allocations.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+configs = [
+    {"io_binding": False, "arena": False},
+    {"io_binding": False, "arena": True},
+    {"io_binding": True, "arena": True},
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark ORT IO binding")
+    parser.add_argument("--onnx_dir", type=str, required=True)
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=300, help="lfr frames per utterance")
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--single", type=str, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_single(args, config):
+    from utils.infer_utils import OrtInferSession
+
+    model_file = os.path.join(args.onnx_dir, "model_quant.onnx" if args.quantize else "model.onnx")
+    session = OrtInferSession(
+        model_file,
+        intra_op_num_threads=args.threads,
+        io_binding=config["io_binding"],
+        enable_cpu_mem_arena=config["arena"],
+    )
+    feats = np.random.randn(args.batch, args.frames, 560).astype(np.float32)
+    inputs = [
+        feats,
+        np.full((args.batch,), args.frames, dtype=np.int32),
+        np.zeros((args.batch,), dtype=np.int32),
+        np.full((args.batch,), 14, dtype=np.int32),
+    ]
+    for _ in range(3):
+        session(inputs)
+    rss_warm = rss_mb()
+
+    tracemalloc.start()
+    costs = []
+    for _ in range(args.calls):
+        beg = time.perf_counter()
+        ctc_logits, _ = session(inputs)
+        ctc_logits.argmax(axis=-1)
+        costs.append(time.perf_counter() - beg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        **config,
+        "ms": 1000 * float(np.median(costs)),
+        "py_peak_mb": peak / 2**20,
+        "rss_mb": rss_mb(),
+        "rss_growth_mb": rss_mb() - rss_warm,
+    }
+
+
+def main():
+    args = parse_args()
+    if args.single is not None:
+        print(json.dumps(run_single(args, json.loads(args.single))))
+        return
+
+    print("io_binding\tarena\tp50_ms\tpy_peak_MB\trss_MB\trss_growth_MB")
+    for config in configs:
+        cmd = [sys.executable, "-m", "benchmark.onnx_alloc", "--single", json.dumps(config)]
+        for k in ("onnx_dir", "batch", "frames", "calls", "threads"):
+            cmd += [f"--{k}", str(getattr(args, k))]
+        if args.quantize:
+            cmd.append("--quantize")
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(
+            f"{r['io_binding']}\t{r['arena']}\t{r['ms']:.2f}\t{r['py_peak_mb']:.1f}\t"
+            f"{r['rss_mb']:.1f}\t{r['rss_growth_mb']:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""CPU throughput of SenseVoiceSmallONNX for batch sizes 1-32.
+
+    python -m benchmark.onnx_batch --onnx_dir <exported model dir> [--manifest data/val_example.jsonl]
+"""
+
+import argparse
+import os
+import time
+
+import librosa
+
+from benchmark.common import example_wavs, read_manifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark batched ONNX inference")
+    parser.add_argument("--onnx_dir", type=str, required=True, help="dir with model.onnx, config.yaml, am.mvn")
+    parser.add_argument("--manifest", type=str, default=None, help="jsonl with source")
+    parser.add_argument("--num_utts", type=int, default=64)
+    parser.add_argument("--batch_sizes", type=str, default="1,2,4,8,16,32")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--quantize", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    from utils.model_bin import SenseVoiceSmallONNX
+
+    args = parse_args()
+    if args.manifest:
+        wavs = [i["source"] for i in read_manifest(args.manifest, args.num_utts)]
+    else:
+        wavs = list(example_wavs({"init_param": os.path.join(args.onnx_dir, "model.pt")}).values())
+    # decode once up front so that only feature extraction and the session are timed
+    waveforms = [librosa.load(w, sr=16000)[0] for w in wavs]
+    waveforms = (waveforms * (args.num_utts // len(waveforms) + 1))[: args.num_utts]
+    audio_s = sum(len(w) for w in waveforms) / 16000
+
+    model = SenseVoiceSmallONNX(
+        args.onnx_dir, quantize=args.quantize, intra_op_num_threads=args.threads
+    )
+    reference = None
+    print("batch\tseconds\tutt/s\tRTF\tsame_as_bs1")
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        model.batch_size = batch_size
+        model(waveforms[:batch_size], 0, 14)  # warmup
+        beg = time.perf_counter()
+        res = model(waveforms, 0, 14)
+        cost = time.perf_counter() - beg
+        if reference is None:
+            reference = res
+        same = sum(a == b for a, b in zip(reference, res)) / len(res)
+        print(f"{batch_size}\t{cost:.3f}\t{len(res) / cost:.2f}\t{cost / audio_s:.4f}\t{same:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Import time, peak RSS and heavy modules pulled in by the ONNX runtime path vs the torch path.
+
+    python -m benchmark.onnx_footprint --onnx_dir <exported model dir> [--wav example/zh.wav]
+Every path runs in its own process.
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+heavy_modules = ["torch", "torchaudio", "funasr", "librosa", "jieba", "modelscope", "yaml"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark the torch-free ONNX path")
+    parser.add_argument("--onnx_dir", type=str, required=True)
+    parser.add_argument("--wav", type=str, default=None, help="16 kHz wav decoded once after loading")
+    parser.add_argument("--single", type=str, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def run_single(args, path):
+    beg = time.perf_counter()
+    if path == "onnx":
+        from utils.ctc_vocab import PieceTable
+        from utils.model_bin import SenseVoiceSmallONNX
+    else:
+        from model import SenseVoiceSmall
+    imported = time.perf_counter()
+
+    if path == "onnx":
+        model = SenseVoiceSmallONNX(args.onnx_dir)
+        loaded = time.perf_counter()
+        if args.wav:
+            import glob
+
+            bpemodel = glob.glob(f"{args.onnx_dir}/*.bpe.model")[0]
+            model(args.wav, 0, 14, tokenizer=PieceTable.from_bpemodel(bpemodel))
+    else:
+        model, kwargs = SenseVoiceSmall.from_pretrained(model=args.onnx_dir, device="cpu")
+        loaded = time.perf_counter()
+        if args.wav:
+            model.inference(args.wav, language="auto", use_itn=True, **kwargs)
+    return {
+        "path": path,
+        "import_s": imported - beg,
+        "load_s": loaded - imported,
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "modules": [m for m in heavy_modules if m in sys.modules],
+    }
+
+
+def main():
+    args = parse_args()
+    if args.single is not None:
+        print(json.dumps(run_single(args, args.single)))
+        return
+
+    print("path\timport_s\tload_s\tpeak_rss_MB\theavy_modules")
+    for path in ("onnx", "torch"):
+        cmd = [sys.executable, "-m", "benchmark.onnx_footprint", "--onnx_dir", args.onnx_dir, "--single", path]
+        if args.wav:
+            cmd += ["--wav", args.wav]
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{r['path']}\t{r['import_s']:.3f}\t{r['load_s']:.3f}\t{r['rss_mb']:.1f}\t{','.join(r['modules'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Output bytes, Python-side allocations and latency of a plain export
+(ctc_logits) vs an in-graph argmax export (ctc_ids + ctc_max_prob).
+
+    python -m benchmark.onnx_outputs --export --output_dir exported_argmax
+    python -m benchmark.onnx_outputs --output_dir exported_argmax --batch 8 --frames 500
+"""
+
+import argparse
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmark.common import load_model, summarize
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark in-graph CTC argmax")
+    parser.add_argument("--model_dir", type=str, default="iic/SenseVoiceSmall")
+    parser.add_argument("--output_dir", type=str, required=True, help="where the argmax graph is exported")
+    parser.add_argument("--export", action="store_true")
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--calls", type=int, default=20)
+    return parser.parse_args()
+
+
+def main():
+    import torch
+
+    from utils import export_utils
+    from utils.infer_utils import OrtInferSession
+    from utils.model_bin import SenseVoiceSmallONNX
+
+    args = parse_args()
+    model, kwargs = load_model(args.model_dir, "cpu")
+    model_dir = os.path.dirname(kwargs["init_param"])
+    if args.export:
+        kwargs = {k: v for k, v in kwargs.items() if k != "model"}
+        rebuilt = model.export(type="onnx", ctc_argmax=True)
+        with torch.no_grad():
+            export_utils.export(
+                model=rebuilt, ctc_argmax=True, **{**kwargs, "output_dir": args.output_dir}
+            )
+
+    inputs = [
+        np.random.randn(args.batch, args.frames, 560).astype(np.float32),
+        np.full((args.batch,), args.frames, dtype=np.int32),
+        np.zeros((args.batch,), dtype=np.int32),
+        np.full((args.batch,), 14, dtype=np.int32),
+    ]
+    print("graph\toutputs\toutput_MB\tpy_peak_MB\tp50_ms")
+    for name, path in [
+        ("logits", os.path.join(model_dir, "model.onnx")),
+        ("argmax", os.path.join(args.output_dir, "model.onnx")),
+    ]:
+        session = OrtInferSession(path)
+        SenseVoiceSmallONNX.frame_outputs(session, inputs)
+        outputs = session(inputs)
+        nbytes = sum(o.nbytes for o in outputs)
+        costs = []
+        tracemalloc.start()
+        for _ in range(args.calls):
+            beg = time.perf_counter()
+            SenseVoiceSmallONNX.frame_outputs(session, inputs)
+            costs.append(time.perf_counter() - beg)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"{name}\t{','.join(session.get_output_names())}\t{nbytes / 2**20:.2f}\t"
+            f"{peak / 2**20:.2f}\t{1000 * summarize(costs)['p50']:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Throughput of one shared OrtInferSession vs OrtSessionPool under concurrent callers.
+
+    python -m benchmark.onnx_pool --onnx_dir <exported model dir> --clients 16
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+from benchmark.common import summarize
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark the ORT session pool")
+    parser.add_argument("--onnx_dir", type=str, required=True)
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent caller threads")
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--frames", type=int, default=300, help="lfr frames per request")
+    parser.add_argument("--threads", type=str, default="1,2,4,8", help="intra-op threads per pooled session")
+    parser.add_argument("--core_budget", type=int, default=None)
+    parser.add_argument("--pin_cores", action="store_true")
+    return parser.parse_args()
+
+
+def drive(session, args):
+    inputs = [
+        np.random.randn(1, args.frames, 560).astype(np.float32),
+        np.array([args.frames], dtype=np.int32),
+        np.zeros((1,), dtype=np.int32),
+        np.array([14], dtype=np.int32),
+    ]
+    session(inputs)
+    latencies = []
+
+    def client():
+        for _ in range(args.requests):
+            beg = time.perf_counter()
+            session(inputs)
+            latencies.append(time.perf_counter() - beg)
+
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    beg = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return len(latencies) / (time.perf_counter() - beg), summarize(latencies)
+
+
+def main():
+    from utils.infer_utils import OrtInferSession, OrtSessionPool, available_cores
+
+    args = parse_args()
+    model_file = os.path.join(args.onnx_dir, "model_quant.onnx" if args.quantize else "model.onnx")
+    budget = args.core_budget or len(available_cores())
+
+    print("config\tsessions\treq/s\tp50_ms\tp99_ms")
+    for name, session in [
+        ("shared-4", OrtInferSession(model_file, intra_op_num_threads=4)),
+        (f"shared-{budget}", OrtInferSession(model_file, intra_op_num_threads=budget)),
+    ]:
+        rps, lat = drive(session, args)
+        print(f"{name}\t1\t{rps:.2f}\t{1000 * lat['p50']:.1f}\t{1000 * lat['p99']:.1f}")
+        del session
+
+    for threads in [int(t) for t in args.threads.split(",")]:
+        pool = OrtSessionPool(
+            model_file,
+            intra_op_num_threads=threads,
+            core_budget=budget,
+            pin_cores=args.pin_cores,
+        )
+        rps, lat = drive(pool, args)
+        print(
+            f"pool-{threads}x\t{len(pool.sessions)}\t{rps:.2f}\t"
+            f"{1000 * lat['p50']:.1f}\t{1000 * lat['p99']:.1f}"
+        )
+        del pool
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Startup time of SenseVoiceSmallONNX without caches, on the first (cache
+building) start and on later starts.
+
+    python -m benchmark.onnx_startup --onnx_dir <exported model dir> [--quantize]
+Every start runs in a fresh process.
+"""
+
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark ONNX model startup")
+    parser.add_argument("--onnx_dir", type=str, required=True)
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--single", type=str, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def run_single(args, config):
+    beg = time.perf_counter()
+    from utils.model_bin import SenseVoiceSmallONNX
+
+    imported = time.perf_counter()
+    SenseVoiceSmallONNX(
+        args.onnx_dir,
+        quantize=args.quantize,
+        cache_dir=config["cache_dir"],
+        cache_optimized=config["cache"],
+    )
+    return {"import_s": imported - beg, "init_s": time.perf_counter() - imported}
+
+
+def start(args, cache_dir, cache):
+    cmd = [sys.executable, "-m", "benchmark.onnx_startup", "--onnx_dir", args.onnx_dir]
+    cmd += ["--single", json.dumps({"cache_dir": cache_dir, "cache": cache})]
+    if args.quantize:
+        cmd.append("--quantize")
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+    if args.single is not None:
+        print(json.dumps(run_single(args, json.loads(args.single))))
+        return
+
+    cache_dir = tempfile.mkdtemp(prefix="sensevoice_ort_cache_")
+    try:
+        rows = [("no_cache", start(args, cache_dir, False))]
+        shutil.rmtree(cache_dir)
+        rows.append(("first_start", start(args, cache_dir, True)))
+        for _ in range(args.repeat):
+            rows.append(("cached", start(args, cache_dir, True)))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print("start\timport_s\tinit_s")
+    for name, r in rows:
+        print(f"{name}\t{r['import_s']:.3f}\t{r['init_s']:.3f}")
+
+
+if __name__ == "__main__":
+    main()
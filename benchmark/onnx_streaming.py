@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Per-chunk latency of the streaming ONNX export and its output vs the offline model.
+
+    python -m benchmark.onnx_streaming [--export --chunk_size 16 --look_back 4] [--manifest data/val_example.jsonl]
+"""
+
+import argparse
+import os
+import time
+
+import librosa
+
+from benchmark.common import error_rate, example_wavs, load_model, read_manifest, summarize
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark streaming ONNX inference")
+    parser.add_argument("--model_dir", type=str, default="iic/SenseVoiceSmall")
+    parser.add_argument("--export", action="store_true", help="export model_streaming.onnx first")
+    parser.add_argument("--chunk_size", type=int, default=16, help="lfr frames (60 ms each) per chunk")
+    parser.add_argument("--look_back", type=int, default=4, help="cached chunks of attention context")
+    parser.add_argument("--piece_ms", type=int, default=100, help="audio pushed per call")
+    parser.add_argument("--manifest", type=str, default=None)
+    parser.add_argument("--limit", type=int, default=50)
+    return parser.parse_args()
+
+
+def main():
+    import torch
+
+    from utils import export_utils
+    from utils.ctc_vocab import PieceTable
+    from utils.model_bin import SenseVoiceSmallONNX, SenseVoiceSmallStreamingONNX
+
+    args = parse_args()
+    model, kwargs = load_model(args.model_dir, "cpu")
+    onnx_dir = os.path.dirname(kwargs["init_param"])
+    if args.export:
+        streaming = model.export(streaming=True, chunk_size=args.chunk_size, look_back=args.look_back)
+        with torch.no_grad():
+            export_utils.export(model=streaming, **{k: v for k, v in kwargs.items() if k != "model"})
+    table = PieceTable(kwargs["tokenizer"])
+
+    if args.manifest:
+        wavs = [i["source"] for i in read_manifest(args.manifest, args.limit)]
+    else:
+        wavs = list(example_wavs(kwargs).values())
+    offline = SenseVoiceSmallONNX(onnx_dir)
+    stream = SenseVoiceSmallStreamingONNX(onnx_dir)
+    piece = 16 * args.piece_ms
+
+    chunk_costs, offline_hyps, stream_hyps = [], [], []
+    for wav in wavs:
+        waveform = librosa.load(wav, sr=16000)[0]
+        offline_hyps.append(table.decode(offline(waveform, 0, 15)[0][4:]))
+        tokens = []
+        for beg in range(0, len(waveform), piece):
+            chunks_before = stream.num_chunks
+            t = time.perf_counter()
+            out = stream(waveform[beg : beg + piece], 0, 15, is_final=beg + piece >= len(waveform))
+            if stream.num_chunks > chunks_before:
+                chunk_costs.append((time.perf_counter() - t) / (stream.num_chunks - chunks_before))
+            tokens += out["tokens"]
+        stream_hyps.append(table.decode(tokens))
+
+    lat = summarize(chunk_costs)
+    chunk_ms = args.chunk_size * 60
+    print(f"chunk\t{chunk_ms} ms audio, look_back {args.look_back}")
+    print(f"latency\tmean {1000 * lat['mean']:.1f} ms\tp50 {1000 * lat['p50']:.1f} ms\tp99 {1000 * lat['p99']:.1f} ms")
+    print(f"diff_vs_offline\t{error_rate(offline_hyps, stream_hyps):.4f}")
+
+
+if __name__ == "__main__":
+    main()
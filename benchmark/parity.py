@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Output parity and performance of every backend (utils/backends.py) and
+batch size on a fixed corpus: the bundled examples plus synthetic audio.
+
+    python -m benchmark.parity --backends torch onnx onnx_int8 --batch_sizes 1 4 8 --output parity.json
+    git diff --no-index old/parity.json parity.json
+
+Every row is compared with `--reference` at the smallest batch size:
+agreement over tokens (rich tags plus characters) and, where both sides
+emit them, the largest timestamp delta. Each backend / batch size runs in
+a fresh process so peak RSS is its own. Exits non-zero if a row is out of
+tolerance.
+"""
+
+import argparse
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from benchmark.common import clean_text, edit_distance, example_languages, rich_regex, summarize
+
+sample_rate = 16000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="cross-backend parity and performance matrix")
+    parser.add_argument("--model_dir", type=str, default="iic/SenseVoiceSmall")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--backends", type=str, nargs="+", default=["torch", "onnx", "onnx_int8"])
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--reference", type=str, default="torch")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the corpus per row")
+    parser.add_argument("--tol_fp32", type=float, default=0.99, help="min agreement, reference/fp32 tiers")
+    parser.add_argument("--tol_int8", type=float, default=0.95, help="min agreement, int8 tier")
+    parser.add_argument("--tol_timestamp", type=float, default=0.06, help="max timestamp delta in seconds")
+    parser.add_argument("--output", type=str, default="parity.json")
+    parser.add_argument("--single", type=str, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def synthetic_corpus():
+    """Deterministic non-speech inputs: edge cases for padding, blanks and the VAD."""
+    rng = np.random.default_rng(0)
+    t = np.arange(sample_rate * 12) / sample_rate
+    voiced = np.sin(2 * np.pi * 140 * t) + 0.5 * np.sin(2 * np.pi * 280 * t) + 0.25 * np.sin(2 * np.pi * 420 * t)
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 4 * t))
+    sweep = np.sin(2 * np.pi * (100 + 300 * t[: sample_rate * 8]) * t[: sample_rate * 8])
+    return {
+        "synth_silence_3s": np.zeros(sample_rate * 3),
+        "synth_noise_5s": 0.05 * rng.standard_normal(sample_rate * 5),
+        "synth_sweep_8s": 0.3 * sweep,
+        "synth_voiced_12s": 0.2 * voiced * envelope,
+        "synth_short_0.3s": 0.05 * rng.standard_normal(int(sample_rate * 0.3)),
+    }
+
+
+def load_corpus(model_dir):
+    import librosa
+
+    from utils.backends import local_model_dir
+
+    example_dir = os.path.join(local_model_dir(model_dir), "example")
+    corpus = {}
+    for lang in example_languages:
+        path = os.path.join(example_dir, f"{lang}.mp3")
+        if os.path.exists(path):
+            corpus[f"example_{lang}"] = librosa.load(path, sr=sample_rate)[0]
+    corpus.update(synthetic_corpus())
+    return {k: np.asarray(v, dtype=np.float32) for k, v in corpus.items()}
+
+
+def run_single(config):
+    from utils.backends import create_backend
+
+    corpus = load_corpus(config["model_dir"])
+    keys = list(corpus)
+    backend = create_backend(config["backend"], config["model_dir"], device=config["device"])
+    timestamps = backend.supports("timestamps")
+    extra = {"output_timestamp": True} if timestamps else {}
+    batch = config["batch"]
+
+    def decode_all():
+        results, costs = [], []
+        for beg in range(0, len(keys), batch):
+            batch_keys = keys[beg : beg + batch]
+            t = time.perf_counter()
+            results += backend.infer_batch([corpus[k] for k in batch_keys], keys=batch_keys, **extra)
+            costs.append(time.perf_counter() - t)
+        return results, costs
+
+    decode_all()
+    costs = []
+    for _ in range(config["repeat"]):
+        results, pass_costs = decode_all()
+        costs += pass_costs
+    audio_s = sum(len(w) for w in corpus.values()) / sample_rate
+    lat = summarize(costs)
+    return {
+        "backend": config["backend"],
+        "tier": backend.tier,
+        "batch": batch,
+        "rtf": sum(costs) / (audio_s * config["repeat"]),
+        "p50_ms": 1000 * lat["p50"],
+        "p99_ms": 1000 * lat["p99"],
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "texts": {r["key"]: r["text"] for r in results},
+        "timestamps": {r["key"]: r["timestamp"] for r in results if "timestamp" in r},
+    }
+
+
+def run(args, backend, batch):
+    config = {
+        "backend": backend,
+        "batch": batch,
+        "model_dir": args.model_dir,
+        "device": args.device,
+        "repeat": args.repeat,
+    }
+    cmd = [sys.executable, "-m", "benchmark.parity", "--single", json.dumps(config)]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"backend": backend, "batch": batch, "error": proc.stderr.strip().splitlines()[-1:]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def tokens(text):
+    """Rich tags as single tokens followed by the characters of the text."""
+    return re.findall(rich_regex, text) + list(clean_text(text).replace(" ", ""))
+
+
+def agreement(ref_texts, hyp_texts):
+    errors, total = 0, 0
+    for key, ref in ref_texts.items():
+        ref, hyp = tokens(ref), tokens(hyp_texts.get(key, ""))
+        errors += edit_distance(ref, hyp)
+        total += len(ref)
+    return 1 - errors / max(total, 1)
+
+
+def timestamp_delta(ref_ts, hyp_ts):
+    """Largest start/end difference over utterances with identical token sequences."""
+    deltas = []
+    for key, ref in ref_ts.items():
+        hyp = hyp_ts.get(key)
+        if hyp is None or [t[0] for t in ref] != [t[0] for t in hyp]:
+            continue
+        deltas += [max(abs(r[1] - h[1]), abs(r[2] - h[2])) for r, h in zip(ref, hyp)]
+    return max(deltas) if deltas else None
+
+
+def compare(args, rows):
+    ok_rows = [r for r in rows if "error" not in r]
+    reference = next(
+        (r for r in ok_rows if r["backend"] == args.reference and r["batch"] == min(args.batch_sizes)),
+        ok_rows[0] if ok_rows else None,
+    )
+    passed = True
+    for row in ok_rows:
+        row["reference"] = f"{reference['backend']}@{reference['batch']}"
+        row["agreement"] = agreement(reference["texts"], row["texts"])
+        row["max_timestamp_delta"] = timestamp_delta(reference["timestamps"], row["timestamps"])
+        min_agreement = args.tol_int8 if row["tier"] == "int8" else args.tol_fp32
+        row["pass"] = row["agreement"] >= min_agreement and (
+            row["max_timestamp_delta"] is None or row["max_timestamp_delta"] <= args.tol_timestamp
+        )
+        passed &= row["pass"]
+    return passed and len(ok_rows) == len(rows)
+
+
+def meta(args):
+    from utils.backends import cpu_features
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "cpu_features": cpu_features(),
+        "model_dir": args.model_dir,
+        "device": args.device,
+        "tolerances": {"fp32": args.tol_fp32, "int8": args.tol_int8, "timestamp_s": args.tol_timestamp},
+    }
+
+
+def main():
+    args = parse_args()
+    if args.single is not None:
+        print(json.dumps(run_single(json.loads(args.single))))
+        return
+
+    from utils.backends import BACKENDS
+
+    rows = []
+    for backend in args.backends:
+        if backend not in BACKENDS or not BACKENDS[backend].available():
+            rows.append({"backend": backend, "error": ["not installed"]})
+            continue
+        for batch in args.batch_sizes:
+            rows.append(run(args, backend, batch))
+    passed = compare(args, rows)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta(args), "matrix": rows}, f, ensure_ascii=False, indent=1, sort_keys=True)
+        f.write("\n")
+
+    print("backend\tbatch\tRTF\tp50_ms\tp99_ms\tpeak_rss_MB\tagreement\tmax_ts_delta\tpass")
+    for r in rows:
+        if "error" in r:
+            print(f"{r['backend']}\t{r.get('batch', '-')}\terror: {' '.join(r['error'])}")
+            continue
+        ts = "-" if r["max_timestamp_delta"] is None else f"{r['max_timestamp_delta']:.3f}"
+        print(
+            f"{r['backend']}\t{r['batch']}\t{r['rtf']:.4f}\t{r['p50_ms']:.1f}\t{r['p99_ms']:.1f}\t"
+            f"{r['peak_rss_mb']:.0f}\t{r['agreement']:.4f}\t{ts}\t{r['pass']}"
+        )
+    print(f"matrix written to {args.output}")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Latency and error rate of the fp32, dynamic int8 and static int8 (QDQ) ONNX models.
+
+    python -m benchmark.quantization --manifest data/val_example.jsonl \\
+        [--export --calibration_manifest data/train_example.jsonl]
+"""
+
+import argparse
+import os
+import time
+
+import librosa
+
+from benchmark.common import error_rate, read_manifest, summarize
+
+modes = [("fp32", False), ("dynamic", True), ("static", "static")]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark ONNX quantization modes")
+    parser.add_argument("--model_dir", type=str, default="iic/SenseVoiceSmall")
+    parser.add_argument("--manifest", type=str, required=True, help="jsonl with source/target")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--export", action="store_true", help="export the three models first")
+    parser.add_argument("--calibration_manifest", type=str, default="data/train_example.jsonl")
+    parser.add_argument("--calibration_limit", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--unit", type=str, default="char", choices=["char", "word"])
+    return parser.parse_args()
+
+
+def export_models(model, kwargs, args):
+    import torch
+
+    from utils import export_utils
+
+    kwargs = {k: v for k, v in kwargs.items() if k != "model"}
+    rebuilt = model.export(type="onnx", quantize=False)
+    with torch.no_grad():
+        export_utils.export(model=rebuilt, quantize=True, **kwargs)
+        export_utils.export(
+            model=rebuilt,
+            quantize="static",
+            calibration_manifest=args.calibration_manifest,
+            calibration_limit=args.calibration_limit,
+            **kwargs,
+        )
+
+
+def main():
+    from benchmark.common import load_model
+    from utils.ctc_vocab import PieceTable
+    from utils.model_bin import SenseVoiceSmallONNX
+
+    args = parse_args()
+    model, kwargs = load_model(args.model_dir, "cpu")
+    onnx_dir = os.path.dirname(kwargs["init_param"])
+    if args.export:
+        export_models(model, kwargs, args)
+    table = PieceTable(kwargs["tokenizer"])
+
+    items = read_manifest(args.manifest, args.limit)
+    waveforms = [librosa.load(i["source"], sr=16000)[0] for i in items]
+    refs = [i["target"] for i in items]
+    audio_s = sum(len(w) for w in waveforms) / 16000
+
+    baseline = None
+    print("model\tp50_ms\tp99_ms\tRTF\tdiff_vs_fp32\terr")
+    for name, quantize in modes:
+        onnx = SenseVoiceSmallONNX(onnx_dir, quantize=quantize, intra_op_num_threads=args.threads)
+        onnx(waveforms[0], 0, 14)
+        hyps, costs = [], []
+        for waveform in waveforms:
+            beg = time.perf_counter()
+            hyps.append(table.decode(onnx(waveform, 0, 14)[0]))
+            costs.append(time.perf_counter() - beg)
+        if baseline is None:
+            baseline = hyps
+        lat = summarize(costs)
+        print(
+            f"{name}\t{1000 * lat['p50']:.1f}\t{1000 * lat['p99']:.1f}\t{sum(costs) / audio_s:.4f}\t"
+            f"{error_rate(baseline, hyps, args.unit):.4f}\t{error_rate(refs, hyps, args.unit):.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Write throughput of the synchronous DatadirWriter vs AsyncResultWriter.
+
+Point `--output_dir` at the filesystem used in production (e.g. a network mount):
+
+    python -m benchmark.result_writer --output_dir /mnt/nfs/sensevoice_bench [--jsonl]
+"""
+
+import argparse
+import os
+import shutil
+import time
+
+from funasr.utils.datadir_writer import DatadirWriter
+
+from utils.result_writer import AsyncResultWriter
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark result writers")
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--num_results", type=int, default=20000)
+    parser.add_argument("--decode_ms", type=float, default=0.0, help="simulated decode time per result")
+    parser.add_argument("--fsync_interval", type=float, default=5.0)
+    parser.add_argument("--jsonl", action="store_true", help="also write result.jsonl with timestamps")
+    return parser.parse_args()
+
+
+def synthetic_results(n):
+    text = "<|zh|><|NEUTRAL|><|Speech|><|withitn|>欢迎大家来体验达摩院推出的语音识别模型。"
+    timestamp = [["▁欢迎", 0.03, 0.39], ["大家", 0.39, 0.63], ["来", 0.63, 0.75]]
+    return [{"key": f"utt_{i:08d}", "text": text, "timestamp": timestamp} for i in range(n)]
+
+
+def run_sync(output_dir, results, decode_ms):
+    writer = DatadirWriter(output_dir)
+    ibest_writer = writer["1best_recog"]
+    blocked = 0.0
+    beg = time.perf_counter()
+    for result in results:
+        time.sleep(decode_ms / 1000)
+        t = time.perf_counter()
+        ibest_writer["text"][result["key"]] = result["text"]
+        blocked += time.perf_counter() - t
+    writer.close()
+    return time.perf_counter() - beg, blocked
+
+
+def run_async(output_dir, results, decode_ms, fsync_interval, jsonl):
+    writer = AsyncResultWriter(output_dir, fsync_interval=fsync_interval, jsonl=jsonl)
+    blocked = 0.0
+    beg = time.perf_counter()
+    for result in results:
+        time.sleep(decode_ms / 1000)
+        t = time.perf_counter()
+        writer.write(result["key"], result)
+        blocked += time.perf_counter() - t
+    writer.close()
+    return time.perf_counter() - beg, blocked
+
+
+def main():
+    args = parse_args()
+    results = synthetic_results(args.num_results)
+
+    print("writer\ttotal_s\tblocked_s\tresults/s")
+    for name in ("sync", "async"):
+        output_dir = os.path.join(args.output_dir, name)
+        shutil.rmtree(output_dir, ignore_errors=True)
+        if name == "sync":
+            total, blocked = run_sync(output_dir, results, args.decode_ms)
+        else:
+            total, blocked = run_async(
+                output_dir, results, args.decode_ms, args.fsync_interval, args.jsonl
+            )
+        print(f"{name}\t{total:.3f}\t{blocked:.3f}\t{len(results) / total:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Training step time and prompt construction cost of SenseVoiceSmall.
+
+    python -m benchmark.train_step --device cuda:0 --batch 32
+"""
+
+import argparse
+
+import torch
+
+from benchmark.common import load_model, summarize, synthetic_batch, timeit
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="benchmark training step time")
+    parser.add_argument("--model_dir", type=str, default="iic/SenseVoiceSmall")
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=10)
+    return parser.parse_args()
+
+
+def rowwise_prompt_ids(model, text):
+    """The former per-row prompt builder, kept as the reference point."""
+    lids = torch.LongTensor([[model.lid_int_dict[int(lid)] if torch.rand(1) > 0.2 and int(lid) in model.lid_int_dict else 0] for lid in text[:, 0]])
+    styles = torch.LongTensor([[model.textnorm_int_dict[int(style)]] for style in text[:, 3]])
+    return lids.to(text.device), styles.to(text.device)
+
+
+def main():
+    args = parse_args()
+    model, _ = load_model(args.model_dir, args.device)
+    model.train()
+    speech, speech_lengths, text, text_lengths = synthetic_batch(
+        model, args.batch, args.frames, args.tokens, args.device
+    )
+    cuda = args.device.startswith("cuda")
+
+    def sync(result):
+        if cuda:
+            torch.cuda.synchronize(args.device)
+        return result
+
+    _, rowwise = timeit(lambda: sync(rowwise_prompt_ids(model, text)), repeat=args.repeat)
+    _, vectorized = timeit(lambda: sync(model._prompt_ids(text)), repeat=args.repeat)
+
+    def step():
+        loss, _, _ = model(speech.clone(), speech_lengths.clone(), text, text_lengths)
+        loss.backward()
+        model.zero_grad()
+        return sync(loss)
+
+    _, steps = timeit(step, repeat=args.repeat)
+
+    print(f"prompt ids, row-wise:   {summarize(rowwise)['p50'] * 1000:.3f} ms")
+    print(f"prompt ids, vectorized: {summarize(vectorized)['p50'] * 1000:.3f} ms")
+    print(f"train step (fwd+bwd):   {summarize(steps)['p50'] * 1000:.1f} ms, batch {args.batch}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Copyright FunASR (https://github.com/alibaba-damo-academy/FunASR). All Rights Reserved.
+#  MIT License  (https://opensource.org/licenses/MIT)
+
+# distill SenseVoiceSmall into a shallower student, same data/trainer flow as finetune.sh
+# usage: bash distill.sh [smoke]
+#   smoke: tiny 2-block student, 1 epoch on CPU (gloo backend), to check the recipe end to end
+
+workspace=`pwd`
+
+# which gpu to train or finetune
+export CUDA_VISIBLE_DEVICES="0,1"
+gpu_num=$(echo $CUDA_VISIBLE_DEVICES | awk -F "," '{print NF}')
+
+# teacher, and the model dir the student config/tokenizer/init weights come from;
+# student layers are initialized from the first layers of the teacher checkpoint
+teacher_model="iic/SenseVoiceSmall"
+model_name_or_model_dir="iic/SenseVoiceSmall"
+
+# student depth
+num_blocks=12
+tp_blocks=20
+
+# distillation weights
+kd_weight=1.0
+rich_kd_weight=1.0
+temperature=2.0
+
+# data dir, which contains: train.json, val.json
+train_data=${workspace}/data/train_example.jsonl
+val_data=${workspace}/data/val_example.jsonl
+
+# exp output dir
+output_dir="./outputs_distill"
+
+batch_size=6000
+max_epoch=50
+device_args=""
+if [ "$1" == "smoke" ]; then
+    export CUDA_VISIBLE_DEVICES=""
+    gpu_num=1
+    num_blocks=2
+    tp_blocks=1
+    batch_size=500
+    max_epoch=1
+    output_dir="./outputs_distill_smoke"
+    # torchrun defaults to NCCL, which needs GPUs
+    device_args="++device=cpu ++backend=gloo"
+fi
+log_file="${output_dir}/log.txt"
+
+deepspeed_config=${workspace}/deepspeed_conf/ds_stage1.json
+
+mkdir -p ${output_dir}
+echo "log_file: ${log_file}"
+
+DISTRIBUTED_ARGS="
+    --nnodes ${WORLD_SIZE:-1} \
+    --nproc_per_node $gpu_num \
+    --node_rank ${RANK:-0} \
+    --master_addr ${MASTER_ADDR:-127.0.0.1} \
+    --master_port ${MASTER_PORT:-26669}
+"
+
+echo $DISTRIBUTED_ARGS
+
+# funasr trainer path
+train_tool=`dirname $(which funasr)`/train_ds.py
+
+torchrun $DISTRIBUTED_ARGS \
+${train_tool} \
+++model="${model_name_or_model_dir}" \
+++trust_remote_code=true \
+++remote_code="${workspace}/model.py" \
+++encoder_conf.num_blocks=${num_blocks} \
+++encoder_conf.tp_blocks=${tp_blocks} \
+++distill_conf.teacher="${teacher_model}" \
+++distill_conf.kd_weight=${kd_weight} \
+++distill_conf.rich_kd_weight=${rich_kd_weight} \
+++distill_conf.temperature=${temperature} \
+++train_data_set_list="${train_data}" \
+++valid_data_set_list="${val_data}" \
+++dataset_conf.data_split_num=1 \
+++dataset_conf.batch_sampler="BatchSampler" \
+++dataset_conf.batch_size=${batch_size}  \
+++dataset_conf.sort_size=1024 \
+++dataset_conf.batch_type="token" \
+++dataset_conf.num_workers=4 \
+++train_conf.max_epoch=${max_epoch} \
+++train_conf.log_interval=1 \
+++train_conf.resume=true \
+++train_conf.validate_interval=2000 \
+++train_conf.save_checkpoint_interval=2000 \
+++train_conf.keep_nbest_models=20 \
+++train_conf.avg_nbest_model=10 \
+++train_conf.use_deepspeed=false \
+++train_conf.deepspeed_config=${deepspeed_config} \
+++optim_conf.lr=0.0002 \
+${device_args} \
+++output_dir="${output_dir}" &> ${log_file}
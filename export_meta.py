@@ -6,10 +6,17 @@
 import types
 import torch
 from funasr.utils.torch_function import sequence_mask
+from utils.lora import merge_lora
 
 
 def export_rebuild_model(model, **kwargs):
+    # LoRA adapters are folded into the base weights before tracing
+    merge_lora(model)
     model.device = kwargs.get("device")
+    # ctc_argmax: return int32 ids + max-probabilities instead of (B, T, vocab) logits,
+    # ctc_rich_logits: also the logits of the 4 rich-tag positions
+    model.export_ctc_argmax = kwargs.get("ctc_argmax", False)
+    model.export_ctc_rich_logits = kwargs.get("ctc_rich_logits", False)
     model.make_pad_mask = sequence_mask(kwargs["max_seq_len"], flip=False)
     model.forward = types.MethodType(export_forward, model)
     model.export_dummy_inputs = types.MethodType(export_dummy_inputs, model)
@@ -47,8 +54,15 @@ def export_forward(
         encoder_out = encoder_out[0]
 
     ctc_logits = self.ctc.ctc_lo(encoder_out)
-    
-    return ctc_logits, encoder_out_lens
+    if not self.export_ctc_argmax:
+        return ctc_logits, encoder_out_lens
+
+    max_logits, ctc_ids = ctc_logits.max(dim=-1)
+    ctc_max_prob = torch.exp(max_logits - torch.logsumexp(ctc_logits, dim=-1))
+    outputs = (ctc_ids.int(), ctc_max_prob, encoder_out_lens)
+    if self.export_ctc_rich_logits:
+        outputs += (ctc_logits[:, :4, :],)
+    return outputs
 
 def export_dummy_inputs(self):
     speech = torch.randn(2, 30, 560)
@@ -61,18 +75,142 @@ def export_input_names(self):
     return ["speech", "speech_lengths", "language", "textnorm"]
 
 def export_output_names(self):
-    return ["ctc_logits", "encoder_out_lens"]
+    if not self.export_ctc_argmax:
+        return ["ctc_logits", "encoder_out_lens"]
+    names = ["ctc_ids", "ctc_max_prob", "encoder_out_lens"]
+    if self.export_ctc_rich_logits:
+        names.append("rich_logits")
+    return names
 
 def export_dynamic_axes(self):
-    return {
+    names = set(self.export_input_names() + self.export_output_names())
+    axes = {
         "speech": {0: "batch_size", 1: "feats_length"},
         "speech_lengths": {0: "batch_size"},
         "language": {0: "batch_size"},
         "textnorm": {0: "batch_size"},
         "ctc_logits": {0: "batch_size", 1: "logits_length"},
+        "ctc_ids": {0: "batch_size", 1: "logits_length"},
+        "ctc_max_prob": {0: "batch_size", 1: "logits_length"},
+        "rich_logits": {0: "batch_size"},
         "encoder_out_lens":  {0: "batch_size"},
     }
+    return {k: v for k, v in axes.items() if k in names}
 
 def export_name(self):
     return "model.onnx"
 
+
+
+class StreamingExportModel(torch.nn.Module):
+    """Chunk-by-chunk SenseVoice encoder + CTC head for ONNX export.
+
+    Every call takes `chunk_size` lfr frames, of which the first `num_frames`
+    are audio (the rest pads a final partial chunk and is masked), re-encodes
+    the four prompt frames in front of them and returns the CTC logits of
+    prompts + chunk.
+    Each encoder layer keeps the keys/values of the last `look_back`
+    chunks and the last `kernel_size - 1` fsmn inputs as explicit inputs and
+    outputs of fixed shape, so every call costs the same.
+    """
+
+    def __init__(self, model, chunk_size: int = 16, look_back: int = 4):
+        super().__init__()
+        self.model = model
+        self.chunk_size = chunk_size
+        self.capacity = chunk_size * look_back
+        encoder = model.encoder
+        self.layers = list(encoder.encoders0) + list(encoder.encoders) + list(encoder.tp_encoders)
+        self.num_encoders = len(encoder.encoders0) + len(encoder.encoders)
+
+    def export(self, **kwargs):
+        return self
+
+    def forward(self, speech_chunk, language, textnorm, offset, num_frames, cache_len, *caches):
+        model, encoder = self.model, self.model.encoder
+        b = speech_chunk.size(0)
+        prompts = torch.cat(
+            (
+                model.embed(language.long()).unsqueeze(1),
+                model.embed(torch.LongTensor([[1, 2]]).to(speech_chunk.device)).repeat(b, 1, 1),
+                model.embed(textnorm.long()).unsqueeze(1),
+            ),
+            dim=1,
+        )
+        x = torch.cat((prompts, speech_chunk), dim=1) * encoder.output_size() ** 0.5
+        # prompts sit at positions 1..4 and audio frames continue after them
+        positions = torch.cat(
+            (
+                torch.arange(1, 5, device=x.device),
+                offset.long().reshape(1) + 5 + torch.arange(self.chunk_size, device=x.device),
+            )
+        )[None, :]
+        x = x + encoder.embed.encode(positions, x.size(-1), x.dtype)
+
+        slots = torch.arange(self.capacity, device=x.device)[None, :]
+        cache_mask = (slots >= self.capacity - cache_len.long().reshape(-1, 1)).to(x.dtype)
+        frames = torch.arange(self.chunk_size, device=x.device)[None, :]
+        chunk_mask = (frames < num_frames.long().reshape(-1, 1)).to(x.dtype)
+        new_caches = []
+        for i, layer in enumerate(self.layers):
+            if i == self.num_encoders:
+                x = encoder.after_norm(x)
+            x, *layer_caches = layer.forward_stream(
+                x, 4, *caches[3 * i : 3 * i + 3], cache_mask, chunk_mask
+            )
+            new_caches.extend(layer_caches)
+        x = encoder.tp_norm(x)
+
+        ctc_logits = model.ctc.ctc_lo(x)
+        new_cache_len = torch.clamp(cache_len + num_frames, max=self.capacity)
+        return (ctc_logits, new_cache_len, *new_caches)
+
+    def cache_shapes(self, batch_size: int = 1):
+        shapes = []
+        for layer in self.layers:
+            attn = layer.self_attn
+            kernel = attn.fsmn_block.kernel_size[0]
+            shapes += [
+                (batch_size, attn.h, self.capacity, attn.d_k),
+                (batch_size, attn.h, self.capacity, attn.d_k),
+                (batch_size, attn.n_feat, kernel - 1),
+            ]
+        return shapes
+
+    def cache_names(self, prefix: str = ""):
+        return [
+            f"{prefix}cache_{kind}_{i}" for i in range(len(self.layers)) for kind in ("k", "v", "fsmn")
+        ]
+
+    def export_dummy_inputs(self):
+        speech_chunk = torch.randn(1, self.chunk_size, 560)
+        language = torch.tensor([0], dtype=torch.int32)
+        textnorm = torch.tensor([15], dtype=torch.int32)
+        offset = torch.tensor([0], dtype=torch.int32)
+        num_frames = torch.tensor([self.chunk_size], dtype=torch.int32)
+        cache_len = torch.tensor([0], dtype=torch.int32)
+        caches = [torch.zeros(shape) for shape in self.cache_shapes()]
+        return (speech_chunk, language, textnorm, offset, num_frames, cache_len, *caches)
+
+    def export_input_names(self):
+        names = ["speech_chunk", "language", "textnorm", "offset", "num_frames", "cache_len"]
+        return names + self.cache_names()
+
+    def export_output_names(self):
+        return ["ctc_logits", "new_cache_len"] + self.cache_names("new_")
+
+    def export_dynamic_axes(self):
+        names = ["speech_chunk", "language", "textnorm", "num_frames", "cache_len", "ctc_logits", "new_cache_len"]
+        names += self.cache_names() + self.cache_names("new_")
+        return {name: {0: "batch_size"} for name in names}
+
+    def export_name(self):
+        return "model_streaming.onnx"
+
+
+def export_rebuild_streaming_model(model, **kwargs):
+    merge_lora(model)
+    model.eval()
+    return StreamingExportModel(
+        model, chunk_size=kwargs.get("chunk_size", 16), look_back=kwargs.get("look_back", 4)
+    )
@@ -29,6 +29,16 @@ log_file="${output_dir}/log.txt"
 
 deepspeed_config=${workspace}/deepspeed_conf/ds_stage1.json
 
+# LoRA adapters on the attention projections instead of a full finetune,
+# the base weights are frozen; save the adapter with utils.lora.save_adapter
+#lora_args="++encoder_conf.lora_list=[q,k,v,o] ++encoder_conf.lora_rank=8 ++encoder_conf.lora_alpha=16"
+lora_args=""
+
+# activation checkpointing of every k-th encoder layer ("layer") or only of
+# the self-attention ("attention"), for larger token batches in the same memory
+#checkpoint_args="++encoder_conf.checkpoint_every=2 ++encoder_conf.checkpoint_mode=layer"
+checkpoint_args=""
+
 mkdir -p ${output_dir}
 echo "log_file: ${log_file}"
 
@@ -67,4 +77,6 @@ ${train_tool} \
 ++train_conf.use_deepspeed=false \
 ++train_conf.deepspeed_config=${deepspeed_config} \
 ++optim_conf.lr=0.0002 \
+${lora_args} \
+${checkpoint_args} \
 ++output_dir="${output_dir}" &> ${log_file}
\ No newline at end of file
@@ -1,8 +1,10 @@
 
 import time
+import logging
 import torch
 from torch import nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 from typing import Iterable, Optional
 
 from funasr.register import tables
@@ -13,7 +15,10 @@ from funasr.train_utils.device_funcs import force_gatherable
 from funasr.losses.label_smoothing_loss import LabelSmoothingLoss
 from funasr.metrics.compute_acc import compute_accuracy, th_accuracy
 from funasr.utils.load_utils import load_audio_text_image_video, extract_fbank
-from utils.ctc_alignment import ctc_forced_align
+from utils.cascade import ctc_confidence
+from utils.ctc_alignment import ctc_align_emissions
+from utils.ctc_vocab import LANGUAGE_SCRIPTS, LanguageVocab, PieceTable, load_sentencepiece, piece_scripts
+from utils.result_writer import AsyncResultWriter
 
 class SinusoidalPositionEncoder(torch.nn.Module):
     """ """
@@ -71,6 +76,44 @@ class PositionwiseFeedForward(torch.nn.Module):
         return self.w_2(self.dropout(self.activation(self.w_1(x))))
 
 
+class LoRALinear(nn.Linear):
+    """Linear layer with a low-rank adapter: y = x W^T + b + (alpha / r) * x A^T B^T.
+
+    The base `weight`/`bias` keep their names, so checkpoints without adapters
+    load unchanged. `merge` folds the adapter into `weight` so inference runs
+    a plain linear layer; `unmerge` restores the base weight.
+    """
+
+    def __init__(self, in_features, out_features, r=8, lora_alpha=16, lora_dropout=0.1, bias=True):
+        super().__init__(in_features, out_features, bias=bias)
+        self.r = r
+        self.scaling = lora_alpha / r
+        self.lora_A = nn.Parameter(torch.zeros(r, in_features))
+        self.lora_B = nn.Parameter(torch.zeros(out_features, r))
+        self.lora_dropout = nn.Dropout(p=lora_dropout) if lora_dropout > 0 else nn.Identity()
+        self.merged = False
+        nn.init.kaiming_uniform_(self.lora_A, a=5**0.5)
+
+    def delta_weight(self):
+        return (self.lora_B @ self.lora_A) * self.scaling
+
+    def merge(self):
+        if not self.merged:
+            self.weight.data += self.delta_weight().to(self.weight.dtype)
+            self.merged = True
+
+    def unmerge(self):
+        if self.merged:
+            self.weight.data -= self.delta_weight().to(self.weight.dtype)
+            self.merged = False
+
+    def forward(self, x):
+        out = F.linear(x, self.weight, self.bias)
+        if self.merged:
+            return out
+        return out + (self.lora_dropout(x) @ self.lora_A.t() @ self.lora_B.t()) * self.scaling
+
+
 class MultiHeadedAttentionSANM(nn.Module):
     """Multi-Head Attention layer.
 
@@ -93,19 +136,38 @@ class MultiHeadedAttentionSANM(nn.Module):
         lora_rank=8,
         lora_alpha=16,
         lora_dropout=0.1,
+        n_head_kept=None,
     ):
         """Construct an MultiHeadedAttention object."""
         super().__init__()
         assert n_feat % n_head == 0
         # We assume d_v always equals d_k
         self.d_k = n_feat // n_head
-        self.h = n_head
+        self.h = n_head if n_head_kept is None else n_head_kept
+        self.n_feat = n_feat
         # self.linear_q = nn.Linear(n_feat, n_feat)
         # self.linear_k = nn.Linear(n_feat, n_feat)
         # self.linear_v = nn.Linear(n_feat, n_feat)
 
-        self.linear_out = nn.Linear(n_feat, n_feat)
-        self.linear_q_k_v = nn.Linear(in_feat, n_feat * 3)
+        # after head pruning v keeps all n_feat channels for the fsmn memory,
+        # and v_index selects the channels of the kept heads for attention
+        if self.h != n_head:
+            self.register_buffer("v_index", torch.arange(self.h * self.d_k))
+        else:
+            self.register_buffer("v_index", None)
+
+        # lora_list names the adapted projections: "q", "k", "v" (or "qkv") adapt
+        # the fused linear_q_k_v, "o" adapts linear_out
+        lora_list = lora_list or []
+        lora_args = dict(r=lora_rank, lora_alpha=lora_alpha, lora_dropout=lora_dropout)
+        if "o" in lora_list:
+            self.linear_out = LoRALinear(self.h * self.d_k, n_feat, **lora_args)
+        else:
+            self.linear_out = nn.Linear(self.h * self.d_k, n_feat)
+        if any(i in lora_list for i in ("q", "k", "v", "qkv")):
+            self.linear_q_k_v = LoRALinear(in_feat, self.h * self.d_k * 2 + n_feat, **lora_args)
+        else:
+            self.linear_q_k_v = nn.Linear(in_feat, self.h * self.d_k * 2 + n_feat)
         self.attn = None
         self.dropout = nn.Dropout(p=dropout_rate)
 
@@ -153,14 +215,17 @@ class MultiHeadedAttentionSANM(nn.Module):
         """
         b, t, d = x.size()
         q_k_v = self.linear_q_k_v(x)
-        q, k, v = torch.split(q_k_v, int(self.h * self.d_k), dim=-1)
+        q, k, v = torch.split(
+            q_k_v, [int(self.h * self.d_k), int(self.h * self.d_k), self.n_feat], dim=-1
+        )
+        v_att = v if self.v_index is None else v.index_select(-1, self.v_index)
         q_h = torch.reshape(q, (b, t, self.h, self.d_k)).transpose(
             1, 2
         )  # (batch, head, time1, d_k)
         k_h = torch.reshape(k, (b, t, self.h, self.d_k)).transpose(
             1, 2
         )  # (batch, head, time2, d_k)
-        v_h = torch.reshape(v, (b, t, self.h, self.d_k)).transpose(
+        v_h = torch.reshape(v_att, (b, t, self.h, self.d_k)).transpose(
             1, 2
         )  # (batch, head, time2, d_k)
 
@@ -264,6 +329,56 @@ class MultiHeadedAttentionSANM(nn.Module):
         att_outs = self.forward_attention(v_h, scores, None)
         return att_outs + fsmn_memory, cache
 
+    @staticmethod
+    def _stream_window(seq, start, size):
+        """seq[b, :, start[b] : start[b] + size] along dim 2, as an exportable gather."""
+        index = start.long().reshape(-1, 1) + torch.arange(size, device=seq.device)
+        index = index.reshape([seq.size(0), 1, size] + [1] * (seq.dim() - 3))
+        return torch.gather(seq, 2, index.expand(*seq.shape[:2], size, *seq.shape[3:]))
+
+    def forward_stream(self, x, n_prompt, cache_k, cache_v, cache_fsmn, cache_mask, chunk_mask):
+        """`forward_chunk` with fixed-capacity tensor caches, for graph export.
+
+        Args:
+            x (torch.Tensor): `n_prompt` prompt frames followed by the chunk (#batch, time, size).
+            cache_k, cache_v (torch.Tensor): keys/values of the last audio frames
+                (#batch, head, capacity, d_k), left-aligned padding is masked by `cache_mask`.
+            cache_fsmn (torch.Tensor): last `kernel_size - 1` v frames (#batch, n_feat, kernel_size - 1).
+            cache_mask (torch.Tensor): 1 for the valid cache entries (#batch, capacity).
+            chunk_mask (torch.Tensor): 1 for the valid chunk frames, a prefix of the
+                chunk; the padding of a final partial chunk is 0 (#batch, chunk).
+
+        Returns:
+            torch.Tensor: Output tensor (#batch, time, d_model) and the three updated caches.
+        """
+        q_h, k_h, v_h, v = self.forward_qkv(x)
+        capacity, chunk = cache_k.size(2), x.size(1) - n_prompt
+        num_valid = chunk_mask.sum(dim=1)
+
+        # prompts use the plain fsmn, audio frames continue the history; padded
+        # frames are zeroed, so like the right context of the last frames of a
+        # chunk they look like an utterance end
+        fsmn_prompt = self.forward_fsmn(v[:, :n_prompt], None)
+        v_audio = v[:, n_prompt:] * chunk_mask.unsqueeze(-1)
+        history = torch.cat((cache_fsmn, v_audio.transpose(1, 2)), dim=2)
+        right = self.pad_fn.padding[1]
+        fsmn_audio = self.fsmn_block(F.pad(history, (0, right)))[:, :, right : right + chunk]
+        fsmn_audio = fsmn_audio.transpose(1, 2) + v_audio
+
+        k_all = torch.cat((cache_k, k_h), dim=2)
+        v_all = torch.cat((cache_v, v_h), dim=2)
+        mask = torch.cat(
+            (cache_mask, cache_mask.new_ones((x.size(0), n_prompt)), chunk_mask), dim=1
+        )
+        scores = torch.matmul(q_h * self.d_k ** (-0.5), k_all.transpose(-2, -1))
+        att_outs = self.forward_attention(v_all, scores, mask.unsqueeze(1))
+
+        # the caches end at the last valid frame, padded frames never enter them
+        new_k = self._stream_window(torch.cat((cache_k, k_h[:, :, n_prompt:]), dim=2), num_valid, capacity)
+        new_v = self._stream_window(torch.cat((cache_v, v_h[:, :, n_prompt:]), dim=2), num_valid, capacity)
+        new_fsmn = self._stream_window(history, num_valid, cache_fsmn.size(2))
+        return att_outs + torch.cat((fsmn_prompt, fsmn_audio), dim=1), new_k, new_v, new_fsmn
+
 
 class LayerNorm(nn.LayerNorm):
     def __init__(self, *args, **kwargs):
@@ -318,6 +433,17 @@ class EncoderLayerSANM(nn.Module):
             self.concat_linear = nn.Linear(size + size, size)
         self.stochastic_depth_rate = stochastic_depth_rate
         self.dropout_rate = dropout_rate
+        self.checkpoint_attn = False
+
+    def forward_attn(self, x, mask, mask_shfit_chunk=None, mask_att_chunk_encoder=None):
+        """Self-attention, recomputed in backward instead of stored when checkpoint_attn is set."""
+        if self.checkpoint_attn and self.training and torch.is_grad_enabled():
+            return checkpoint(
+                self.self_attn, x, mask, mask_shfit_chunk, mask_att_chunk_encoder, use_reentrant=False
+            )
+        return self.self_attn(
+            x, mask, mask_shfit_chunk=mask_shfit_chunk, mask_att_chunk_encoder=mask_att_chunk_encoder
+        )
 
     def forward(self, x, mask, cache=None, mask_shfit_chunk=None, mask_att_chunk_encoder=None):
         """Compute encoded features.
@@ -353,7 +479,7 @@ class EncoderLayerSANM(nn.Module):
             x_concat = torch.cat(
                 (
                     x,
-                    self.self_attn(
+                    self.forward_attn(
                         x,
                         mask,
                         mask_shfit_chunk=mask_shfit_chunk,
@@ -369,7 +495,7 @@ class EncoderLayerSANM(nn.Module):
         else:
             if self.in_size == self.size:
                 x = residual + stoch_layer_coeff * self.dropout(
-                    self.self_attn(
+                    self.forward_attn(
                         x,
                         mask,
                         mask_shfit_chunk=mask_shfit_chunk,
@@ -378,7 +504,7 @@ class EncoderLayerSANM(nn.Module):
                 )
             else:
                 x = stoch_layer_coeff * self.dropout(
-                    self.self_attn(
+                    self.forward_attn(
                         x,
                         mask,
                         mask_shfit_chunk=mask_shfit_chunk,
@@ -433,6 +559,29 @@ class EncoderLayerSANM(nn.Module):
 
         return x, cache
 
+    def forward_stream(self, x, n_prompt, cache_k, cache_v, cache_fsmn, cache_mask, chunk_mask):
+        """`forward_chunk` with the fixed-capacity caches of `MultiHeadedAttentionSANM.forward_stream`."""
+        residual = x
+        if self.normalize_before:
+            x = self.norm1(x)
+
+        attn, cache_k, cache_v, cache_fsmn = self.self_attn.forward_stream(
+            x, n_prompt, cache_k, cache_v, cache_fsmn, cache_mask, chunk_mask
+        )
+        x = residual + attn if self.in_size == self.size else attn
+
+        if not self.normalize_before:
+            x = self.norm1(x)
+
+        residual = x
+        if self.normalize_before:
+            x = self.norm2(x)
+        x = residual + self.feed_forward(x)
+        if not self.normalize_before:
+            x = self.norm2(x)
+
+        return x, cache_k, cache_v, cache_fsmn
+
 
 @tables.register("encoder_classes", "SenseVoiceEncoderSmall")
 class SenseVoiceEncoderSmall(nn.Module):
@@ -464,6 +613,14 @@ class SenseVoiceEncoderSmall(nn.Module):
         kernel_size: int = 11,
         sanm_shfit: int = 0,
         selfattention_layer_type: str = "sanm",
+        attention_heads_list: Optional[list] = None,
+        linear_units_list: Optional[list] = None,
+        lora_list: Optional[list] = None,
+        lora_rank: int = 8,
+        lora_alpha: int = 16,
+        lora_dropout: float = 0.1,
+        checkpoint_every: int = 0,
+        checkpoint_mode: str = "layer",
         **kwargs,
     ):
         super().__init__()
@@ -473,38 +630,58 @@ class SenseVoiceEncoderSmall(nn.Module):
 
         self.normalize_before = normalize_before
 
+        # per-layer kept heads / hidden units of a structurally pruned model,
+        # in the order encoders0, encoders, tp_encoders
+        if attention_heads_list is None:
+            attention_heads_list = [attention_heads] * (num_blocks + tp_blocks)
+        if linear_units_list is None:
+            linear_units_list = [linear_units] * (num_blocks + tp_blocks)
+        assert len(attention_heads_list) == len(linear_units_list) == num_blocks + tp_blocks
+
         positionwise_layer = PositionwiseFeedForward
-        positionwise_layer_args = (
-            output_size,
-            linear_units,
-            dropout_rate,
-        )
+
+        def positionwise_layer_args(i):
+            return (
+                output_size,
+                linear_units_list[i],
+                dropout_rate,
+            )
 
         encoder_selfattn_layer = MultiHeadedAttentionSANM
-        encoder_selfattn_layer_args0 = (
-            attention_heads,
-            input_size,
-            output_size,
-            attention_dropout_rate,
-            kernel_size,
-            sanm_shfit,
-        )
-        encoder_selfattn_layer_args = (
-            attention_heads,
-            output_size,
-            output_size,
-            attention_dropout_rate,
-            kernel_size,
-            sanm_shfit,
-        )
+
+        def encoder_selfattn_layer_args(i, in_size):
+            return (
+                attention_heads,
+                in_size,
+                output_size,
+                attention_dropout_rate,
+                kernel_size,
+                sanm_shfit,
+            )
+
+        def encoder_selfattn_layer_kwargs(i):
+            layer_kwargs = {}
+            if lora_list:
+                layer_kwargs.update(
+                    lora_list=lora_list,
+                    lora_rank=lora_rank,
+                    lora_alpha=lora_alpha,
+                    lora_dropout=lora_dropout,
+                )
+            if attention_heads_list[i] != attention_heads:
+                layer_kwargs["n_head_kept"] = attention_heads_list[i]
+            return layer_kwargs
 
         self.encoders0 = nn.ModuleList(
             [
                 EncoderLayerSANM(
                     input_size,
                     output_size,
-                    encoder_selfattn_layer(*encoder_selfattn_layer_args0),
-                    positionwise_layer(*positionwise_layer_args),
+                    encoder_selfattn_layer(
+                        *encoder_selfattn_layer_args(i, input_size),
+                        **encoder_selfattn_layer_kwargs(i),
+                    ),
+                    positionwise_layer(*positionwise_layer_args(i)),
                     dropout_rate,
                 )
                 for i in range(1)
@@ -515,11 +692,14 @@ class SenseVoiceEncoderSmall(nn.Module):
                 EncoderLayerSANM(
                     output_size,
                     output_size,
-                    encoder_selfattn_layer(*encoder_selfattn_layer_args),
-                    positionwise_layer(*positionwise_layer_args),
+                    encoder_selfattn_layer(
+                        *encoder_selfattn_layer_args(i, output_size),
+                        **encoder_selfattn_layer_kwargs(i),
+                    ),
+                    positionwise_layer(*positionwise_layer_args(i)),
                     dropout_rate,
                 )
-                for i in range(num_blocks - 1)
+                for i in range(1, num_blocks)
             ]
         )
 
@@ -528,11 +708,14 @@ class SenseVoiceEncoderSmall(nn.Module):
                 EncoderLayerSANM(
                     output_size,
                     output_size,
-                    encoder_selfattn_layer(*encoder_selfattn_layer_args),
-                    positionwise_layer(*positionwise_layer_args),
+                    encoder_selfattn_layer(
+                        *encoder_selfattn_layer_args(i, output_size),
+                        **encoder_selfattn_layer_kwargs(i),
+                    ),
+                    positionwise_layer(*positionwise_layer_args(i)),
                     dropout_rate,
                 )
-                for i in range(tp_blocks)
+                for i in range(num_blocks, num_blocks + tp_blocks)
             ]
         )
 
@@ -540,9 +723,37 @@ class SenseVoiceEncoderSmall(nn.Module):
 
         self.tp_norm = LayerNorm(output_size)
 
+        self.set_checkpointing(checkpoint_every, checkpoint_mode)
+
     def output_size(self) -> int:
         return self._output_size
 
+    def set_checkpointing(self, every: int = 0, mode: str = "layer"):
+        """Activation checkpointing for training.
+
+        Args:
+            every (int): checkpoint every `every`-th layer, 0 disables checkpointing.
+            mode (str): "layer" recomputes whole EncoderLayerSANM blocks,
+                "attention" recomputes only the self-attention (and its T x T maps).
+        """
+        assert mode in ("layer", "attention"), f"unknown checkpoint_mode: {mode}"
+        self.checkpoint_every = every
+        self.checkpoint_mode = mode
+        layers = list(self.encoders0) + list(self.encoders) + list(self.tp_encoders)
+        for idx, layer in enumerate(layers):
+            layer.checkpoint_attn = mode == "attention" and every > 0 and idx % every == 0
+
+    def _forward_layer(self, idx, encoder_layer, xs_pad, masks):
+        if (
+            self.checkpoint_mode == "layer"
+            and self.checkpoint_every > 0
+            and idx % self.checkpoint_every == 0
+            and self.training
+            and torch.is_grad_enabled()
+        ):
+            return checkpoint(encoder_layer, xs_pad, masks, use_reentrant=False)
+        return encoder_layer(xs_pad, masks)
+
     def forward(
         self,
         xs_pad: torch.Tensor,
@@ -556,12 +767,14 @@ class SenseVoiceEncoderSmall(nn.Module):
         xs_pad = self.embed(xs_pad)
 
         # forward encoder1
+        offset = 0
         for layer_idx, encoder_layer in enumerate(self.encoders0):
-            encoder_outs = encoder_layer(xs_pad, masks)
+            encoder_outs = self._forward_layer(offset + layer_idx, encoder_layer, xs_pad, masks)
             xs_pad, masks = encoder_outs[0], encoder_outs[1]
 
+        offset += len(self.encoders0)
         for layer_idx, encoder_layer in enumerate(self.encoders):
-            encoder_outs = encoder_layer(xs_pad, masks)
+            encoder_outs = self._forward_layer(offset + layer_idx, encoder_layer, xs_pad, masks)
             xs_pad, masks = encoder_outs[0], encoder_outs[1]
 
         xs_pad = self.after_norm(xs_pad)
@@ -569,8 +782,9 @@ class SenseVoiceEncoderSmall(nn.Module):
         # forward encoder2
         olens = masks.squeeze(1).sum(1).int()
 
+        offset += len(self.encoders)
         for layer_idx, encoder_layer in enumerate(self.tp_encoders):
-            encoder_outs = encoder_layer(xs_pad, masks)
+            encoder_outs = self._forward_layer(offset + layer_idx, encoder_layer, xs_pad, masks)
             xs_pad, masks = encoder_outs[0], encoder_outs[1]
 
         xs_pad = self.tp_norm(xs_pad)
@@ -637,6 +851,14 @@ class SenseVoiceSmall(nn.Module):
         self.textnorm_int_dict = {25016: 14, 25017: 15}
         self.embed = torch.nn.Embedding(7 + len(self.lid_dict) + len(self.textnorm_dict), input_size)
         self.emo_dict = {"unk": 25009, "happy": 25001, "sad": 25002, "angry": 25003, "neutral": 25004}
+        # token id -> embed id lookup tables for building prompts on device,
+        # the last entry is the fallback for ids outside the tables
+        self.register_buffer("lid_lut", self._prompt_lut(self.lid_int_dict, 0), persistent=False)
+        self.register_buffer(
+            "textnorm_lut",
+            self._prompt_lut(self.textnorm_int_dict, self.textnorm_dict["woitn"]),
+            persistent=False,
+        )
         
         self.criterion_att = LabelSmoothingLoss(
             size=self.vocab_size,
@@ -644,6 +866,20 @@ class SenseVoiceSmall(nn.Module):
             smoothing=kwargs.get("lsm_weight", 0.0),
             normalize_length=self.length_normalized_loss,
         )
+
+        # knowledge distillation from a deeper teacher, e.g.
+        # distill_conf: {teacher: iic/SenseVoiceSmall, kd_weight: 1.0, rich_kd_weight: 1.0, temperature: 1.0}
+        # the teacher is loaded here, once per rank and before the trainer wraps
+        # the model in DDP, unless `preload: false`; it is not part of the state_dict
+        self.distill_conf = kwargs.get("distill_conf", None)
+        self._teacher = []
+        if self.distill_conf is not None and self.distill_conf.get("preload", True):
+            self.teacher(device="cpu")
+
+        # with LoRA adapters in encoder_conf, only the adapters are trained by default
+        if encoder_conf.get("lora_list") and encoder_conf.get("lora_freeze_base", True):
+            for name, p in self.named_parameters():
+                p.requires_grad = "lora_" in name
     
     @staticmethod
     def from_pretrained(model:str=None, **kwargs):
@@ -677,21 +913,51 @@ class SenseVoiceSmall(nn.Module):
         batch_size = speech.shape[0]
 
         # 1. Encoder
-        encoder_out, encoder_out_lens = self.encode(speech, speech_lengths, text)
+        prompt_ids = self._prompt_ids(text)
+        teacher_speech, teacher_speech_lengths = speech, speech_lengths.clone()
+        encoder_out, encoder_out_lens = self.encode(
+            speech, speech_lengths, text, prompt_ids=prompt_ids
+        )
 
         loss_ctc, cer_ctc = None, None
         loss_rich, acc_rich = None, None
         stats = dict()
 
+        # ctc_lo is projected once per position: the rich-tag positions without
+        # dropout, the CTC positions with dropout in training only; the
+        # undropped logits of all positions are reused by the distillation loss
+        rich_logits = self.ctc.ctc_lo(encoder_out[:, :4, :])
+        ctc_dropout = self.training and self.ctc.dropout_rate > 0
+        ctc_logits = self.ctc.ctc_lo(
+            F.dropout(encoder_out[:, 4:, :], p=self.ctc.dropout_rate, training=ctc_dropout)
+        )
+
         loss_ctc, cer_ctc = self._calc_ctc_loss(
-            encoder_out[:, 4:, :], encoder_out_lens - 4, text[:, 4:], text_lengths - 4
+            encoder_out[:, 4:, :], encoder_out_lens - 4, text[:, 4:], text_lengths - 4,
+            ys_hat=ctc_logits,
         )
 
         loss_rich, acc_rich = self._calc_rich_ce_loss(
-            encoder_out[:, :4, :], text[:, :4]
+            encoder_out[:, :4, :], text[:, :4], decoder_out=rich_logits
         )
 
         loss = loss_ctc + loss_rich
+
+        if self.training and self.distill_conf is not None:
+            if ctc_dropout:
+                ctc_logits = self.ctc.ctc_lo(encoder_out[:, 4:, :])
+            loss_kd, loss_rich_kd = self._calc_distill_loss(
+                torch.cat((rich_logits, ctc_logits), dim=1), encoder_out_lens, teacher_speech, teacher_speech_lengths, text, prompt_ids
+            )
+            loss = (
+                self.distill_conf.get("ctc_weight", 1.0) * loss_ctc
+                + loss_rich
+                + self.distill_conf.get("kd_weight", 1.0) * loss_kd
+                + self.distill_conf.get("rich_kd_weight", 1.0) * loss_rich_kd
+            )
+            stats["loss_kd"] = torch.clone(loss_kd.detach())
+            stats["loss_rich_kd"] = torch.clone(loss_rich_kd.detach())
+
         # Collect total loss stats
         stats["loss_ctc"] = torch.clone(loss_ctc.detach()) if loss_ctc is not None else None
         stats["loss_rich"] = torch.clone(loss_rich.detach()) if loss_rich is not None else None
@@ -704,18 +970,89 @@ class SenseVoiceSmall(nn.Module):
         loss, stats, weight = force_gatherable((loss, stats, batch_size), loss.device)
         return loss, stats, weight
 
+    def teacher(self, device=None):
+        """Frozen teacher model of distill_conf on `device`, loaded if not preloaded."""
+        if not self._teacher:
+            teacher, _ = SenseVoiceSmall.from_pretrained(
+                model=self.distill_conf["teacher"], device=str(device)
+            )
+            teacher.eval()
+            for p in teacher.parameters():
+                p.requires_grad = False
+            self._teacher.append(teacher)
+        teacher = self._teacher[0]
+        if device is not None and next(teacher.parameters()).device != torch.device(device):
+            # not a submodule, so it does not follow model.to(); moved on first use
+            teacher.to(device)
+        return teacher
+
+    def _calc_distill_loss(
+        self,
+        ctc_logits: torch.Tensor,
+        encoder_out_lens: torch.Tensor,
+        speech: torch.Tensor,
+        speech_lengths: torch.Tensor,
+        text: torch.Tensor,
+        prompt_ids,
+    ):
+        """KL(teacher || student) on the CTC posteriors and on the 4 rich-tag positions."""
+        temperature = self.distill_conf.get("temperature", 1.0)
+        teacher = self.teacher(device=speech.device)
+        with torch.no_grad():
+            teacher_out, _ = teacher.encode(speech, speech_lengths, text, prompt_ids=prompt_ids)
+            teacher_logits = teacher.ctc.ctc_lo(teacher_out) / temperature
+
+        student_logits = ctc_logits / temperature
+        kl = F.kl_div(
+            F.log_softmax(student_logits, dim=-1),
+            F.log_softmax(teacher_logits, dim=-1),
+            reduction="none",
+            log_target=True,
+        ).sum(-1) * temperature**2
+
+        mask = sequence_mask(encoder_out_lens, maxlen=kl.size(1), device=kl.device)
+        mask[:, :4] = 0
+        loss_kd = (kl * mask).sum() / mask.sum().clamp(min=1)
+        loss_rich_kd = kl[:, :4].mean()
+        return loss_kd, loss_rich_kd
+
+    @staticmethod
+    def _prompt_lut(int_dict: dict, default: int):
+        lut = torch.full((max(int_dict) + 2,), default, dtype=torch.long)
+        for token_id, embed_id in int_dict.items():
+            lut[token_id] = embed_id
+        return lut
+
+    def _prompt_ids(self, text: torch.Tensor, lid_dropout: float = 0.2):
+        """Language (randomly dropped to auto) and text-norm prompt ids of a batch.
+
+        Built with table lookups on the device of `text`, without per-row host syncs.
+        Returns:
+                lids: (Batch, 1)
+                styles: (Batch, 1)
+        """
+        lid_lut = self.lid_lut.to(text.device)
+        textnorm_lut = self.textnorm_lut.to(text.device)
+        lids = lid_lut[text[:, :1].long().clamp(0, lid_lut.size(0) - 1)]
+        keep = torch.rand(lids.shape, device=text.device) > lid_dropout
+        lids = lids * keep
+        styles = textnorm_lut[text[:, 3:4].long().clamp(0, textnorm_lut.size(0) - 1)]
+        return lids, styles
+
     def encode(
         self,
         speech: torch.Tensor,
         speech_lengths: torch.Tensor,
         text: torch.Tensor,
+        prompt_ids=None,
         **kwargs,
     ):
         """Frontend + Encoder. Note that this method is used by asr_inference.py
         Args:
                 speech: (Batch, Length, ...)
                 speech_lengths: (Batch, )
-                ind: int
+                text: (Batch, Length), the first 4 tokens give the prompts
+                prompt_ids: (lids, styles) from `_prompt_ids`, sampled from text if None
         """
 
         # Data augmentation
@@ -727,11 +1064,12 @@ class SenseVoiceSmall(nn.Module):
             speech, speech_lengths = self.normalize(speech, speech_lengths)
 
 
-        lids = torch.LongTensor([[self.lid_int_dict[int(lid)] if torch.rand(1) > 0.2 and int(lid) in self.lid_int_dict else 0 ] for lid in text[:, 0]]).to(speech.device)
-        language_query = self.embed(lids)
+        if prompt_ids is None:
+            prompt_ids = self._prompt_ids(text)
+        lids, styles = prompt_ids
+        language_query = self.embed(lids.to(speech.device))
         
-        styles = torch.LongTensor([[self.textnorm_int_dict[int(style)]] for style in text[:, 3]]).to(speech.device)
-        style_query = self.embed(styles)
+        style_query = self.embed(styles.to(speech.device))
         speech = torch.cat((style_query, speech), dim=1)
         speech_lengths += 1
 
@@ -750,9 +1088,18 @@ class SenseVoiceSmall(nn.Module):
         encoder_out_lens: torch.Tensor,
         ys_pad: torch.Tensor,
         ys_pad_lens: torch.Tensor,
+        ys_hat: torch.Tensor = None,
     ):
         # Calc CTC loss
-        loss_ctc = self.ctc(encoder_out, encoder_out_lens, ys_pad, ys_pad_lens)
+        if ys_hat is None:
+            loss_ctc = self.ctc(encoder_out, encoder_out_lens, ys_pad, ys_pad_lens)
+        else:
+            # ys_hat: already projected ctc_lo logits (Batch, Length, Vocab)
+            ys_mask = sequence_mask(ys_pad_lens, maxlen=ys_pad.size(1), dtype=torch.bool)
+            ys_true = ys_pad[ys_mask]
+            loss_ctc = self.ctc.loss_fn(
+                ys_hat.transpose(0, 1), ys_true, encoder_out_lens, ys_pad_lens
+            ).to(device=encoder_out.device, dtype=encoder_out.dtype)
 
         # Calc CER using CTC
         cer_ctc = None
@@ -765,8 +1112,10 @@ class SenseVoiceSmall(nn.Module):
         self,
         encoder_out: torch.Tensor,
         ys_pad: torch.Tensor,
+        decoder_out: torch.Tensor = None,
     ):
-        decoder_out = self.ctc.ctc_lo(encoder_out)
+        if decoder_out is None:
+            decoder_out = self.ctc.ctc_lo(encoder_out)
         # 2. Compute attention loss
         loss_rich = self.criterion_att(decoder_out, ys_pad.contiguous())
         acc_rich = th_accuracy(
@@ -778,6 +1127,185 @@ class SenseVoiceSmall(nn.Module):
         return loss_rich, acc_rich
 
 
+    def add_prompts(
+        self,
+        speech: torch.Tensor,
+        speech_lengths: torch.Tensor,
+        language_ids: torch.Tensor,
+        textnorm_ids: torch.Tensor,
+    ):
+        """Prepend the language, event/emotion and text-norm queries.
+
+        Args:
+                speech: (Batch, Length, Dim)
+                language_ids: (Batch,) values of lid_dict
+                textnorm_ids: (Batch,) values of textnorm_dict
+        Returns:
+                speech: (Batch, 4 + Length, Dim) and speech_lengths + 4
+        """
+        language_query = self.embed(language_ids.to(speech.device)).unsqueeze(1)
+        textnorm_query = self.embed(textnorm_ids.to(speech.device)).unsqueeze(1)
+        speech = torch.cat((textnorm_query, speech), dim=1)
+
+        event_emo_query = self.embed(torch.LongTensor([[1, 2]]).to(speech.device)).repeat(
+            speech.size(0), 1, 1
+        )
+        input_query = torch.cat((language_query, event_emo_query), dim=1)
+        speech = torch.cat((input_query, speech), dim=1)
+        return speech, speech_lengths + 4
+
+    def ctc_greedy_search(
+        self,
+        encoder_out: torch.Tensor,
+        ban_emo_unk: bool = False,
+        chunk_size: int = 256,
+        columns: torch.Tensor = None,
+    ):
+        """Greedy CTC search that never materializes (B, T, V) log-probs.
+
+        `ctc_lo` is applied over `chunk_size` frames at a time and only the
+        argmax ids, the top-1 log-probs and the per-frame log-partition are kept.
+        If `columns` is given, the projection is restricted to that vocabulary
+        subset and the log-partition is taken over the subset only.
+        Args:
+                encoder_out: (Batch, Length, Dim)
+                columns: (K,) sorted token ids of a pruned vocabulary
+        Returns:
+                ids: (Batch, Length) argmax token ids
+                scores: (Batch, Length) log-prob of the argmax token
+                lse: (Batch, Length) logsumexp of the logits, for `ctc_column_probs`
+        """
+        b, n, _ = encoder_out.size()
+        ids = torch.empty((b, n), dtype=torch.long, device=encoder_out.device)
+        scores = encoder_out.new_empty((b, n), dtype=torch.float32)
+        lse = encoder_out.new_empty((b, n), dtype=torch.float32)
+        weight, bias = self.ctc.ctc_lo.weight, self.ctc.ctc_lo.bias
+        unk_mask = None
+        if columns is not None:
+            weight = weight[columns]
+            bias = bias[columns] if bias is not None else None
+            if ban_emo_unk:
+                unk_mask = columns == self.emo_dict["unk"]
+        for beg in range(0, n, chunk_size):
+            end = min(n, beg + chunk_size)
+            logits = F.linear(encoder_out[:, beg:end, :], weight, bias).float()
+            lse[:, beg:end] = torch.logsumexp(logits, dim=-1)
+            if unk_mask is not None:
+                logits[:, :, unk_mask] = -float("inf")
+            elif ban_emo_unk and columns is None:
+                logits[:, :, self.emo_dict["unk"]] = -float("inf")
+            max_logits, max_ids = logits.max(dim=-1)
+            if columns is not None:
+                max_ids = columns[max_ids]
+            ids[:, beg:end] = max_ids
+            scores[:, beg:end] = max_logits - lse[:, beg:end]
+        return ids, scores, lse
+
+    def ctc_collapse(self, ctc_ids: torch.Tensor, lengths: torch.Tensor):
+        """Merge repeats and drop blanks for the whole batch with tensor ops.
+
+        Args:
+                ctc_ids: (Batch, Length) frame-level argmax ids
+                lengths: (Batch,)
+        Returns:
+                per row list of token ids
+        """
+        prev = F.pad(ctc_ids[:, :-1], (1, 0), value=-1)
+        frames = torch.arange(ctc_ids.size(1), device=ctc_ids.device)
+        keep = (ctc_ids != prev) & (ctc_ids != self.blank_id) & (frames < lengths.unsqueeze(-1))
+        counts = keep.sum(dim=-1).tolist()
+        flat = ctc_ids[keep].tolist()
+        token_ints, beg = [], 0
+        for count in counts:
+            token_ints.append(flat[beg : beg + count])
+            beg += count
+        return token_ints
+
+    def ctc_column_probs(
+        self,
+        encoder_out: torch.Tensor,
+        lse: torch.Tensor,
+        columns: torch.Tensor,
+    ):
+        """CTC posteriors restricted to `columns` of the vocabulary.
+
+        Args:
+                encoder_out: (..., Dim)
+                lse: (...) logsumexp returned by `ctc_greedy_search`
+                columns: (K,) token ids
+        Returns:
+                probs: (..., K), equal to `self.ctc.softmax(encoder_out)[..., columns]`
+        """
+        weight = self.ctc.ctc_lo.weight[columns]
+        bias = self.ctc.ctc_lo.bias[columns] if self.ctc.ctc_lo.bias is not None else None
+        logits = F.linear(encoder_out, weight, bias).float()
+        return torch.exp(logits - lse.unsqueeze(-1))
+
+    def ctc_token_spans(
+        self,
+        encoder_out: torch.Tensor,
+        encoder_out_lens: torch.Tensor,
+        ctc_ids: torch.Tensor,
+        ctc_lse: torch.Tensor,
+        token_ids: list,
+        log_probs: bool = False,
+    ):
+        """Frame span of every token of every row by batched CTC forced alignment.
+
+        Only the blank and the target-token columns of the CTC posteriors are computed.
+        Args:
+                encoder_out: (Batch, Length, Dim)
+                encoder_out_lens: (Batch,)
+                ctc_ids, ctc_lse: (Batch, Length) from `ctc_greedy_search`; with
+                        ctc_ids the blank is suppressed where it is the argmax
+                token_ids: per row list of token ids to align
+                log_probs: align on log-posteriors instead of posteriors
+        Returns:
+                per row list of [start_frame, end_frame) for each token, None for a
+                token the alignment gave no frame, so spans stay indexed like token_ids
+        """
+        device = encoder_out.device
+        target_lengths = torch.LongTensor([len(t) for t in token_ids])
+        max_len = max(int(target_lengths.max()), 1) if len(token_ids) else 1
+        targets = torch.full((len(token_ids), max_len), self.blank_id, dtype=torch.long)
+        for r, t in enumerate(token_ids):
+            targets[r, : len(t)] = torch.LongTensor(t)
+        targets = targets.to(device)
+        encoder_out = encoder_out[: len(token_ids)]
+
+        weight = self.ctc.ctc_lo.weight[targets]
+        token_logits = torch.einsum("btd,bld->btl", encoder_out, weight)
+        if self.ctc.ctc_lo.bias is not None:
+            token_logits = token_logits + self.ctc.ctc_lo.bias[targets].unsqueeze(1)
+        lse = ctc_lse[: len(token_ids)]
+        token_probs = token_logits.float() - lse.unsqueeze(-1)
+        blank_probs = self.ctc_column_probs(
+            encoder_out, lse, torch.LongTensor([self.blank_id]).to(device)
+        ).squeeze(-1)
+        if log_probs:
+            blank_probs = torch.log(blank_probs)
+        else:
+            token_probs = torch.exp(token_probs)
+        if ctc_ids is not None:
+            blank_probs = blank_probs.masked_fill(ctc_ids[: len(token_ids)] == self.blank_id, 0)
+
+        index = ctc_align_emissions(
+            blank_probs, token_probs, targets, encoder_out_lens[: len(token_ids)], target_lengths
+        ).tolist()
+
+        spans = []
+        for r, row in enumerate(index):
+            row_spans = [None] * len(token_ids[r])
+            for t, idx in enumerate(row[: int(encoder_out_lens[r])]):
+                if idx < 0:
+                    continue
+                if row_spans[idx] is None:
+                    row_spans[idx] = [t, t + 1]
+                else:
+                    row_spans[idx][1] = t + 1
+            spans.append(row_spans)
+        return spans
+
     def inference(
         self,
         data_in,
@@ -823,107 +1351,374 @@ class SenseVoiceSmall(nn.Module):
         speech_lengths = speech_lengths.to(device=kwargs["device"])
 
         language = kwargs.get("language", "auto")
-        language_query = self.embed(
-            torch.LongTensor(
-                [[self.lid_dict[language] if language in self.lid_dict else 0]]
-            ).to(speech.device)
-        ).repeat(speech.size(0), 1, 1)
-        
         use_itn = kwargs.get("use_itn", False)
         output_timestamp = kwargs.get("output_timestamp", False)
 
         textnorm = kwargs.get("text_norm", None)
         if textnorm is None:
             textnorm = "withitn" if use_itn else "woitn"
-        textnorm_query = self.embed(
-            torch.LongTensor([[self.textnorm_dict[textnorm]]]).to(speech.device)
-        ).repeat(speech.size(0), 1, 1)
-        speech = torch.cat((textnorm_query, speech), dim=1)
-        speech_lengths += 1
 
-        event_emo_query = self.embed(torch.LongTensor([[1, 2]]).to(speech.device)).repeat(
-            speech.size(0), 1, 1
-        )
-        input_query = torch.cat((language_query, event_emo_query), dim=1)
-        speech = torch.cat((input_query, speech), dim=1)
-        speech_lengths += 3
+        # (language, textnorm) pairs decoded from one feature extraction, stacked
+        # along the batch dimension: row v * b + i is variant v of utterance i
+        variants = kwargs.get("variants", None) or [(language, textnorm)]
+        b = speech.size(0)
+        if len(variants) > 1:
+            speech = speech.repeat(len(variants), 1, 1)
+            speech_lengths = speech_lengths.repeat(len(variants))
+        language_ids = torch.LongTensor(
+            [self.lid_dict[l] if l in self.lid_dict else 0 for l, _ in variants]
+        ).repeat_interleave(b)
+        textnorm_ids = torch.LongTensor(
+            [self.textnorm_dict[t] for _, t in variants]
+        ).repeat_interleave(b)
+        speech, speech_lengths = self.add_prompts(speech, speech_lengths, language_ids, textnorm_ids)
 
         # Encoder
+        time4 = time.perf_counter()
         encoder_out, encoder_out_lens = self.encoder(speech, speech_lengths)
         if isinstance(encoder_out, tuple):
             encoder_out = encoder_out[0]
+        meta_data["encoder"] = f"{time.perf_counter() - time4:0.3f}"
+
+        # c. Passed the encoder result and the greedy search
+        columns = None
+        variant_languages = {l for l, _ in variants}
+        if kwargs.get("prune_vocab", False) and len(variant_languages) == 1:
+            language = variant_languages.pop()
+            if language in LANGUAGE_SCRIPTS:
+                if not hasattr(self, "language_vocab"):
+                    self.language_vocab = LanguageVocab(tokenizer, vocab_size=self.vocab_size)
+                columns = self.language_vocab(
+                    language,
+                    device=encoder_out.device,
+                    keep=[self.blank_id] + list(self.emo_dict.values()),
+                )
+        ctc_ids, ctc_scores, ctc_lse = self.ctc_greedy_search(
+            encoder_out,
+            ban_emo_unk=kwargs.get("ban_emo_unk", False),
+            chunk_size=kwargs.get("ctc_chunk_size", 256),
+            columns=columns,
+        )
 
-        # c. Passed the encoder result and the beam search
-        ctc_logits = self.ctc.log_softmax(encoder_out)
-        if kwargs.get("ban_emo_unk", False):
-            ctc_logits[:, :, self.emo_dict["unk"]] = -float("inf")
+        # collapse and detokenize the whole batch at once
+        token_ints = self.ctc_collapse(ctc_ids, encoder_out_lens)
+        if not hasattr(self, "piece_table"):
+            self.piece_table = PieceTable(tokenizer)
+        texts = self.piece_table.decode_batch(token_ints)
+        confidence = None
+        if kwargs.get("output_confidence", False):
+            confidence = ctc_confidence(
+                ctc_ids.cpu().numpy(),
+                ctc_scores.exp().cpu().numpy(),
+                encoder_out_lens.cpu().numpy(),
+                blank_id=self.blank_id,
+            ).tolist()
 
         results = []
-        b, n, d = encoder_out.size()
+        row_tokens, row_pieces, row_results, row_writes = [], [], [], []
         if isinstance(key[0], (list, tuple)):
             key = key[0]
         if len(key) < b:
             key = key * b
-        for i in range(b):
-            x = ctc_logits[i, : encoder_out_lens[i].item(), :]
-            yseq = x.argmax(dim=-1)
-            yseq = torch.unique_consecutive(yseq, dim=-1)
+        for r in range(encoder_out.size(0)):
+            v, i = divmod(r, b)
+
+            token_int = token_ints[r]
+            text = texts[r]
+            result_i = {"key": key[i], "text": text}
+            if confidence is not None:
+                result_i["confidence"] = confidence[r]
+            if len(variants) > 1:
+                row_writes.append((f"1best_recog_{variants[v][0]}_{variants[v][1]}", result_i))
+            else:
+                row_writes.append(("1best_recog", result_i))
+            if output_timestamp:
+                row_tokens.append(token_int[4:])
+                row_pieces.append(self.piece_table.id2pieces(token_int[4:]))
+                row_results.append(result_i)
+
+            if len(variants) == 1:
+                results.append(result_i)
+            else:
+                result_i["language"], result_i["text_norm"] = variants[v]
+                if v == 0:
+                    results.append({"key": key[i], "text": text, "variants": []})
+                    if confidence is not None:
+                        results[i]["confidence"] = confidence[r]
+                results[i]["variants"].append(result_i)
+
+        if output_timestamp:
+            # all rows are aligned in one call, prompt positions excluded
+            time5 = time.perf_counter()
+            spans = self.ctc_token_spans(
+                encoder_out[:, 4:, :], encoder_out_lens - 4, ctc_ids[:, 4:], ctc_lse[:, 4:], row_tokens
+            )
+            for r, result_i in enumerate(row_results):
+                tokens = row_pieces[r]
+                ts_max = encoder_out_lens[r].item() - 4
+                timestamp = []
+                for token, span in zip(tokens, spans[r]):
+                    if span is None:
+                        # not aligned: left out rather than given a neighbour's times
+                        continue
+                    _start, _end = span
+                    ts_left = max((_start*60-30)/1000, 0)
+                    ts_right = min((_end*60-30)/1000, (ts_max*60-30)/1000)
+                    timestamp.append([token, ts_left, ts_right])
+                result_i["timestamp"] = timestamp
+            meta_data["timestamp"] = f"{time.perf_counter() - time5:0.3f}"
+
+        if kwargs.get("output_dir") is not None:
+            self.write_results(row_writes, **kwargs)
+        return results, meta_data
 
-            ibest_writer = None
-            if kwargs.get("output_dir") is not None:
-                if not hasattr(self, "writer"):
-                    self.writer = DatadirWriter(kwargs.get("output_dir"))
-                ibest_writer = self.writer[f"1best_recog"]
+    def write_results(self, row_writes, **kwargs):
+        """Hand (subdir, result) rows to the result writer of `output_dir`.
 
-            mask = yseq != self.blank_id
-            token_int = yseq[mask].tolist()
+        By default the synchronous `DatadirWriter` is used, so the files are
+        complete when `inference` returns. `async_writer=True` opts into an
+        `AsyncResultWriter` so that decoding never blocks on the filesystem;
+        its files are complete only after `self.writer.close()` (also run at
+        exit), and `output_jsonl=True` then also writes `{subdir}/result.jsonl`
+        with the timestamps.
+        """
+        if not hasattr(self, "writer"):
+            if kwargs.get("async_writer", False):
+                self.writer = AsyncResultWriter(
+                    kwargs["output_dir"],
+                    max_queue=kwargs.get("writer_queue_size", 10000),
+                    fsync_interval=kwargs.get("writer_fsync_interval", 5.0),
+                    jsonl=kwargs.get("output_jsonl", False),
+                )
+            else:
+                self.writer = DatadirWriter(kwargs["output_dir"])
+        for subdir, result_i in row_writes:
+            if isinstance(self.writer, AsyncResultWriter):
+                self.writer.write(result_i["key"], result_i, subdir=subdir)
+            else:
+                self.writer[subdir]["text"][result_i["key"]] = result_i["text"]
 
-            # Change integer-ids to tokens
-            text = tokenizer.decode(token_int)
-            if ibest_writer is not None:
-                ibest_writer["text"][key[i]] = text
+    def align(
+        self,
+        data_in,
+        text: list,
+        key: list = None,
+        tokenizer=None,
+        frontend=None,
+        **kwargs,
+    ):
+        """Token and word timestamps of externally supplied transcripts.
 
-            if output_timestamp:
-                from itertools import groupby
-                timestamp = []
-                tokens = tokenizer.text2tokens(text)[4:]
+        The transcripts are tokenized with the model's SentencePiece model, the
+        batch is encoded once, and all rows are force-aligned in one call on the
+        CTC log-posteriors of the transcript tokens.
+        Args:
+                data_in: list of audio (paths, waveforms), one per transcript
+                text: list of transcripts
+        Returns:
+                [{"key", "text", "tokens": [[piece, start, end]], "words": [[word, start, end]]}], meta_data;
+                start and end are None for pieces (and words) the alignment could not place
+        """
+        meta_data = {}
+        time1 = time.perf_counter()
+        audio_sample_list = load_audio_text_image_video(
+            data_in,
+            fs=frontend.fs,
+            audio_fs=kwargs.get("fs", 16000),
+            data_type=kwargs.get("data_type", "sound"),
+            tokenizer=tokenizer,
+        )
+        if not isinstance(audio_sample_list, (list, tuple)):
+            audio_sample_list = [audio_sample_list]
+        if isinstance(text, str):
+            text = [text]
+        assert len(text) == len(audio_sample_list), "one transcript per audio is required"
+        if key is None:
+            key = [f"utt{i}" for i in range(len(text))]
+        speech, speech_lengths = extract_fbank(
+            audio_sample_list, data_type=kwargs.get("data_type", "sound"), frontend=frontend
+        )
+        speech = speech.to(device=kwargs["device"])
+        speech_lengths = speech_lengths.to(device=kwargs["device"])
+        time2 = time.perf_counter()
+        meta_data["extract_feat"] = f"{time2 - time1:0.3f}"
 
-                logits_speech = self.ctc.softmax(encoder_out)[i, 4:encoder_out_lens[i].item(), :]
+        b = speech.size(0)
+        language = kwargs.get("language", "auto")
+        speech, speech_lengths = self.add_prompts(
+            speech,
+            speech_lengths,
+            torch.full((b,), self.lid_dict.get(language, 0), dtype=torch.long),
+            torch.full((b,), self.textnorm_dict[kwargs.get("text_norm", "withitn")], dtype=torch.long),
+        )
+        encoder_out, encoder_out_lens = self.encoder(speech, speech_lengths)
+        if isinstance(encoder_out, tuple):
+            encoder_out = encoder_out[0]
+        _, _, ctc_lse = self.ctc_greedy_search(encoder_out, chunk_size=kwargs.get("ctc_chunk_size", 256))
+        time3 = time.perf_counter()
+        meta_data["encoder"] = f"{time3 - time2:0.3f}"
+
+        sp = load_sentencepiece(tokenizer)
+        frames = (encoder_out_lens - 4).tolist()
+        token_ids = []
+        for i, t in enumerate(text):
+            ids = tokenizer.encode(t)
+            if len(ids) > frames[i]:
+                logging.warning(f"{key[i]}: {len(ids)} tokens do not fit {frames[i]} frames, not aligned")
+                ids = []
+            token_ids.append(ids)
+        spans = self.ctc_token_spans(
+            encoder_out[:, 4:, :], encoder_out_lens - 4, None, ctc_lse[:, 4:], token_ids, log_probs=True
+        )
 
-                pred = logits_speech.argmax(-1).cpu()
-                logits_speech[pred==self.blank_id, self.blank_id] = 0
+        results = []
+        for i in range(b):
+            tokens, words = [], []
+            new_word = True
+            for token_id, span in zip(token_ids[i], spans[i]):
+                piece = sp.id_to_piece(token_id)
+                if span is None:
+                    # not aligned: the piece is kept, without times
+                    ts_left = ts_right = None
+                else:
+                    _start, _end = span
+                    ts_left = max((_start*60-30)/1000, 0)
+                    ts_right = min((_end*60-30)/1000, (frames[i]*60-30)/1000)
+                tokens.append([piece, ts_left, ts_right])
+                # a word starts at "▁"; every han/kana piece is a word of its own
+                word = piece.replace("▁", "")
+                single = bool(piece_scripts(word) & {"han", "kana"})
+                new_word = new_word or piece.startswith("▁") or single
+                if not word:
+                    continue
+                if new_word or not words:
+                    words.append([word, ts_left, ts_right])
+                else:
+                    words[-1][0] += word
+                    if words[-1][1] is None:
+                        words[-1][1] = ts_left
+                    if ts_right is not None:
+                        words[-1][2] = ts_right
+                new_word = single
+            results.append({"key": key[i], "text": text[i], "tokens": tokens, "words": words})
+        meta_data["align"] = f"{time.perf_counter() - time3:0.3f}"
+        return results, meta_data
 
-                align = ctc_forced_align(
-                    logits_speech.unsqueeze(0).float(),
-                    torch.Tensor(token_int[4:]).unsqueeze(0).long().to(logits_speech.device),
-                    (encoder_out_lens-4).long(),
-                    torch.tensor(len(token_int)-4).unsqueeze(0).long().to(logits_speech.device),
-                    ignore_id=self.ignore_id,
-                )
+    rich_labels = {
+        "language": ["zh", "en", "yue", "ja", "ko", "nospeech"],
+        "emotion": ["HAPPY", "SAD", "ANGRY", "NEUTRAL", "FEARFUL", "DISGUSTED", "SURPRISED", "EMO_UNKNOWN"],
+        "event": ["Speech", "BGM", "Applause", "Laughter", "Cry", "Sneeze", "Breath", "Cough", "Event_UNK"],
+    }
+
+    def _rich_columns(self, tokenizer):
+        """Token ids of the language/emotion/event tags, resolved once from the tokenizer."""
+        if not hasattr(self, "rich_columns"):
+            sp = load_sentencepiece(tokenizer)
+            self.rich_columns = {}
+            for task, labels in self.rich_labels.items():
+                pairs = [(l, sp.piece_to_id(f"<|{l}|>")) for l in labels]
+                self.rich_columns[task] = [(l, i) for l, i in pairs if i != sp.unk_id()]
+        return self.rich_columns
+
+    def classify(
+        self,
+        data_in,
+        key: list = ["wav_file_tmp_name"],
+        tokenizer=None,
+        frontend=None,
+        max_duration_s: float = 10.0,
+        num_windows: int = 1,
+        **kwargs,
+    ):
+        """Language, emotion and event tags without transcription.
 
-                pred = groupby(align[0, :encoder_out_lens[0]])
-                _start = 0
-                token_id = 0
-                ts_max = encoder_out_lens[i] - 4
-                for pred_token, pred_frame in pred:
-                    _end = _start + len(list(pred_frame))
-                    if pred_token != 0:
-                        ts_left = max((_start*60-30)/1000, 0)
-                        ts_right = min((_end*60-30)/1000, (ts_max*60-30)/1000)
-                        timestamp.append([tokens[token_id], ts_left, ts_right])
-                        token_id += 1
-                    _start = _end
-
-                result_i = {"key": key[i], "text": text, "timestamp": timestamp}
-                results.append(result_i)
+        Only a bounded part of each audio is encoded: the first `max_duration_s`
+        seconds, or `num_windows` evenly spaced windows of that length. Just the
+        four prompt positions are projected by ctc_lo, the tag posteriors are
+        averaged over windows and no text is decoded.
+        Returns:
+                [{"key", "language": {"label", "score", "scores"}, "emotion": ..., "event": ...}], meta_data
+        """
+        meta_data = {}
+        time1 = time.perf_counter()
+        audio_sample_list = load_audio_text_image_video(
+            data_in,
+            fs=frontend.fs,
+            audio_fs=kwargs.get("fs", 16000),
+            data_type=kwargs.get("data_type", "sound"),
+            tokenizer=tokenizer,
+        )
+        if not isinstance(audio_sample_list, (list, tuple)):
+            audio_sample_list = [audio_sample_list]
+        if isinstance(key[0], (list, tuple)):
+            key = key[0]
+        if len(key) < len(audio_sample_list):
+            key = key * len(audio_sample_list)
+
+        window = int(max_duration_s * frontend.fs)
+        windows, owners = [], []
+        for i, samples in enumerate(audio_sample_list):
+            n = samples.shape[-1]
+            if n <= window or num_windows <= 1:
+                starts = [0]
             else:
-                result_i = {"key": key[i], "text": text}
-                results.append(result_i)
+                step = (n - window) / (num_windows - 1)
+                starts = sorted({int(round(j * step)) for j in range(num_windows)})
+            for beg in starts:
+                windows.append(samples[..., beg : beg + window])
+                owners.append(i)
+        time2 = time.perf_counter()
+        meta_data["load_data"] = f"{time2 - time1:0.3f}"
+
+        speech, speech_lengths = extract_fbank(
+            windows, data_type=kwargs.get("data_type", "sound"), frontend=frontend
+        )
+        speech = speech.to(device=kwargs["device"])
+        speech_lengths = speech_lengths.to(device=kwargs["device"])
+        time3 = time.perf_counter()
+        meta_data["extract_feat"] = f"{time3 - time2:0.3f}"
+
+        n_windows = speech.size(0)
+        speech, speech_lengths = self.add_prompts(
+            speech,
+            speech_lengths,
+            torch.full((n_windows,), self.lid_dict["auto"], dtype=torch.long),
+            torch.full((n_windows,), self.textnorm_dict["woitn"], dtype=torch.long),
+        )
+        encoder_out, encoder_out_lens = self.encoder(speech, speech_lengths)
+        if isinstance(encoder_out, tuple):
+            encoder_out = encoder_out[0]
+        meta_data["encoder"] = f"{time.perf_counter() - time3:0.3f}"
+
+        # positions 0, 1, 2 hold the language, emotion and event tags
+        logits = self.ctc.ctc_lo(encoder_out[:, :3, :]).float()
+        weights = (speech_lengths - 4).float().clamp(min=1)
+        owners = torch.LongTensor(owners).to(logits.device)
+
+        results = [{"key": key[i]} for i in range(len(audio_sample_list))]
+        for pos, (task, columns) in enumerate(self._rich_columns(tokenizer).items()):
+            labels = [l for l, _ in columns]
+            ids = torch.LongTensor([c for _, c in columns]).to(logits.device)
+            probs = torch.softmax(logits[:, pos, ids], dim=-1) * weights[:, None]
+            agg = torch.zeros(len(results), len(labels), device=probs.device)
+            agg.index_add_(0, owners, probs)
+            agg = agg / agg.sum(dim=-1, keepdim=True)
+            for i, row in enumerate(agg.tolist()):
+                best = max(range(len(labels)), key=lambda j: row[j])
+                results[i][task] = {
+                    "label": labels[best],
+                    "score": row[best],
+                    "scores": dict(zip(labels, row)),
+                }
         return results, meta_data
 
     def export(self, **kwargs):
         from export_meta import export_rebuild_model
 
+        if kwargs.get("streaming", False):
+            from export_meta import export_rebuild_streaming_model
+
+            return export_rebuild_streaming_model(model=self, **kwargs)
         if "max_seq_len" not in kwargs:
             kwargs["max_seq_len"] = 512
         models = export_rebuild_model(model=self, **kwargs)
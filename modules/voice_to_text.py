@@ -5,28 +5,35 @@
 import os
 import sys
 import torch
-from funasr import AutoModel
 from funasr.utils.postprocess_utils import rich_transcription_postprocess
 
+from utils.backends import create_backend
+
 class VoiceToTextModule:
-    def __init__(self, model_dir="iic/SenseVoiceSmall", device="cuda:0" if torch.cuda.is_available() else "cpu"):
+    def __init__(self, model_dir="iic/SenseVoiceSmall", device="cuda:0" if torch.cuda.is_available() else "cpu",
+                 backend="automodel", accuracy_tier="fp32"):
+        # backend: torch / automodel / onnx / onnx_int8, 或 auto (启动时测速选择最快且满足精度等级的后端)
         self.model_dir = model_dir
         self.device = device
+        self.backend = backend
+        self.accuracy_tier = accuracy_tier
         self.model = None
         self.initialize_model()
         
     def initialize_model(self):
         try:
-            # 修改模型初始化方式，与 demo1.py 或 webui.py 保持一致
-            self.model = AutoModel(
-                model=self.model_dir,
-                trust_remote_code=True,
-                remote_code="./model.py",
-                vad_model="fsmn-vad",
-                vad_kwargs={"max_single_segment_time": 30000},
+            # 通过 utils.backends 加载模型，automodel 与 demo1.py 或 webui.py 保持一致
+            backend_kwargs = {}
+            if self.backend == "automodel":
+                backend_kwargs = {"trust_remote_code": True, "remote_code": "./model.py"}
+            self.model = create_backend(
+                self.backend,
+                self.model_dir,
                 device=self.device,
+                tier=self.accuracy_tier,
+                **backend_kwargs,
             )
-            print(f"语音转文字模块初始化成功，使用设备: {self.device}")
+            print(f"语音转文字模块初始化成功，使用后端: {self.model.name}，设备: {self.device}")
         except Exception as e:
             print(f"语音转文字模块初始化失败: {str(e)}")
             self.init_error = str(e)  # 保存错误信息
@@ -44,9 +51,8 @@ class VoiceToTextModule:
                 return {"success": False, "error": f"音频文件不存在: {audio_path}"}
                 
             # 修改模型调用方式，与 demo1.py 或 webui.py 保持一致
-            res = self.model.generate(
-                input=audio_path,
-                cache={},
+            res = self.model.infer_batch(
+                [audio_path],
                 language="auto",  # "zh", "en", "yue", "ja", "ko", "nospeech"
                 use_itn=True,
                 batch_size_s=60,
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+# Copyright (c) 2023. All Rights Reserved.
+"""Structured pruning of attention heads and FFN units of SenseVoiceSmall.
+
+    python prune.py --calib data/train_example.jsonl --eval data/val_example.jsonl \
+        --head_ratio 0.25 --unit_ratio 0.25 --output_dir ./outputs/pruned [--export]
+"""
+
+import argparse
+import os
+import time
+
+import torch
+
+from benchmark.common import error_rate, load_model, read_manifest
+from utils.pruning import PruningScorer, prune_model, save_pruned_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="prune SenseVoiceSmall with a calibration pass")
+    parser.add_argument("--model_dir", type=str, default="iic/SenseVoiceSmall")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--calib", type=str, required=True, help="calibration jsonl manifest")
+    parser.add_argument("--calib_num", type=int, default=200)
+    parser.add_argument("--eval", type=str, default=None, help="jsonl manifest for the latency/error report")
+    parser.add_argument("--eval_num", type=int, default=200)
+    parser.add_argument("--head_ratio", type=float, default=0.25, help="fraction of heads removed per layer")
+    parser.add_argument("--unit_ratio", type=float, default=0.25, help="fraction of FFN units removed per layer")
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--export", action="store_true", help="also export model.onnx to output_dir")
+    return parser.parse_args()
+
+
+def evaluate(model, kwargs, items):
+    hyps = []
+    beg = time.perf_counter()
+    for item in items:
+        lang = item.get("text_language", "<|auto|>").strip("<|>")
+        res, _ = model.inference(data_in=item["source"], language=lang, use_itn=True, **kwargs)
+        hyps.append(res[0]["text"])
+    cost = time.perf_counter() - beg
+    return cost, error_rate([item["target"] for item in items], hyps)
+
+
+def main():
+    args = parse_args()
+    model, kwargs = load_model(args.model_dir, args.device)
+    model_dir = os.path.dirname(kwargs["init_param"])
+    eval_items = read_manifest(args.eval, args.eval_num) if args.eval else []
+
+    with torch.no_grad():
+        if eval_items:
+            base_cost, base_err = evaluate(model, kwargs, eval_items)
+
+        with PruningScorer(model) as scorer:
+            for item in read_manifest(args.calib, args.calib_num):
+                model.inference(data_in=item["source"], language="auto", **kwargs)
+
+        heads_list, units_list = prune_model(
+            model,
+            scorer.head_scores(),
+            scorer.unit_scores(),
+            head_ratio=args.head_ratio,
+            unit_ratio=args.unit_ratio,
+        )
+        save_pruned_model(
+            model,
+            model_dir,
+            args.output_dir,
+            {"attention_heads_list": heads_list, "linear_units_list": units_list},
+        )
+        print(f"pruned model saved to {args.output_dir}")
+        print(f"heads per layer: {heads_list}")
+        print(f"units per layer: {units_list}")
+
+        if eval_items:
+            cost, err = evaluate(model, kwargs, eval_items)
+            print("model\tseconds\terror_rate")
+            print(f"base\t{base_cost:.3f}\t{base_err:.4f}")
+            print(f"pruned\t{cost:.3f}\t{err:.4f}\t({base_cost / cost:.2f}x)")
+
+    if args.export:
+        from utils import export_utils
+
+        pruned, pruned_kwargs = load_model(args.output_dir, "cpu")
+        rebuilt_model = pruned.export(type="onnx", quantize=False)
+        del pruned_kwargs["model"]
+        pruned_kwargs["output_dir"] = args.output_dir
+        with torch.no_grad():
+            export_utils.export(model=rebuilt_model, **pruned_kwargs)
+
+
+if __name__ == "__main__":
+    main()
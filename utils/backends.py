@@ -0,0 +1,325 @@
+# -*- encoding: utf-8 -*-
+"""Interchangeable ways of running SenseVoiceSmall behind one interface.
+
+    backend = create_backend("onnx_int8", "iic/SenseVoiceSmall", device="cpu")
+    results = backend.infer_batch([wav_or_path, ...], language="auto", use_itn=True)
+
+Every backend returns one `{"key", "text"}` dict per input, `text` carrying
+the rich tags like `SenseVoiceSmall.inference`. `create_backend("auto", ...)`
+runs `probe` and keeps the fastest backend of the declared accuracy tier.
+"""
+import glob
+import importlib.util
+import logging
+import os
+import time
+from typing import Dict, FrozenSet, List, Sequence, Union
+
+import numpy as np
+
+# from most to least exact: the PyTorch model itself, an fp32 ONNX export of it
+# and an int8 quantized export
+ACCURACY_TIERS = ("reference", "fp32", "int8")
+
+LANGUAGE_IDS = {"auto": 0, "zh": 3, "en": 4, "yue": 7, "ja": 11, "ko": 12, "nospeech": 13}
+TEXTNORM_IDS = {"withitn": 14, "woitn": 15}
+
+BACKENDS: Dict[str, type] = {}
+
+
+def register_backend(cls):
+    BACKENDS[cls.name] = cls
+    return cls
+
+
+def local_model_dir(model_dir: str) -> str:
+    """A local directory for a model id, downloaded by modelscope if needed."""
+    if os.path.isdir(model_dir):
+        return model_dir
+    from modelscope.hub.snapshot_download import snapshot_download
+
+    return snapshot_download(model_dir)
+
+
+class Backend:
+    """Base class of the backends.
+
+    `tier` is one of ACCURACY_TIERS, `capabilities` a subset of
+    {"batch", "timestamps", "confidence", "vad", "streaming"}.
+    """
+
+    name: str = None
+    tier: str = "reference"
+    capabilities: FrozenSet[str] = frozenset()
+    requires: Sequence[str] = ()
+
+    def __init__(self, model_dir: str = "iic/SenseVoiceSmall", device: str = "cpu", **kwargs):
+        self.model_dir = model_dir
+        self.device = device
+        self.kwargs = kwargs
+        self.model = None
+
+    @classmethod
+    def available(cls) -> bool:
+        """Whether the packages this backend needs are installed."""
+        return all(importlib.util.find_spec(m) is not None for m in cls.requires)
+
+    def load(self) -> "Backend":
+        raise NotImplementedError
+
+    def infer_batch(
+        self,
+        inputs: List[Union[str, np.ndarray]],
+        language: str = "auto",
+        use_itn: bool = False,
+        keys: List[str] = None,
+        **kwargs,
+    ) -> List[dict]:
+        """Decode `inputs` (paths or 16 kHz waveforms) as one batch.
+
+        Backend specific options go to `kwargs` and are ignored by the
+        backends that do not use them.
+        """
+        raise NotImplementedError
+
+    def stream(self):
+        raise NotImplementedError(f"backend {self.name} does not support streaming")
+
+    def supports(self, *capabilities: str) -> bool:
+        return set(capabilities) <= self.capabilities
+
+    @staticmethod
+    def keys_for(inputs, keys):
+        if keys is None:
+            return [f"utt_{i}" for i in range(len(inputs))]
+        if len(keys) < len(inputs):
+            # like `SenseVoiceSmall.inference`, a single key is reused
+            keys = list(keys) * len(inputs)
+        return list(keys)[: len(inputs)]
+
+
+@register_backend
+class TorchBackend(Backend):
+    """`SenseVoiceSmall.inference` of model.py, one padded batch per call."""
+
+    name = "torch"
+    capabilities = frozenset({"batch", "timestamps", "confidence"})
+    requires = ("torch", "funasr")
+
+    def load(self):
+        from model import SenseVoiceSmall
+
+        self.model, self.model_kwargs = SenseVoiceSmall.from_pretrained(
+            model=self.model_dir, device=self.device, **self.kwargs
+        )
+        self.model.eval()
+        return self
+
+    def infer_batch(self, inputs, language="auto", use_itn=False, keys=None, **kwargs):
+        import torch
+
+        keys = self.keys_for(inputs, keys)
+        with torch.no_grad():
+            results, _ = self.model.inference(
+                data_in=list(inputs),
+                language=language,
+                use_itn=use_itn,
+                key=keys,
+                **{**self.model_kwargs, **kwargs},
+            )
+        return results
+
+
+@register_backend
+class AutoModelBackend(Backend):
+    """funasr `AutoModel` with the fsmn VAD in front, for long recordings.
+
+    The model code is funasr's own SenseVoice unless the caller passes
+    `trust_remote_code=True, remote_code="./model.py"`.
+    """
+
+    name = "automodel"
+    capabilities = frozenset({"vad"})
+    requires = ("torch", "funasr")
+
+    def load(self):
+        from funasr import AutoModel
+
+        model_kwargs = {
+            "vad_model": "fsmn-vad",
+            "vad_kwargs": {"max_single_segment_time": 30000},
+            **self.kwargs,
+        }
+        self.model = AutoModel(model=self.model_dir, device=self.device, **model_kwargs)
+        return self
+
+    def infer_batch(self, inputs, language="auto", use_itn=False, keys=None, **kwargs):
+        keys = self.keys_for(inputs, keys)
+        generate_kwargs = {"batch_size_s": 60, "merge_vad": True, "merge_length_s": 15, **kwargs}
+        generate_kwargs.pop("fs", None)
+        results = []
+        for key, data in zip(keys, inputs):
+            res = self.model.generate(
+                input=data, cache={}, language=language, use_itn=use_itn, **generate_kwargs
+            )
+            results.append({"key": key, "text": res[0]["text"] if res else ""})
+        return results
+
+
+@register_backend
+class OnnxBackend(Backend):
+    """`SenseVoiceSmallONNX` on the exported `model.onnx`, no torch needed."""
+
+    name = "onnx"
+    tier = "fp32"
+    capabilities = frozenset({"batch"})
+    requires = ("onnxruntime", "sentencepiece")
+    quantize: Union[bool, str] = False
+
+    def load(self):
+        from utils.ctc_vocab import PieceTable
+        from utils.model_bin import SenseVoiceSmallONNX
+
+        model_dir = local_model_dir(self.model_dir)
+        device_id = self.device.split(":")[-1] if self.device.startswith("cuda") else "-1"
+        self.model = SenseVoiceSmallONNX(
+            model_dir, device_id=device_id, **{"quantize": self.quantize, **self.kwargs}
+        )
+        self.table = PieceTable.from_bpemodel(glob.glob(os.path.join(model_dir, "*.bpe.model"))[0])
+        self.local_dir = model_dir
+        if os.path.exists(os.path.join(model_dir, "model_streaming.onnx")):
+            self.capabilities = self.capabilities | {"streaming"}
+        return self
+
+    def infer_batch(self, inputs, language="auto", use_itn=False, keys=None, fs=16000, **kwargs):
+        keys = self.keys_for(inputs, keys)
+        waveforms = list(inputs)
+        if fs != 16000:
+            import librosa
+
+            waveforms = [
+                librosa.resample(np.asarray(w, dtype=np.float32), orig_sr=fs, target_sr=16000)
+                if not isinstance(w, str)
+                else w
+                for w in waveforms
+            ]
+        # one session run for the whole call, like the torch backend; passed per
+        # call since the instance is shared by concurrent requests
+        textnorm = TEXTNORM_IDS["withitn" if use_itn else "woitn"]
+        token_ints = self.model(
+            waveforms, LANGUAGE_IDS.get(language, 0), textnorm, batch_size=max(len(waveforms), 1)
+        )
+        texts = self.table.decode_batch(token_ints)
+        return [{"key": key, "text": text} for key, text in zip(keys, texts)]
+
+    def stream(self):
+        from utils.model_bin import SenseVoiceSmallStreamingONNX
+
+        if "streaming" not in self.capabilities:
+            return super().stream()
+        return SenseVoiceSmallStreamingONNX(self.local_dir, **self.kwargs)
+
+
+@register_backend
+class OnnxInt8Backend(OnnxBackend):
+    """`SenseVoiceSmallONNX` on the dynamically quantized `model_quant.onnx`."""
+
+    name = "onnx_int8"
+    tier = "int8"
+    quantize = True
+
+
+def cpu_features() -> Dict[str, bool]:
+    """SIMD extensions relevant to int8 inference, from /proc/cpuinfo."""
+    flags = set()
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = set(line.split(":", 1)[1].split())
+                    break
+    except OSError:
+        pass
+    return {
+        "avx2": "avx2" in flags,
+        "avx512": "avx512f" in flags,
+        "vnni": "avx512_vnni" in flags or "avx_vnni" in flags,
+        "amx": "amx_int8" in flags,
+    }
+
+
+def eligible_backends(tier: str = "fp32", capabilities: Sequence[str] = ()) -> List[str]:
+    """Installed backends at least as exact as `tier` that declare `capabilities`."""
+    max_tier = ACCURACY_TIERS.index(tier)
+    return [
+        name
+        for name, cls in BACKENDS.items()
+        if ACCURACY_TIERS.index(cls.tier) <= max_tier
+        and set(capabilities) <= cls.capabilities
+        and cls.available()
+    ]
+
+
+def probe(
+    model_dir: str = "iic/SenseVoiceSmall",
+    device: str = "cpu",
+    tier: str = "fp32",
+    capabilities: Sequence[str] = (),
+    names: Sequence[str] = None,
+    audio: np.ndarray = None,
+    repeat: int = 3,
+    **kwargs,
+) -> List[dict]:
+    """Load and time every eligible backend on this machine, fastest first.
+
+    Each row has the backend `name`, its loaded `backend` (None if loading
+    failed) and the median `seconds` of `repeat` calls on `audio`, 10 s of
+    synthetic audio by default. "streaming" is only known after loading, so
+    it is checked on the loaded backend.
+    """
+    if audio is None:
+        rng = np.random.default_rng(0)
+        audio = (0.05 * rng.standard_normal(16000 * 10)).astype(np.float32)
+    static_caps = [c for c in capabilities if c != "streaming"]
+    names = names or eligible_backends(tier, static_caps)
+    logging.info(f"probing backends {names} on cpu features {cpu_features()}")
+    rows = []
+    for name in names:
+        row = {"name": name, "backend": None, "seconds": float("inf")}
+        try:
+            backend = BACKENDS[name](model_dir, device, **kwargs).load()
+            if not backend.supports(*capabilities):
+                continue
+            backend.infer_batch([audio])
+            costs = []
+            for _ in range(repeat):
+                beg = time.perf_counter()
+                backend.infer_batch([audio])
+                costs.append(time.perf_counter() - beg)
+            row.update(backend=backend, seconds=float(np.median(costs)))
+        except Exception as e:
+            row["error"] = str(e)
+            logging.warning(f"backend {name} unavailable: {e}")
+        rows.append(row)
+    return sorted(rows, key=lambda r: r["seconds"])
+
+
+def create_backend(
+    name: str = "torch",
+    model_dir: str = "iic/SenseVoiceSmall",
+    device: str = "cpu",
+    tier: str = "fp32",
+    capabilities: Sequence[str] = (),
+    **kwargs,
+) -> Backend:
+    """A loaded backend by name, or with name="auto" the fastest one found by `probe`."""
+    if name != "auto":
+        if name not in BACKENDS:
+            raise ValueError(f"unknown backend {name}, expected one of {['auto'] + list(BACKENDS)}")
+        return BACKENDS[name](model_dir, device, **kwargs).load()
+    rows = probe(model_dir, device, tier, capabilities, **kwargs)
+    if not rows or rows[0]["backend"] is None:
+        raise RuntimeError(f"no backend of tier {tier} with {list(capabilities)} could be loaded")
+    for row in rows:
+        logging.info(f"backend {row['name']}: {row['seconds']:.3f} s")
+    return rows[0]["backend"]
@@ -0,0 +1,111 @@
+# -*- encoding: utf-8 -*-
+from typing import Callable, List, Sequence, Tuple
+
+import numpy as np
+
+
+def frame_max_probs(logits: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Argmax ids and their posterior for (B, T, V) CTC logits."""
+    ids = logits.argmax(axis=-1)
+    max_logits = np.take_along_axis(logits, ids[..., None], axis=-1)
+    probs = 1.0 / np.exp(logits - max_logits).sum(axis=-1)
+    return ids, probs
+
+
+def ctc_confidence(
+    ids: np.ndarray, probs: np.ndarray, lengths: np.ndarray, blank_id: int = 0, skip: int = 4
+) -> np.ndarray:
+    """Per-segment confidence: mean top-1 posterior of the non-blank frames.
+
+    The first `skip` frames (language/emotion/event/textnorm prompts) and the
+    padding are ignored. Segments without any token fall back to the mean
+    over all their frames, so a confidently silent segment is not re-decoded.
+    """
+    frames = np.arange(ids.shape[1])[None, :]
+    valid = (frames >= skip) & (frames < np.asarray(lengths).reshape(-1, 1))
+    token = valid & (ids != blank_id)
+    mask = np.where(token.any(axis=-1, keepdims=True), token, valid)
+    return (probs * mask).sum(axis=-1) / np.maximum(mask.sum(axis=-1), 1)
+
+
+def cascade(
+    first_pass: Callable[[List[int]], List[dict]],
+    second_pass: Callable[[List[int]], List[dict]],
+    num_items: int,
+    threshold: float = 0.9,
+) -> Tuple[List[dict], List[int]]:
+    """Confidence-gated two-pass decoding.
+
+    `first_pass(indices)` (the cheap, e.g. int8, model) must return one result
+    per index with a "confidence" entry; only the items below `threshold` are
+    handed to `second_pass(indices)` (the full-precision model) and their
+    results replaced. Returns the merged results and the re-decoded indices.
+    """
+    results = first_pass(list(range(num_items)))
+    redecode = [i for i, r in enumerate(results) if r["confidence"] < threshold]
+    if redecode:
+        for i, r in zip(redecode, second_pass(redecode)):
+            r["redecoded"] = True
+            results[i] = r
+    return results, redecode
+
+
+def select(items, indices: Sequence[int]):
+    """Subset of a list, or of the batch dimension of an array/tensor."""
+    if isinstance(items, (list, tuple)):
+        return [items[i] for i in indices]
+    return items[list(indices)]
+
+
+def quantize_model(model):
+    """int8 dynamic quantization of the nn.Linear layers, the PyTorch counterpart
+    of `model_quant.onnx`. The input model is left untouched."""
+    import copy
+
+    import torch
+
+    quantized = torch.quantization.quantize_dynamic(
+        copy.deepcopy(model).cpu(), {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return quantized.eval()
+
+
+def cascade_inference(
+    fast_model, accurate_model, data_in, key: list = None, threshold: float = 0.9, **kwargs
+):
+    """Run `SenseVoiceSmall.inference` on `fast_model` and re-decode the
+    low-confidence segments with `accurate_model`.
+
+    `data_in` is a list of inputs (paths, waveforms) or a batch of fbank
+    features with `data_lengths`. Returns (results, re-decoded indices).
+    """
+    if not isinstance(data_in, (list, tuple)) and kwargs.get("data_type", "sound") != "fbank":
+        data_in = [data_in]
+    num_items = len(data_in)
+    if key is None:
+        key = [f"utt_{i}" for i in range(num_items)]
+    data_lengths = kwargs.pop("data_lengths", None)
+    kwargs.pop("output_confidence", None)
+
+    def run(model, device):
+        def fn(indices):
+            lengths = select(data_lengths, indices) if data_lengths is not None else None
+            inputs = select(data_in, indices)
+            if hasattr(inputs, "to"):
+                inputs, lengths = inputs.to(device), lengths.to(device)
+            return model.inference(
+                inputs,
+                data_lengths=lengths,
+                key=select(key, indices),
+                **{**kwargs, "device": device},
+                output_confidence=True,
+            )[0]
+
+        return fn
+
+    return cascade(
+        run(fast_model, kwargs.get("fast_device", "cpu")),
+        run(accurate_model, kwargs.get("device", "cpu")),
+        num_items,
+        threshold,
+    )
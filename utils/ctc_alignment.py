@@ -1,76 +1,119 @@
 import torch
 
-def ctc_forced_align(
-    log_probs: torch.Tensor,
+def ctc_align_emissions(
+    blank_emissions: torch.Tensor,
+    token_emissions: torch.Tensor,
     targets: torch.Tensor,
     input_lengths: torch.Tensor,
     target_lengths: torch.Tensor,
-    blank: int = 0,
-    ignore_id: int = -1,
 ) -> torch.Tensor:
-    """Align a CTC label sequence to an emission.
+    """Batched Viterbi CTC alignment on emissions already gathered to the targets.
+
+    Only the blank column and the target-token columns of the emission are
+    needed, and backpointers are stored as uint8, so memory is O(B * T * L)
+    bytes instead of O(B * T * C) floats plus O(B * T * L) int64.
 
     Args:
-        log_probs (Tensor): log probability of CTC emission output.
-            Tensor of shape `(B, T, C)`. where `B` is the batch size, `T` is the input length,
-            `C` is the number of characters in alphabet including blank.
-        targets (Tensor): Target sequence. Tensor of shape `(B, L)`,
-            where `L` is the target length.
-        input_lengths (Tensor):
-            Lengths of the inputs (max value must each be <= `T`). 1-D Tensor of shape `(B,)`.
-        target_lengths (Tensor):
-            Lengths of the targets. 1-D Tensor of shape `(B,)`.
-        blank_id (int, optional): The index of blank symbol in CTC emission. (Default: 0)
-        ignore_id (int, optional): The index of ignore symbol in CTC emission. (Default: -1)
-    """
-    targets[targets == ignore_id] = blank
+        blank_emissions (Tensor): score of the blank symbol, shape `(B, T)`.
+        token_emissions (Tensor): score of each target token, shape `(B, T, L)`,
+            i.e. `emission[b, t, targets[b, l]]`.
+        targets (Tensor): Target sequence `(B, L)`, only used to detect repeated labels.
+        input_lengths (Tensor): Lengths of the inputs `(B,)`, each <= `T`.
+        target_lengths (Tensor): Lengths of the targets `(B,)`, each <= `L`.
 
-    batch_size, input_time_size, _ = log_probs.size()
-    bsz_indices = torch.arange(batch_size, device=input_lengths.device)
+    Returns:
+        Tensor: `(B, T)` index of the aligned target token for each frame, -1 for blank
+            and for frames beyond `input_lengths`.
+    """
+    batch_size, input_time_size, target_size = token_emissions.size()
+    device = token_emissions.device
+    bsz_indices = torch.arange(batch_size, device=device)
+    input_lengths = input_lengths.to(device).long()
+    target_lengths = target_lengths.to(device).long()
+    ext_size = 2 * target_size + 1
 
-    _t_a_r_g_e_t_s_ = torch.cat(
+    # emissions of the blank-extended label sequence (B, T, 2L+1)
+    emissions = torch.cat(
         (
-            torch.stack((torch.full_like(targets, blank), targets), dim=-1).flatten(start_dim=1),
-            torch.full_like(targets[:, :1], blank),
+            torch.stack(
+                (blank_emissions.unsqueeze(-1).expand(-1, -1, target_size), token_emissions), dim=-1
+            ).flatten(start_dim=2),
+            blank_emissions.unsqueeze(-1),
         ),
         dim=-1,
     )
-    diff_labels = torch.cat(
-        (
-            torch.as_tensor([[False, False]], device=targets.device).expand(batch_size, -1),
-            _t_a_r_g_e_t_s_[:, 2:] != _t_a_r_g_e_t_s_[:, :-2],
-        ),
-        dim=1,
-    )
+    diff_labels = torch.zeros((batch_size, ext_size), dtype=torch.bool, device=device)
+    if target_size > 1:
+        diff_labels[:, 3::2] = targets[:, 1:] != targets[:, :-1]
 
-    neg_inf = torch.tensor(float("-inf"), device=log_probs.device, dtype=log_probs.dtype)
+    neg_inf = torch.tensor(float("-inf"), device=device, dtype=emissions.dtype)
     padding_num = 2
-    padded_t = padding_num + _t_a_r_g_e_t_s_.size(-1)
-    best_score = torch.full((batch_size, padded_t), neg_inf, device=log_probs.device, dtype=log_probs.dtype)
-    best_score[:, padding_num + 0] = log_probs[:, 0, blank]
-    best_score[:, padding_num + 1] = log_probs[bsz_indices, 0, _t_a_r_g_e_t_s_[:, 1]]
+    best_score = torch.full(
+        (batch_size, padding_num + ext_size), neg_inf, device=device, dtype=emissions.dtype
+    )
+    best_score[:, padding_num + 0] = emissions[:, 0, 0]
+    if ext_size > 1:
+        best_score[:, padding_num + 1] = emissions[:, 0, 1]
 
-    backpointers = torch.zeros((batch_size, input_time_size, padded_t), device=log_probs.device, dtype=targets.dtype)
+    backpointers = torch.zeros((batch_size, input_time_size, ext_size), device=device, dtype=torch.uint8)
 
     for t in range(1, input_time_size):
         prev = torch.stack(
             (best_score[:, 2:], best_score[:, 1:-1], torch.where(diff_labels, best_score[:, :-2], neg_inf))
         )
         prev_max_value, prev_max_idx = prev.max(dim=0)
-        best_score[:, padding_num:] = log_probs[:, t].gather(-1, _t_a_r_g_e_t_s_) + prev_max_value
-        backpointers[:, t, padding_num:] = prev_max_idx
+        active = (t < input_lengths).unsqueeze(-1)
+        best_score[:, padding_num:] = torch.where(
+            active, emissions[:, t] + prev_max_value, best_score[:, padding_num:]
+        )
+        backpointers[:, t] = prev_max_idx.to(torch.uint8)
 
     l1l2 = best_score.gather(
         -1, torch.stack((padding_num + target_lengths * 2 - 1, padding_num + target_lengths * 2), dim=-1)
     )
 
-    path = torch.zeros((batch_size, input_time_size), device=best_score.device, dtype=torch.long)
+    path = torch.zeros((batch_size, input_time_size), device=device, dtype=torch.long)
     path[bsz_indices, input_lengths - 1] = padding_num + target_lengths * 2 - 1 + l1l2.argmax(dim=-1)
 
     for t in range(input_time_size - 1, 0, -1):
         target_indices = path[:, t]
-        prev_max_idx = backpointers[bsz_indices, t, target_indices]
-        path[:, t - 1] += target_indices - prev_max_idx
+        prev_max_idx = backpointers[bsz_indices, t, (target_indices - padding_num).clamp(min=0)].long()
+        path[:, t - 1] += torch.where(target_indices >= padding_num, target_indices - prev_max_idx, 0)
+
+    ext_path = path - padding_num
+    return torch.where((ext_path >= 0) & (ext_path % 2 == 1), ext_path // 2, -1)
 
-    alignments = _t_a_r_g_e_t_s_.gather(dim=-1, index=(path - padding_num).clamp(min=0))
-    return alignments
+
+def ctc_forced_align(
+    log_probs: torch.Tensor,
+    targets: torch.Tensor,
+    input_lengths: torch.Tensor,
+    target_lengths: torch.Tensor,
+    blank: int = 0,
+    ignore_id: int = -1,
+) -> torch.Tensor:
+    """Align a CTC label sequence to an emission.
+
+    Args:
+        log_probs (Tensor): log probability of CTC emission output.
+            Tensor of shape `(B, T, C)`. where `B` is the batch size, `T` is the input length,
+            `C` is the number of characters in alphabet including blank.
+        targets (Tensor): Target sequence. Tensor of shape `(B, L)`,
+            where `L` is the target length.
+        input_lengths (Tensor):
+            Lengths of the inputs (max value must each be <= `T`). 1-D Tensor of shape `(B,)`.
+        target_lengths (Tensor):
+            Lengths of the targets. 1-D Tensor of shape `(B,)`.
+        blank_id (int, optional): The index of blank symbol in CTC emission. (Default: 0)
+        ignore_id (int, optional): The index of ignore symbol in CTC emission. (Default: -1)
+    """
+    targets = targets.masked_fill(targets == ignore_id, blank)
+    index = ctc_align_emissions(
+        log_probs[:, :, blank],
+        log_probs.gather(-1, targets.unsqueeze(1).expand(-1, log_probs.size(1), -1)),
+        targets,
+        input_lengths,
+        target_lengths,
+    )
+    alignments = targets.gather(-1, index.clamp(min=0))
+    return alignments.masked_fill(index < 0, blank)
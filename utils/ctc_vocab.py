@@ -0,0 +1,147 @@
+# -*- encoding: utf-8 -*-
+import re
+from typing import Dict, List
+
+# unicode scripts whose pieces may be emitted for each pinned language;
+# latin is kept everywhere because of code-switching
+LANGUAGE_SCRIPTS = {
+    "zh": {"han", "latin"},
+    "en": {"latin"},
+    "yue": {"han", "latin"},
+    "ja": {"han", "kana", "latin"},
+    "ko": {"hangul", "han", "latin"},
+}
+
+_rich_token = re.compile(r"^<\|.*\|>$")
+
+
+def char_script(c: str) -> str:
+    cp = ord(c)
+    if 0x4E00 <= cp <= 0x9FFF or 0x3400 <= cp <= 0x4DBF or 0xF900 <= cp <= 0xFAFF or 0x20000 <= cp <= 0x2FA1F:
+        return "han"
+    if 0x3040 <= cp <= 0x30FF or 0x31F0 <= cp <= 0x31FF or 0xFF66 <= cp <= 0xFF9F:
+        return "kana"
+    if 0xAC00 <= cp <= 0xD7AF or 0x1100 <= cp <= 0x11FF or 0x3130 <= cp <= 0x318F:
+        return "hangul"
+    if c.isalpha():
+        return "latin" if cp < 0x0250 or 0x1E00 <= cp <= 0x1EFF or 0xFF21 <= cp <= 0xFF5A else "other"
+    return "common"
+
+
+def piece_scripts(piece: str) -> set:
+    return {char_script(c) for c in piece.replace("▁", "")} - {"common"}
+
+
+def load_sentencepiece(tokenizer):
+    sp = getattr(tokenizer, "sp", None)
+    if sp is None:
+        import sentencepiece as spm
+
+        sp = spm.SentencePieceProcessor()
+        sp.load(str(tokenizer.bpemodel))
+    return sp
+
+
+def build_language_vocab(tokenizer, language: str) -> List[int]:
+    """Token ids that can be emitted when decoding `language`.
+
+    Control, unknown and rich tokens (`<|zh|>`, `<|HAPPY|>`, ...) are always kept,
+    as are pieces made only of digits, punctuation or the word boundary.
+    """
+    if language not in LANGUAGE_SCRIPTS:
+        raise ValueError(f"vocab pruning is not supported for language: {language}")
+    allowed = LANGUAGE_SCRIPTS[language]
+    sp = load_sentencepiece(tokenizer)
+    ids = []
+    for i in range(sp.get_piece_size()):
+        piece = sp.id_to_piece(i)
+        if sp.is_control(i) or sp.is_unknown(i) or _rich_token.match(piece):
+            ids.append(i)
+        elif piece_scripts(piece) <= allowed:
+            ids.append(i)
+    return ids
+
+
+class LanguageVocab:
+    """Per-language token subsets, built once from the SentencePiece model."""
+
+    def __init__(self, tokenizer, vocab_size: int = None):
+        self.tokenizer = tokenizer
+        self.vocab_size = vocab_size
+        self.subsets: Dict[str, List[int]] = {}
+        self.columns: Dict[tuple, "torch.Tensor"] = {}
+
+    def __call__(self, language: str, device=None, keep: List[int] = ()) -> "torch.Tensor":
+        import torch
+
+        if language not in self.subsets:
+            ids = build_language_vocab(self.tokenizer, language)
+            if self.vocab_size is not None:
+                ids = [i for i in ids if i < self.vocab_size]
+            self.subsets[language] = ids
+        cache_key = (language, str(device), tuple(keep))
+        if cache_key not in self.columns:
+            ids = sorted(set(self.subsets[language]).union(keep))
+            self.columns[cache_key] = torch.LongTensor(ids).to(device)
+        return self.columns[cache_key]
+
+
+class PieceTable:
+    """Precomputed id -> piece bytes table, decoding ids without calling SentencePiece.
+
+    Matches `SentencePieceProcessor.decode_ids`: control pieces are dropped,
+    byte-fallback pieces are joined as raw bytes, "▁" becomes a space and the
+    dummy-prefix space of the first word is removed.
+    """
+
+    def __init__(self, tokenizer):
+        sp = load_sentencepiece(tokenizer)
+        self.pieces: List[str] = []
+        self.table: List[bytes] = []
+        self.table_bos: List[bytes] = []
+        self.keeps_bos: List[bool] = []
+        for i in range(sp.get_piece_size()):
+            piece = sp.id_to_piece(i)
+            self.pieces.append(piece)
+            if sp.is_control(i):
+                data, keeps_bos = b"", True
+            elif sp.is_unknown(i):
+                data, keeps_bos = " ⁇ ".encode("utf-8"), False
+            elif sp.is_byte(i):
+                data, keeps_bos = bytes([int(piece[3:-1], 16)]), False
+            else:
+                data = piece.replace("▁", " ").encode("utf-8")
+                keeps_bos = bool(_rich_token.match(piece))
+            self.table.append(data)
+            self.table_bos.append(data[1:] if data.startswith(b" ") and not keeps_bos else data)
+            self.keeps_bos.append(keeps_bos)
+
+    @classmethod
+    def from_bpemodel(cls, bpemodel: str) -> "PieceTable":
+        """Build from a SentencePiece model file, without funasr or torch."""
+        import types
+
+        return cls(types.SimpleNamespace(bpemodel=bpemodel))
+
+    def tokens2text(self, ids: List[int]) -> str:
+        # same name as the funasr tokenizers, so it can be passed as `tokenizer`
+        return self.decode(ids)
+
+    def id2pieces(self, ids: List[int]) -> List[str]:
+        return [self.pieces[i] for i in ids]
+
+    def decode(self, ids: List[int]) -> str:
+        table, keeps_bos = self.table, self.keeps_bos
+        first = next((j for j, i in enumerate(ids) if not keeps_bos[i]), None)
+        if first is None:
+            data = b"".join(table[i] for i in ids)
+        else:
+            data = b"".join(
+                [table[i] for i in ids[:first]]
+                + [self.table_bos[ids[first]]]
+                + [table[i] for i in ids[first + 1 :]]
+            )
+        return data.decode("utf-8", errors="replace")
+
+    def decode_batch(self, batch_ids: List[List[int]]) -> List[str]:
+        return [self.decode(ids) for ids in batch_ids]
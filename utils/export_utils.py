@@ -34,6 +34,11 @@ def _onnx(
     **kwargs,
 ):
 
+    if quantize == "static" and not hasattr(model, "lid_dict"):
+        # the calibration reader feeds whole utterances to the offline graph inputs
+        raise ValueError(
+            f"quantize='static' is only supported for the offline model, not {model.export_name()}"
+        )
     dummy_input = model.export_dummy_inputs()
 
     verbose = kwargs.get("verbose", False)
@@ -51,7 +56,27 @@ def _onnx(
         dynamic_axes=model.export_dynamic_axes(),
     )
 
-    if quantize:
+    if quantize == "static":
+        # int8 QDQ with activation ranges calibrated on a manifest
+        from utils.quantization import ManifestCalibrationReader, quantize_static_qdq
+
+        quant_model_path = model_path.replace(".onnx", "_qdq.onnx")
+        if not os.path.exists(quant_model_path):
+            reader = ManifestCalibrationReader(
+                kwargs["calibration_manifest"],
+                os.path.dirname(kwargs.get("init_param", model_path)),
+                lid_dict=model.lid_dict,
+                textnorm_id=model.textnorm_dict["withitn"],
+                limit=kwargs.get("calibration_limit", 100),
+            )
+            quantize_static_qdq(
+                model_path,
+                quant_model_path,
+                reader,
+                per_channel=kwargs.get("per_channel", True),
+                calibrate_method=kwargs.get("calibrate_method", "MinMax"),
+            )
+    elif quantize:
         from onnxruntime.quantization import QuantType, quantize_dynamic
         import onnx
 
@@ -25,6 +25,7 @@ class WavFrontend:
         lfr_m: int = 1,
         lfr_n: int = 1,
         dither: float = 1.0,
+        cmvn: np.ndarray = None,
         **kwargs,
     ) -> None:
 
@@ -44,7 +45,10 @@ class WavFrontend:
         self.lfr_n = lfr_n
         self.cmvn_file = cmvn_file
 
-        if self.cmvn_file:
+        if cmvn is not None:
+            # already parsed, e.g. from the model asset cache
+            self.cmvn = cmvn
+        elif self.cmvn_file:
             self.cmvn = self.load_cmvn()
         self.fbank_fn = None
         self.fbank_beg_idx = 0
@@ -1,13 +1,17 @@
 # -*- encoding: utf-8 -*-
 
 import functools
+import hashlib
 import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, NamedTuple, Set, Tuple, Union
 
 import re
 import numpy as np
-import yaml
 
 try:
     from onnxruntime import (
@@ -19,7 +23,6 @@ try:
     )
 except:
     print("please pip3 install onnxruntime")
-import jieba
 import warnings
 
 root_dir = Path(__file__).resolve().parent
@@ -184,33 +187,68 @@ class ONNXRuntimeError(Exception):
 
 
 class OrtInferSession:
-    def __init__(self, model_file, device_id=-1, intra_op_num_threads=4):
+    """onnxruntime session with cached input/output names.
+
+    With `io_binding=True` inputs are bound in place and outputs are written
+    into buffers preallocated once per input-shape bucket (the first run of a
+    bucket lets ORT allocate and records the output shapes). The returned
+    arrays are views of those buffers: they stay valid until the next call with
+    the same input shapes from the same thread, so consume or copy them first.
+    The CPU memory arena is enabled by default in this mode since the same
+    shapes come back again and again.
+    """
+
+    def __init__(
+        self,
+        model_file,
+        device_id=-1,
+        intra_op_num_threads=4,
+        io_binding: bool = False,
+        enable_cpu_mem_arena: bool = None,
+        max_buckets: int = 32,
+        inter_op_num_threads: int = None,
+        session_config: Dict[str, str] = None,
+        initializers: Dict[str, Any] = None,
+        optimized_cache_dir: str = None,
+    ):
         device_id = str(device_id)
+        if enable_cpu_mem_arena is None:
+            enable_cpu_mem_arena = io_binding
         sess_opt = SessionOptions()
         sess_opt.intra_op_num_threads = intra_op_num_threads
+        if inter_op_num_threads is not None:
+            sess_opt.inter_op_num_threads = inter_op_num_threads
         sess_opt.log_severity_level = 4
-        sess_opt.enable_cpu_mem_arena = False
+        sess_opt.enable_cpu_mem_arena = enable_cpu_mem_arena
+        sess_opt.enable_mem_pattern = True
         sess_opt.graph_optimization_level = GraphOptimizationLevel.ORT_ENABLE_ALL
+        for key, value in (session_config or {}).items():
+            sess_opt.add_session_config_entry(key, value)
+        # add_initializer does not take ownership: the OrtValues (which hold
+        # their numpy arrays) must outlive the session
+        self.initializers = initializers or {}
+        for name, value in self.initializers.items():
+            sess_opt.add_initializer(name, value)
 
-        cuda_ep = "CUDAExecutionProvider"
-        cuda_provider_options = {
-            "device_id": device_id,
-            "arena_extend_strategy": "kNextPowerOfTwo",
-            "cudnn_conv_algo_search": "EXHAUSTIVE",
-            "do_copy_in_default_stream": "true",
-        }
-        cpu_ep = "CPUExecutionProvider"
-        cpu_provider_options = {
-            "arena_extend_strategy": "kSameAsRequested",
-        }
-
-        EP_list = []
-        if device_id != "-1" and get_device() == "GPU" and cuda_ep in get_available_providers():
-            EP_list = [(cuda_ep, cuda_provider_options)]
-        EP_list.append((cpu_ep, cpu_provider_options))
+        cuda_ep, cpu_ep = "CUDAExecutionProvider", "CPUExecutionProvider"
+        EP_list = self.execution_providers(device_id)
 
         self._verify_model(model_file)
-        self.session = InferenceSession(model_file, sess_options=sess_opt, providers=EP_list)
+        self.session = None
+        self.model_path = model_file
+        if optimized_cache_dir is not None:
+            optimized = optimized_model(model_file, EP_list, optimized_cache_dir)
+            if optimized is not None:
+                sess_opt.graph_optimization_level = GraphOptimizationLevel.ORT_DISABLE_ALL
+                try:
+                    self.session = InferenceSession(optimized, sess_options=sess_opt, providers=EP_list)
+                    self.model_path = optimized
+                except Exception as e:
+                    logging.warning(f"cached optimized model {optimized} is unusable, rebuilding: {e}")
+                    os.remove(optimized)
+                    sess_opt.graph_optimization_level = GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.session is None:
+            self.session = InferenceSession(model_file, sess_options=sess_opt, providers=EP_list)
 
         if device_id != "-1" and cuda_ep not in self.session.get_providers():
             warnings.warn(
@@ -221,22 +259,59 @@ class OrtInferSession:
                 RuntimeWarning,
             )
 
+        self.input_names = [v.name for v in self.session.get_inputs()]
+        self.output_names = [v.name for v in self.session.get_outputs()]
+        self.io_binding = io_binding
+        self.max_buckets = max_buckets
+        self._local = threading.local()
+
     def __call__(self, input_content: List[Union[np.ndarray, np.ndarray]]) -> np.ndarray:
-        input_dict = dict(zip(self.get_input_names(), input_content))
         try:
-            return self.session.run(self.get_output_names(), input_dict)
+            if self.io_binding:
+                return self.run_with_binding(input_content)
+            return self.session.run(self.output_names, dict(zip(self.input_names, input_content)))
         except Exception as e:
             raise ONNXRuntimeError("ONNXRuntime inferece failed.") from e
 
+    def output_buffers(self) -> "OrderedDict":
+        if not hasattr(self._local, "buffers"):
+            self._local.buffers = OrderedDict()
+        return self._local.buffers
+
+    def run_with_binding(self, input_content: List[np.ndarray]) -> List[np.ndarray]:
+        inputs = [np.ascontiguousarray(x) for x in input_content]
+        bucket = tuple((x.shape, x.dtype.str) for x in inputs)
+        buffers = self.output_buffers()
+
+        binding = self.session.io_binding()
+        for name, x in zip(self.input_names, inputs):
+            binding.bind_cpu_input(name, x)
+        outputs = buffers.get(bucket)
+        if outputs is None:
+            for name in self.output_names:
+                binding.bind_output(name, "cpu")
+        else:
+            buffers.move_to_end(bucket)
+            for name, y in zip(self.output_names, outputs):
+                binding.bind_output(name, "cpu", 0, y.dtype, y.shape, y.ctypes.data)
+
+        self.session.run_with_iobinding(binding)
+        if outputs is None:
+            outputs = binding.copy_outputs_to_cpu()
+            buffers[bucket] = outputs
+            if len(buffers) > self.max_buckets:
+                buffers.popitem(last=False)
+        return outputs
+
     def get_input_names(
         self,
     ):
-        return [v.name for v in self.session.get_inputs()]
+        return self.input_names
 
     def get_output_names(
         self,
     ):
-        return [v.name for v in self.session.get_outputs()]
+        return self.output_names
 
     def get_character_list(self, key: str = "character"):
         return self.meta_dict[key].splitlines()
@@ -247,6 +322,27 @@ class OrtInferSession:
             return True
         return False
 
+    @staticmethod
+    def execution_providers(device_id) -> List[Tuple[str, Dict[str, str]]]:
+        device_id = str(device_id)
+        cuda_ep = "CUDAExecutionProvider"
+        cuda_provider_options = {
+            "device_id": device_id,
+            "arena_extend_strategy": "kNextPowerOfTwo",
+            "cudnn_conv_algo_search": "EXHAUSTIVE",
+            "do_copy_in_default_stream": "true",
+        }
+        cpu_ep = "CPUExecutionProvider"
+        cpu_provider_options = {
+            "arena_extend_strategy": "kSameAsRequested",
+        }
+
+        EP_list = []
+        if device_id != "-1" and get_device() == "GPU" and cuda_ep in get_available_providers():
+            EP_list = [(cuda_ep, cuda_provider_options)]
+        EP_list.append((cpu_ep, cpu_provider_options))
+        return EP_list
+
     @staticmethod
     def _verify_model(model_path):
         model_path = Path(model_path)
@@ -256,6 +352,202 @@ class OrtInferSession:
             raise FileExistsError(f"{model_path} is not a file.")
 
 
+def model_fingerprint(model_file, cache_dir) -> str:
+    """Content hash of `model_file`, memoized in `cache_dir` against its size and mtime."""
+    stat = os.stat(model_file)
+    memo = os.path.join(cache_dir, Path(model_file).name + ".sha256")
+    stamp = f"{stat.st_size} {stat.st_mtime_ns}"
+    if os.path.exists(memo):
+        with open(memo, "r") as f:
+            saved_stamp, _, digest = f.read().strip().rpartition(" ")
+        if saved_stamp == stamp:
+            return digest
+    h = hashlib.sha256()
+    with open(model_file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 22), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    try:
+        with open(memo, "w") as f:
+            f.write(f"{stamp} {digest}")
+    except OSError:
+        pass
+    return digest
+
+
+@functools.lru_cache(maxsize=None)
+def cpu_isa_tag() -> str:
+    """Short hash of the CPU feature flags (AVX2, AVX512, VNNI, ...): two
+    machines of the same architecture may still select different kernels."""
+    import platform
+
+    flags = platform.processor()
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.split(":", 1)[0].strip() in ("flags", "Features"):
+                    flags = " ".join(sorted(line.split(":", 1)[1].split()))
+                    break
+    except OSError:
+        pass
+    return hashlib.sha256(flags.encode("utf-8")).hexdigest()[:8]
+
+
+def optimized_model(model_file, providers, cache_dir) -> Union[str, None]:
+    """Path of the ORT_ENABLE_ALL optimized graph of `model_file`, created on first use.
+
+    The file is keyed by model hash, onnxruntime version, execution provider,
+    machine and CPU feature flags, since fully optimized graphs may contain
+    provider and ISA specific kernels. Returns None when it cannot be written.
+    """
+    import platform
+
+    import onnxruntime
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        digest = model_fingerprint(model_file, cache_dir)[:16]
+        provider = providers[0][0].replace("ExecutionProvider", "").lower()
+        name = f"{Path(model_file).stem}.{digest}.ort{onnxruntime.__version__}.{provider}.{platform.machine()}-{cpu_isa_tag()}.onnx"
+        path = os.path.join(cache_dir, name)
+        if os.path.exists(path):
+            return path
+        sess_opt = SessionOptions()
+        sess_opt.log_severity_level = 4
+        sess_opt.graph_optimization_level = GraphOptimizationLevel.ORT_ENABLE_ALL
+        tmp = f"{path}.{os.getpid()}.tmp"
+        sess_opt.optimized_model_filepath = tmp
+        InferenceSession(str(model_file), sess_options=sess_opt, providers=providers)
+        os.replace(tmp, path)
+        return path
+    except Exception as e:
+        logging.warning(f"can not cache the optimized graph of {model_file} in {cache_dir}: {e}")
+        return None
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def shared_initializers(model_file, min_size: int = 1024) -> Dict[str, Any]:
+    """OrtValues of the large initializers of `model_file`, to be handed to every
+    session of a pool so the weights are held in memory once."""
+    import onnx
+    from onnx import numpy_helper
+    from onnxruntime import OrtValue
+
+    model = onnx.load(str(model_file))
+    values = {}
+    for init in model.graph.initializer:
+        array = numpy_helper.to_array(init)
+        if array.size >= min_size:
+            values[init.name] = OrtValue.ortvalue_from_numpy(np.ascontiguousarray(array))
+    return values
+
+
+class OrtSessionPool:
+    """Several `OrtInferSession`s of one model sharing a core budget.
+
+    `core_budget` cores (default: all cores this process may run on) are split
+    into `num_sessions` disjoint groups of `intra_op_num_threads` cores. Each
+    session runs its intra-op threads on its own group (pinned when
+    `pin_cores=True`, spinning disabled so idle sessions do not burn cores),
+    inter-op parallelism is off, and a call goes to the session with the
+    fewest requests in flight. The sum of intra-op threads never exceeds the
+    budget, so concurrent callers of a web server do not oversubscribe.
+    With `share_weights=True` the large initializers are loaded once and
+    shared by all sessions.
+    """
+
+    def __init__(
+        self,
+        model_file,
+        device_id=-1,
+        num_sessions: int = None,
+        intra_op_num_threads: int = 4,
+        core_budget: int = None,
+        pin_cores: bool = False,
+        share_weights: bool = True,
+        **kwargs,
+    ):
+        cores = available_cores()
+        if core_budget is not None:
+            cores = cores[:core_budget]
+        if num_sessions is None:
+            num_sessions = max(1, len(cores) // intra_op_num_threads)
+        if num_sessions > len(cores):
+            # an empty core group would mean intra_op_num_threads=0, i.e. all cores
+            logging.warning(f"num_sessions={num_sessions} exceeds the {len(cores)} cores, using {len(cores)}")
+            num_sessions = len(cores)
+        intra_op_num_threads = max(1, min(intra_op_num_threads, len(cores) // num_sessions))
+        self.core_groups = [
+            cores[i * intra_op_num_threads : (i + 1) * intra_op_num_threads] for i in range(num_sessions)
+        ]
+        self.pin_cores = pin_cores and hasattr(os, "sched_setaffinity")
+        weights_file = model_file
+        if kwargs.get("optimized_cache_dir") is not None:
+            providers = OrtInferSession.execution_providers(device_id)
+            weights_file = optimized_model(model_file, providers, kwargs["optimized_cache_dir"]) or model_file
+        # kept for the lifetime of the pool, the sessions reference this memory
+        self.initializers = shared_initializers(weights_file) if share_weights else None
+
+        self.sessions = []
+        for group in self.core_groups:
+            session_config = {"session.intra_op.allow_spinning": "0"}
+            if self.pin_cores and len(group) > 1:
+                # the caller thread is intra-op thread 0, the entry lists the
+                # others; logical processor ids are 1-based
+                session_config["session.intra_op_thread_affinities"] = ";".join(
+                    str(c + 1) for c in group[1:]
+                )
+            self.sessions.append(
+                OrtInferSession(
+                    model_file,
+                    device_id,
+                    intra_op_num_threads=len(group),
+                    inter_op_num_threads=1,
+                    session_config=session_config,
+                    initializers=self.initializers,
+                    **kwargs,
+                )
+            )
+        self.in_flight = [0] * len(self.sessions)
+        self.lock = threading.Lock()
+        self.input_names = self.sessions[0].input_names
+        self.output_names = self.sessions[0].output_names
+
+    def acquire(self) -> int:
+        with self.lock:
+            idx = min(range(len(self.sessions)), key=self.in_flight.__getitem__)
+            self.in_flight[idx] += 1
+        return idx
+
+    def release(self, idx: int):
+        with self.lock:
+            self.in_flight[idx] -= 1
+
+    def __call__(self, input_content: List[np.ndarray]) -> List[np.ndarray]:
+        idx = self.acquire()
+        saved = None
+        try:
+            if self.pin_cores:
+                saved = os.sched_getaffinity(0)
+                os.sched_setaffinity(0, self.core_groups[idx])
+            return self.sessions[idx](input_content)
+        finally:
+            if saved is not None:
+                os.sched_setaffinity(0, saved)
+            self.release(idx)
+
+    def get_input_names(self):
+        return self.input_names
+
+    def get_output_names(self):
+        return self.output_names
+
+
 def split_to_mini_sentence(words: list, word_limit: int = 20):
     assert word_limit > 1
     if len(words) <= word_limit:
@@ -311,6 +603,8 @@ def join_chinese_and_english(input_list):
 
 
 def code_mix_split_words_jieba(seg_dict_file: str):
+    import jieba
+
     jieba.load_userdict(seg_dict_file)
 
     def _fn(text: str):
@@ -357,11 +651,37 @@ def read_yaml(yaml_path: Union[str, Path]) -> Dict:
     if not Path(yaml_path).exists():
         raise FileExistsError(f"The {yaml_path} does not exist.")
 
+    import yaml
+
     with open(str(yaml_path), "rb") as f:
-        data = yaml.load(f, Loader=yaml.Loader)
+        # libyaml based loader when available, several times faster
+        data = yaml.load(f, Loader=getattr(yaml, "CLoader", yaml.Loader))
     return data
 
 
+def load_cached(files: List[Union[str, Path]], cache_file: Union[str, Path], build):
+    """`build()` memoized as a pickle next to the model, invalidated when any of
+    `files` changes size or mtime. Falls back to `build()` if the cache can not
+    be read or written."""
+    stamp = [(str(f), os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in files]
+    try:
+        with open(cache_file, "rb") as f:
+            saved_stamp, value = pickle.load(f)
+        if saved_stamp == stamp:
+            return value
+    except Exception:
+        pass
+    value = build()
+    try:
+        tmp = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((stamp, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+    except OSError:
+        pass
+    return value
+
+
 @functools.lru_cache()
 def get_logger(name="funasr_onnx"):
     """Initialize and get a logger by name.
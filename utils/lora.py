@@ -0,0 +1,89 @@
+# -*- encoding: utf-8 -*-
+from pathlib import Path
+from typing import Dict, Union
+
+import torch
+from torch import nn
+
+
+def lora_modules(model: nn.Module) -> Dict[str, nn.Module]:
+    return {name: m for name, m in model.named_modules() if hasattr(m, "lora_A") and hasattr(m, "merge")}
+
+
+def lora_state_dict(model: nn.Module) -> Dict[str, torch.Tensor]:
+    """Only the adapter weights, a few MB instead of a full checkpoint."""
+    return {k: v.detach().cpu().clone() for k, v in model.state_dict().items() if "lora_" in k}
+
+
+def save_adapter(model: nn.Module, path: Union[str, Path]):
+    torch.save(lora_state_dict(model), str(path))
+
+
+def load_adapter(path: Union[str, Path]) -> Dict[str, torch.Tensor]:
+    state = torch.load(str(path), map_location="cpu")
+    if "state_dict" in state:
+        state = state["state_dict"]
+    return {k: v for k, v in state.items() if "lora_" in k}
+
+
+def merge_lora(model: nn.Module):
+    """Fold every adapter into its base weight; forward then has no adapter overhead."""
+    for m in lora_modules(model).values():
+        m.merge()
+
+
+def unmerge_lora(model: nn.Module):
+    for m in lora_modules(model).values():
+        m.unmerge()
+
+
+class AdapterRegistry:
+    """Several tenant adapters served against one base model.
+
+        registry = AdapterRegistry(model)
+        registry.register("tenant_a", "adapters/tenant_a.pt")
+        registry.activate("tenant_a")  # adapter merged into the base weights
+        model.inference(...)
+
+    Only one adapter is active at a time; switching unmerges the previous one
+    before merging the next, so the base weights are shared by all tenants.
+    """
+
+    def __init__(self, model: nn.Module, merge: bool = True):
+        self.model = model
+        self.merge = merge
+        self.adapters: Dict[str, Dict[str, torch.Tensor]] = {}
+        self.active = None
+        if not lora_modules(model):
+            raise ValueError("model has no LoRA layers, build it with encoder_conf.lora_list")
+
+    def register(self, name: str, adapter: Union[str, Path, Dict[str, torch.Tensor]]):
+        if not isinstance(adapter, dict):
+            adapter = load_adapter(adapter)
+        self.adapters[name] = adapter
+
+    def unregister(self, name: str):
+        if self.active == name:
+            self.deactivate()
+        self.adapters.pop(name)
+
+    def deactivate(self):
+        """Back to the plain base model."""
+        unmerge_lora(self.model)
+        for m in lora_modules(self.model).values():
+            m.lora_B.data.zero_()
+        self.active = None
+
+    @torch.no_grad()
+    def activate(self, name: str):
+        if self.active == name:
+            return
+        if name not in self.adapters:
+            raise KeyError(f"adapter {name} is not registered")
+        unmerge_lora(self.model)
+        missing = self.model.load_state_dict(self.adapters[name], strict=False)
+        if missing.unexpected_keys:
+            raise ValueError(f"adapter {name} does not match the model: {missing.unexpected_keys[:4]}")
+        if self.merge:
+            merge_lora(self.model)
+        self.active = name
@@ -6,8 +6,7 @@
 import os.path
 from pathlib import Path
 from typing import List, Union, Tuple
-import torch
-import librosa
+import wave
 import numpy as np
 
 from utils.infer_utils import (
@@ -15,16 +14,56 @@ from utils.infer_utils import (
     Hypothesis,
     ONNXRuntimeError,
     OrtInferSession,
+    OrtSessionPool,
     TokenIDConverter,
     get_logger,
+    load_cached,
     read_yaml,
 )
-from utils.frontend import WavFrontend
+from utils.cascade import ctc_confidence, frame_max_probs
+from utils.frontend import WavFrontend, WavFrontendOnline
 from utils.infer_utils import pad_list
 
 logging = get_logger()
 
 
+def load_audio(path: str, fs: int = 16000) -> np.ndarray:
+    """Mono float32 waveform. 16-bit PCM wav at `fs` is read with the standard
+    library; anything else (other formats, resampling) needs librosa."""
+    if str(path).lower().endswith(".wav"):
+        try:
+            with wave.open(str(path), "rb") as f:
+                if f.getsampwidth() == 2 and f.getframerate() == fs:
+                    data = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+                    data = data.reshape(-1, f.getnchannels()).mean(axis=1)
+                    return (data / 32768.0).astype(np.float32)
+        except wave.Error:
+            pass
+    import librosa
+
+    waveform, _ = librosa.load(path, sr=fs)
+    return waveform
+
+
+def load_model_assets(model_dir, cache_dir=None):
+    """config.yaml and the parsed am.mvn, memoized in `cache_dir` when one is given."""
+    config_file = os.path.join(model_dir, "config.yaml")
+    cmvn_file = os.path.join(model_dir, "am.mvn")
+
+    def build_assets():
+        config = read_yaml(config_file)
+        frontend = WavFrontend(**{**config["frontend_conf"], "cmvn_file": cmvn_file})
+        return config, frontend.cmvn
+
+    if cache_dir is None:
+        return build_assets()
+    return load_cached(
+        [config_file, cmvn_file],
+        os.path.join(cache_dir, "assets.cache.pkl"),
+        build_assets,
+    )
+
+
 class SenseVoiceSmallONNX:
     """
     Author: Speech Lab of DAMO Academy, Alibaba Group
@@ -38,19 +77,38 @@ class SenseVoiceSmallONNX:
         batch_size: int = 1,
         device_id: Union[str, int] = "-1",
         plot_timestamp_to: str = "",
-        quantize: bool = False,
+        quantize: Union[bool, str] = False,
         intra_op_num_threads: int = 4,
         cache_dir: str = None,
+        cascade_threshold: float = None,
+        io_binding: bool = False,
+        shape_bucket: int = None,
+        num_sessions: int = None,
+        core_budget: int = None,
+        pin_cores: bool = False,
+        cache_optimized: bool = False,
         **kwargs,
     ):
-        if quantize:
+        # cascade: decode with model_quant.onnx and re-decode the segments whose
+        # CTC confidence is below `cascade_threshold` with model.onnx
+        self.cascade_threshold = cascade_threshold
+        if cascade_threshold is not None and not quantize:
+            quantize = True
+        if quantize == "static":
+            model_file = os.path.join(model_dir, "model_qdq.onnx")
+        elif quantize:
             model_file = os.path.join(model_dir, "model_quant.onnx")
         else:
             model_file = os.path.join(model_dir, "model.onnx")
 
-        config_file = os.path.join(model_dir, "config.yaml")
+        # with `cache_optimized` the optimized graphs, config and cmvn are cached
+        # in `cache_dir` (default: next to the model), nothing is written otherwise
+        if not cache_optimized:
+            cache_dir = None
+        elif cache_dir is None:
+            cache_dir = model_dir
         cmvn_file = os.path.join(model_dir, "am.mvn")
-        config = read_yaml(config_file)
+        config, cmvn = load_model_assets(model_dir, cache_dir)
         # token_list = os.path.join(model_dir, "tokens.json")
         # with open(token_list, "r", encoding="utf-8") as f:
         #     token_list = json.load(f)
@@ -58,50 +116,137 @@ class SenseVoiceSmallONNX:
         # self.converter = TokenIDConverter(token_list)
         self.tokenizer = CharTokenizer()
         config["frontend_conf"]['cmvn_file'] = cmvn_file
-        self.frontend = WavFrontend(**config["frontend_conf"])
-        self.ort_infer = OrtInferSession(
-            model_file, device_id, intra_op_num_threads=intra_op_num_threads
-        )
+        self.frontend = WavFrontend(**config["frontend_conf"], cmvn=cmvn)
+        session_kwargs = {"intra_op_num_threads": intra_op_num_threads, "io_binding": io_binding}
+        if cache_optimized:
+            session_kwargs["optimized_cache_dir"] = cache_dir
+        if num_sessions is not None or core_budget is not None:
+            # a pool of sessions on disjoint cores for concurrent callers
+            session_cls = OrtSessionPool
+            session_kwargs.update(num_sessions=num_sessions, core_budget=core_budget, pin_cores=pin_cores)
+        else:
+            session_cls = OrtInferSession
+        self.ort_infer = session_cls(model_file, device_id, **session_kwargs)
+        self.ort_infer_fp32 = None
+        if cascade_threshold is not None:
+            self.ort_infer_fp32 = session_cls(
+                os.path.join(model_dir, "model.onnx"), device_id, **session_kwargs
+            )
+        # pad the feature length up to a multiple of `shape_bucket` frames so that
+        # io-binding output buffers are reused across utterances of similar length
+        if shape_bucket is None:
+            shape_bucket = 32 if io_binding else 1
+        self.shape_bucket = max(shape_bucket, 1)
+        self.cascade_stats = {"segments": 0, "redecoded": 0}
         self.batch_size = batch_size
         self.blank_id = 0
 
     def __call__(self, 
                  wav_content: Union[str, np.ndarray, List[str]], 
-                 language: List, 
-                 textnorm: List,
+                 language: Union[int, List], 
+                 textnorm: Union[int, List],
                  tokenizer=None,
+                 batch_size: int = None,
                  **kwargs) -> List:
+        """Decode every input, `batch_size` (default: `self.batch_size`)
+        utterances per session run.
+
+        `language` / `textnorm` are prompt ids, either one for all inputs or one
+        per input. Inputs are grouped by feature length to limit padding and
+        the results are returned in input order.
+        """
         waveform_list = self.load_data(wav_content, self.frontend.opts.frame_opts.samp_freq)
         waveform_nums = len(waveform_list)
-        asr_res = []
-        for beg_idx in range(0, waveform_nums, self.batch_size):
-            end_idx = min(waveform_nums, beg_idx + self.batch_size)
-            feats, feats_len = self.extract_feat(waveform_list[beg_idx:end_idx])
-            ctc_logits, encoder_out_lens = self.infer(feats, 
-                                 feats_len, 
-                                 np.array(language, dtype=np.int32), 
-                                 np.array(textnorm, dtype=np.int32)
-                                 )
-            # back to torch.Tensor
-            ctc_logits = torch.from_numpy(ctc_logits).float()
-            # support batch_size=1 only currently
-            x = ctc_logits[0, : encoder_out_lens[0].item(), :]
-            yseq = x.argmax(dim=-1)
-            yseq = torch.unique_consecutive(yseq, dim=-1)
-
-            mask = yseq != self.blank_id
-            token_int = yseq[mask].tolist()
-            
-            if tokenizer is not None:
-                asr_res.append(tokenizer.tokens2text(token_int))
-            else:
-                asr_res.append(token_int)
+        language = self.per_item(language, waveform_nums, "language")
+        textnorm = self.per_item(textnorm, waveform_nums, "textnorm")
+
+        feat_list, feat_lens = [], []
+        for waveform in waveform_list:
+            speech, _ = self.frontend.fbank(waveform)
+            feat, feat_len = self.frontend.lfr_cmvn(speech)
+            feat_list.append(feat)
+            feat_lens.append(feat_len)
+        order = np.argsort(-np.array(feat_lens), kind="stable")
+
+        batch_size = batch_size or self.batch_size
+        asr_res = [None] * waveform_nums
+        for beg_idx in range(0, waveform_nums, batch_size):
+            index = order[beg_idx : beg_idx + batch_size]
+            feats_len = np.array([feat_lens[i] for i in index], dtype=np.int32)
+            max_len = -(-feats_len.max() // self.shape_bucket) * self.shape_bucket
+            feats = self.pad_feats([feat_list[i] for i in index], max_len)
+            inputs = [feats, feats_len, language[index], textnorm[index]]
+            cascade = self.ort_infer_fp32 is not None
+            ctc_ids, probs, encoder_out_lens = self.frame_outputs(self.ort_infer, inputs, cascade)
+            if cascade:
+                ctc_ids, encoder_out_lens = self.cascade(ctc_ids, probs, encoder_out_lens, inputs)
+            token_ints = self.ctc_collapse(ctc_ids, encoder_out_lens)
+            for i, token_int in zip(index, token_ints):
+                if tokenizer is not None:
+                    asr_res[i] = tokenizer.tokens2text(token_int)
+                else:
+                    asr_res[i] = token_int
         return asr_res
 
+    @staticmethod
+    def per_item(value, num: int, name: str) -> np.ndarray:
+        value = np.array(value, dtype=np.int32).reshape(-1)
+        if value.size == 1:
+            return np.repeat(value, num)
+        if value.size != num:
+            raise ValueError(f"expected 1 or {num} {name} ids, got {value.size}")
+        return value
+
+    def ctc_collapse(self, ctc_ids: np.ndarray, lengths: np.ndarray) -> List[List[int]]:
+        """Merge repeats and drop blanks of every row of (B, T) argmax ids."""
+        prev = np.pad(ctc_ids[:, :-1], ((0, 0), (1, 0)), constant_values=-1)
+        frames = np.arange(ctc_ids.shape[1])[None, :]
+        keep = (ctc_ids != prev) & (ctc_ids != self.blank_id) & (frames < lengths.reshape(-1, 1))
+        return [row[mask].tolist() for row, mask in zip(ctc_ids, keep)]
+
+    @staticmethod
+    def frame_outputs(session, inputs: List[np.ndarray], with_probs: bool = False):
+        """Frame-level argmax ids, their posteriors (if `with_probs`) and lengths.
+
+        Graphs exported with `ctc_argmax=True` already return int32 ids and
+        max-probabilities, so the (B, T, vocab) logits never leave ORT; plain
+        graphs are argmaxed here.
+        """
+        outputs = dict(zip(session.get_output_names(), session(inputs)))
+        if "ctc_ids" in outputs:
+            return outputs["ctc_ids"], outputs["ctc_max_prob"], outputs["encoder_out_lens"]
+        ctc_logits = outputs["ctc_logits"]
+        if with_probs:
+            ids, probs = frame_max_probs(ctc_logits)
+        else:
+            ids, probs = ctc_logits.argmax(axis=-1), None
+        return ids, probs, outputs["encoder_out_lens"]
+
+    def cascade(self, ctc_ids, probs, encoder_out_lens, inputs):
+        """Replace the rows of the quantized pass whose confidence is below
+        `cascade_threshold` by the output of the fp32 model."""
+        confidence = ctc_confidence(ctc_ids, probs, encoder_out_lens, blank_id=self.blank_id)
+        redecode = np.nonzero(confidence < self.cascade_threshold)[0]
+        self.cascade_stats["segments"] += len(confidence)
+        self.cascade_stats["redecoded"] += len(redecode)
+        if len(redecode) == 0:
+            return ctc_ids, encoder_out_lens
+        feats, feats_len, language, textnorm = inputs
+        max_len = -(-feats_len[redecode].max() // self.shape_bucket) * self.shape_bucket
+        ids_fp32, _, lens_fp32 = self.frame_outputs(
+            self.ort_infer_fp32,
+            [feats[redecode, :max_len], feats_len[redecode], language[redecode], textnorm[redecode]],
+        )
+        ctc_ids = ctc_ids.copy()
+        encoder_out_lens = encoder_out_lens.copy()
+        ctc_ids[redecode] = self.blank_id
+        ctc_ids[redecode, : ids_fp32.shape[1]] = ids_fp32
+        encoder_out_lens[redecode] = lens_fp32
+        return ctc_ids, encoder_out_lens
+
     def load_data(self, wav_content: Union[str, np.ndarray, List[str]], fs: int = None) -> List:
         def load_wav(path: str) -> np.ndarray:
-            waveform, _ = librosa.load(path, sr=fs)
-            return waveform
+            return load_audio(path, fs)
 
         if isinstance(wav_content, np.ndarray):
             return [wav_content]
@@ -110,22 +255,10 @@ class SenseVoiceSmallONNX:
             return [load_wav(wav_content)]
 
         if isinstance(wav_content, list):
-            return [load_wav(path) for path in wav_content]
+            return [w if isinstance(w, np.ndarray) else load_wav(w) for w in wav_content]
 
         raise TypeError(f"The type of {wav_content} is not in [str, np.ndarray, list]")
 
-    def extract_feat(self, waveform_list: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
-        feats, feats_len = [], []
-        for waveform in waveform_list:
-            speech, _ = self.frontend.fbank(waveform)
-            feat, feat_len = self.frontend.lfr_cmvn(speech)
-            feats.append(feat)
-            feats_len.append(feat_len)
-
-        feats = self.pad_feats(feats, np.max(feats_len))
-        feats_len = np.array(feats_len).astype(np.int32)
-        return feats, feats_len
-
     @staticmethod
     def pad_feats(feats: List[np.ndarray], max_feat_len: int) -> np.ndarray:
         def pad_feat(feat: np.ndarray, cur_len: int) -> np.ndarray:
@@ -136,10 +269,100 @@ class SenseVoiceSmallONNX:
         feats = np.array(feat_res).astype(np.float32)
         return feats
 
-    def infer(self, 
-              feats: np.ndarray, 
-              feats_len: np.ndarray,
-              language: np.ndarray,
-              textnorm: np.ndarray,) -> Tuple[np.ndarray, np.ndarray]:
-        outputs = self.ort_infer([feats, feats_len, language, textnorm])
-        return outputs
+
+class SenseVoiceSmallStreamingONNX:
+    """Chunk-by-chunk runner of `model_streaming.onnx` (`export(streaming=True)`).
+
+    Audio is pushed in arbitrary pieces; `WavFrontendOnline` turns it into lfr
+    frames, and each time `chunk_size` frames are buffered one fixed-shape
+    session run decodes them, so the latency per chunk is constant. Returns the
+    newly emitted token ids and the rich tags (language, emotion, event,
+    textnorm ids) predicted for the latest chunk.
+    """
+
+    def __init__(
+        self,
+        model_dir: Union[str, Path] = None,
+        device_id: Union[str, int] = "-1",
+        intra_op_num_threads: int = 2,
+        cache_dir: str = None,
+        cache_optimized: bool = False,
+        **kwargs,
+    ):
+        if not cache_optimized:
+            cache_dir = None
+        elif cache_dir is None:
+            cache_dir = model_dir
+        config, cmvn = load_model_assets(model_dir, cache_dir)
+        frontend_conf = {**config["frontend_conf"], "cmvn_file": os.path.join(model_dir, "am.mvn")}
+        self.frontend = WavFrontendOnline(**frontend_conf, cmvn=cmvn)
+        self.ort_infer = OrtInferSession(
+            os.path.join(model_dir, "model_streaming.onnx"),
+            device_id,
+            intra_op_num_threads=intra_op_num_threads,
+            optimized_cache_dir=cache_dir,
+        )
+        inputs = self.ort_infer.session.get_inputs()
+        self.chunk_size, self.feat_dim = inputs[0].shape[1], inputs[0].shape[2]
+        self.cache_specs = [(i.shape[1:], np.float32) for i in inputs[6:]]
+        self.blank_id = 0
+        self.num_chunks = 0
+        self.reset()
+
+    def reset(self):
+        """Start a new stream."""
+        self.frontend.cache_reset()
+        self.caches = [np.zeros((1, *shape), dtype=dtype) for shape, dtype in self.cache_specs]
+        self.cache_len = np.zeros((1,), dtype=np.int32)
+        self.offset = 0
+        self.last_id = self.blank_id
+        self.feats = np.zeros((0, self.feat_dim), dtype=np.float32)
+        self.rich = []
+
+    def run_chunk(self, chunk: np.ndarray, num_frames: int, language: int, textnorm: int) -> List[int]:
+        outputs = self.ort_infer(
+            [
+                chunk[None].astype(np.float32),
+                np.array([language], dtype=np.int32),
+                np.array([textnorm], dtype=np.int32),
+                np.array([self.offset], dtype=np.int32),
+                np.array([num_frames], dtype=np.int32),
+                self.cache_len,
+            ]
+            + self.caches
+        )
+        ctc_logits, self.cache_len, self.caches = outputs[0], outputs[1], list(outputs[2:])
+        self.offset += num_frames
+        self.num_chunks += 1
+        ids = ctc_logits[0].argmax(axis=-1)
+        self.rich = ids[:4].tolist()
+        tokens = []
+        for i in ids[4 : 4 + num_frames].tolist():
+            if i != self.last_id and i != self.blank_id:
+                tokens.append(i)
+            self.last_id = i
+        return tokens
+
+    def __call__(
+        self,
+        audio_chunk: np.ndarray,
+        language: int = 0,
+        textnorm: int = 15,
+        is_final: bool = False,
+    ) -> dict:
+        feats, _ = self.frontend.extract_fbank(
+            audio_chunk[None].astype(np.float32), np.array([len(audio_chunk)]), is_final
+        )
+        if len(feats):
+            self.feats = np.concatenate((self.feats, feats[0].astype(np.float32)), axis=0)
+        tokens = []
+        while len(self.feats) >= self.chunk_size or (is_final and len(self.feats)):
+            num_frames = min(len(self.feats), self.chunk_size)
+            chunk = np.zeros((self.chunk_size, self.feat_dim), dtype=np.float32)
+            chunk[:num_frames] = self.feats[:num_frames]
+            self.feats = self.feats[num_frames:]
+            tokens += self.run_chunk(chunk, num_frames, language, textnorm)
+        result = {"tokens": tokens, "rich": self.rich}
+        if is_final:
+            self.reset()
+        return result
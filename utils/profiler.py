@@ -0,0 +1,256 @@
+# -*- encoding: utf-8 -*-
+import functools
+import inspect
+import json
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import torch
+from torch import nn
+
+
+def _first_tensor(x):
+    if isinstance(x, torch.Tensor):
+        return x
+    if isinstance(x, (list, tuple)):
+        for i in x:
+            t = _first_tensor(i)
+            if t is not None:
+                return t
+    return None
+
+
+def _tensor_bytes(x):
+    if isinstance(x, torch.Tensor):
+        return x.numel() * x.element_size()
+    if isinstance(x, (list, tuple)):
+        return sum(_tensor_bytes(i) for i in x)
+    if isinstance(x, dict):
+        return sum(_tensor_bytes(i) for i in x.values())
+    return 0
+
+
+def _attention_flops(module, b, t):
+    # projections + QK^T + AV + depthwise fsmn; after head pruning q/k/out keep
+    # h * d_k channels while v (the fsmn memory) keeps all n_feat
+    qkv, out = module.linear_q_k_v, module.linear_out
+    proj = 2 * b * t * (qkv.in_features * qkv.out_features + out.in_features * out.out_features)
+    att = 2 * 2 * b * module.h * t * t * module.d_k
+    fsmn = 2 * b * t * module.fsmn_block.in_channels * module.fsmn_block.kernel_size[0]
+    return proj + att + fsmn
+
+
+def _feed_forward_flops(module, tokens):
+    return 2 * tokens * (module.w_1.in_features * module.w_1.out_features + module.w_2.in_features * module.w_2.out_features)
+
+
+def _ctc_flops(model, name, arguments) -> int:
+    """Projection FLOPs of the CTC decode methods, which call F.linear on
+    (a subset of) the ctc_lo weight instead of the ctc_lo module."""
+    encoder_out = arguments["encoder_out"]
+    positions = encoder_out.numel() // encoder_out.size(-1)
+    if name == "ctc.greedy_search":
+        columns = arguments.get("columns")
+        vocab = columns.numel() if columns is not None else model.ctc.ctc_lo.out_features
+    elif name == "ctc.column_probs":
+        vocab = arguments["columns"].numel()
+    else:
+        # target-token columns plus the blank column
+        vocab = max((len(t) for t in arguments["token_ids"]), default=0) + 1
+    return 2 * positions * encoder_out.size(-1) * vocab
+
+
+def estimate_flops(module: nn.Module, inputs, output) -> int:
+    """Analytic multiply-add * 2 count for the module types used by SenseVoiceEncoderSmall."""
+    x = _first_tensor(inputs)
+    if x is None:
+        return 0
+    if isinstance(module, nn.Linear):
+        return 2 * (x.numel() // module.in_features) * module.in_features * module.out_features
+    if isinstance(module, nn.Conv1d):
+        y = _first_tensor(output)
+        k = module.kernel_size[0]
+        return 2 * y.numel() * k * module.in_channels // module.groups
+    if hasattr(module, "linear_q_k_v") and hasattr(module, "d_k"):
+        return _attention_flops(module, x.size(0), x.size(1))
+    if hasattr(module, "w_1") and hasattr(module, "w_2"):
+        return _feed_forward_flops(module, x.numel() // module.w_1.in_features)
+    if hasattr(module, "self_attn") and hasattr(module, "feed_forward"):
+        b, t = x.size(0), x.size(1)
+        return _attention_flops(module.self_attn, b, t) + _feed_forward_flops(module.feed_forward, b * t)
+    return 0
+
+
+class EncoderProfiler:
+    """Per-layer wall time, FLOP estimate and memory of a SenseVoiceSmall forward.
+
+    Hooks (and the wrappers of the CTC decode methods, which call F.linear on
+    the ctc_lo weight rather than the ctc_lo module) only exist inside the
+    `with` block, so a model that is not being profiled runs without any
+    instrumentation overhead:
+
+        with EncoderProfiler(model) as prof:
+            model.inference(...)
+        print(prof.table())
+        prof.export_chrome_trace("trace.json")
+    """
+
+    def __init__(self, model: nn.Module, submodules: bool = True):
+        self.model = model
+        self.submodules = submodules
+        self.handles = []
+        self.events: List[Dict] = []
+        self._stack = {}
+        self._origin = None
+        self.wrapped = []
+
+    def targets(self):
+        encoder = self.model.encoder
+        for group in ("encoders0", "encoders", "tp_encoders"):
+            for i, layer in enumerate(getattr(encoder, group, [])):
+                name = f"{group}.{i}"
+                yield name, layer
+                if self.submodules:
+                    yield f"{name}.self_attn", layer.self_attn
+                    yield f"{name}.self_attn.fsmn_block", layer.self_attn.fsmn_block
+                    yield f"{name}.feed_forward", layer.feed_forward
+
+    def method_targets(self):
+        """Decode methods of the model, timed by wrapping them for the `with` block."""
+        for name, method in (
+            ("ctc.greedy_search", "ctc_greedy_search"),
+            ("ctc.column_probs", "ctc_column_probs"),
+            ("ctc.token_spans", "ctc_token_spans"),
+        ):
+            if hasattr(self.model, method):
+                yield name, method
+
+    def _sync(self, x):
+        if x is not None and x.is_cuda:
+            torch.cuda.synchronize(x.device)
+
+    def _begin(self, x):
+        self._sync(x)
+        mem = torch.cuda.memory_allocated(x.device) if x is not None and x.is_cuda else 0
+        return time.perf_counter(), mem
+
+    def _record(self, name, x, beg, mem, output, flops):
+        self._sync(x)
+        end = time.perf_counter()
+        if x is not None and x.is_cuda:
+            allocated = torch.cuda.memory_allocated(x.device) - mem
+        else:
+            allocated = _tensor_bytes(output)
+        self.events.append(
+            {
+                "name": name,
+                "length": int(x.size(1)) if x is not None and x.dim() > 1 else 0,
+                "batch": int(x.size(0)) if x is not None else 0,
+                "begin": beg - self._origin,
+                "cost": end - beg,
+                "flops": flops,
+                "bytes": int(allocated),
+            }
+        )
+
+    def _pre_hook(self, name):
+        def hook(module, inputs):
+            self._stack[id(module)] = self._begin(_first_tensor(inputs))
+
+        return hook
+
+    def _post_hook(self, name):
+        def hook(module, inputs, output):
+            x = _first_tensor(inputs)
+            beg, mem = self._stack.pop(id(module), (time.perf_counter(), 0))
+            self._record(name, x, beg, mem, output, estimate_flops(module, inputs, output))
+
+        return hook
+
+    def _wrap(self, name, fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapped(*args, **kwargs):
+            x = _first_tensor(args)
+            beg, mem = self._begin(x)
+            output = fn(*args, **kwargs)
+            arguments = signature.bind(*args, **kwargs).arguments
+            self._record(name, x, beg, mem, output, _ctc_flops(self.model, name, arguments))
+            return output
+
+        return wrapped
+
+    def __enter__(self):
+        self.events = []
+        self._origin = time.perf_counter()
+        for name, module in self.targets():
+            self.handles.append(module.register_forward_pre_hook(self._pre_hook(name)))
+            self.handles.append(module.register_forward_hook(self._post_hook(name)))
+        # instance attributes shadowing the class methods, deleted on exit
+        self.wrapped = []
+        for name, method in self.method_targets():
+            setattr(self.model, method, self._wrap(name, getattr(self.model, method)))
+            self.wrapped.append(method)
+        return self
+
+    def __exit__(self, *args):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        for method in self.wrapped:
+            delattr(self.model, method)
+        self.wrapped = []
+        self._stack = {}
+
+    def summary(self) -> List[Dict]:
+        """Aggregate events by (layer name, input length)."""
+        agg = defaultdict(lambda: {"calls": 0, "cost": 0.0, "flops": 0, "bytes": 0})
+        for e in self.events:
+            item = agg[(e["name"], e["length"])]
+            item["calls"] += 1
+            item["cost"] += e["cost"]
+            item["flops"] += e["flops"]
+            item["bytes"] = max(item["bytes"], e["bytes"])
+        rows = []
+        for (name, length), item in agg.items():
+            gflops = item["flops"] / max(item["cost"], 1e-9) / 1e9
+            rows.append(dict(name=name, length=length, gflops_per_s=gflops, **item))
+        return rows
+
+    def table(self, sort_by: str = "cost", top: int = None) -> str:
+        rows = sorted(self.summary(), key=lambda r: r[sort_by], reverse=True)
+        if top is not None:
+            rows = rows[:top]
+        lines = [f"{'layer':<40}{'len':>8}{'calls':>7}{'ms':>10}{'GFLOP':>10}{'GFLOP/s':>10}{'MB':>10}"]
+        for r in rows:
+            lines.append(
+                f"{r['name']:<40}{r['length']:>8}{r['calls']:>7}{r['cost'] * 1000:>10.2f}"
+                f"{r['flops'] / 1e9:>10.3f}{r['gflops_per_s']:>10.2f}{r['bytes'] / 2**20:>10.2f}"
+            )
+        return "\n".join(lines)
+
+    def export_csv(self, path: str):
+        columns = ["name", "length", "calls", "cost", "flops", "gflops_per_s", "bytes"]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(",".join(columns) + "\n")
+            for r in self.summary():
+                f.write(",".join(str(r[c]) for c in columns) + "\n")
+
+    def export_chrome_trace(self, path: str):
+        """Write events in the Chrome trace event format (chrome://tracing, perfetto)."""
+        trace = [
+            {
+                "name": e["name"],
+                "ph": "X",
+                "ts": e["begin"] * 1e6,
+                "dur": e["cost"] * 1e6,
+                "pid": 0,
+                "tid": 0,
+                "args": {k: e[k] for k in ("length", "batch", "flops", "bytes")},
+            }
+            for e in self.events
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
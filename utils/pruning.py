@@ -0,0 +1,158 @@
+# -*- encoding: utf-8 -*-
+import os
+import shutil
+from typing import Dict, List
+
+import torch
+import yaml
+from torch import nn
+
+
+def encoder_layers(encoder) -> List[nn.Module]:
+    """Encoder layers in config order: encoders0, encoders, tp_encoders."""
+    return list(encoder.encoders0) + list(encoder.encoders) + list(encoder.tp_encoders)
+
+
+class PruningScorer:
+    """Activation-magnitude importance of attention heads and FFN hidden units.
+
+    A head is scored by the mean norm of its context vector times the norm of
+    its `linear_out` columns, a hidden unit by its mean activation times the
+    norm of its `w_2` column. Hooks are only active inside the `with` block.
+    """
+
+    def __init__(self, model):
+        self.layers = encoder_layers(model.encoder)
+        self.handles = []
+        self.head_sums = [None] * len(self.layers)
+        self.unit_sums = [None] * len(self.layers)
+        self.frames = [0] * len(self.layers)
+
+    def _head_hook(self, i):
+        def hook(module, inputs):
+            attn = self.layers[i].self_attn
+            x = inputs[0].detach().float()
+            b, t, _ = x.size()
+            norms = x.reshape(b, t, attn.h, attn.d_k).norm(dim=-1).sum(dim=(0, 1))
+            self.head_sums[i] = norms if self.head_sums[i] is None else self.head_sums[i] + norms
+            self.frames[i] += b * t
+
+        return hook
+
+    def _unit_hook(self, i):
+        def hook(module, inputs):
+            x = inputs[0].detach().float()
+            sums = x.abs().reshape(-1, x.size(-1)).sum(dim=0)
+            self.unit_sums[i] = sums if self.unit_sums[i] is None else self.unit_sums[i] + sums
+
+        return hook
+
+    def __enter__(self):
+        for i, layer in enumerate(self.layers):
+            self.handles.append(
+                layer.self_attn.linear_out.register_forward_pre_hook(self._head_hook(i))
+            )
+            self.handles.append(layer.feed_forward.w_2.register_forward_pre_hook(self._unit_hook(i)))
+        return self
+
+    def __exit__(self, *args):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def head_scores(self) -> List[torch.Tensor]:
+        scores = []
+        for i, layer in enumerate(self.layers):
+            attn = layer.self_attn
+            w = attn.linear_out.weight.detach().float()
+            w_norm = w.reshape(w.size(0), attn.h, attn.d_k).norm(dim=(0, 2))
+            scores.append(self.head_sums[i].to(w.device) / max(self.frames[i], 1) * w_norm)
+        return scores
+
+    def unit_scores(self) -> List[torch.Tensor]:
+        scores = []
+        for i, layer in enumerate(self.layers):
+            w = layer.feed_forward.w_2.weight.detach().float()
+            scores.append(self.unit_sums[i].to(w.device) / max(self.frames[i], 1) * w.norm(dim=0))
+        return scores
+
+
+def _sliced_linear(linear: nn.Linear, rows=None, cols=None) -> nn.Linear:
+    weight = linear.weight.data
+    bias = linear.bias.data if linear.bias is not None else None
+    if rows is not None:
+        weight = weight[rows]
+        bias = bias[rows] if bias is not None else None
+    if cols is not None:
+        weight = weight[:, cols]
+    new = nn.Linear(weight.size(1), weight.size(0), bias=bias is not None)
+    new = new.to(device=weight.device, dtype=weight.dtype)
+    new.weight.data.copy_(weight)
+    if bias is not None:
+        new.bias.data.copy_(bias)
+    return new
+
+
+def prune_attention_heads(attn, keep: torch.Tensor):
+    """Physically remove the heads of a MultiHeadedAttentionSANM not listed in `keep`.
+
+    q/k rows and `linear_out` columns of the dropped heads are removed. v keeps
+    all channels because the fsmn memory is added back in model dimension.
+    """
+    keep = keep.sort().values.to(attn.linear_q_k_v.weight.device)
+    hd = attn.h * attn.d_k
+    cols = (keep[:, None] * attn.d_k + torch.arange(attn.d_k, device=keep.device)).reshape(-1)
+    rows = torch.cat(
+        (cols, hd + cols, 2 * hd + torch.arange(attn.n_feat, device=keep.device))
+    )
+    v_index = attn.v_index if attn.v_index is not None else torch.arange(hd, device=keep.device)
+
+    attn.linear_q_k_v = _sliced_linear(attn.linear_q_k_v, rows=rows)
+    attn.linear_out = _sliced_linear(attn.linear_out, cols=cols)
+    attn.h = int(keep.numel())
+    attn.register_buffer("v_index", v_index[cols].clone())
+
+
+def prune_feed_forward(ffn, keep: torch.Tensor):
+    """Physically remove the hidden units of a PositionwiseFeedForward not listed in `keep`."""
+    keep = keep.sort().values.to(ffn.w_1.weight.device)
+    ffn.w_1 = _sliced_linear(ffn.w_1, rows=keep)
+    ffn.w_2 = _sliced_linear(ffn.w_2, cols=keep)
+
+
+def prune_model(model, head_scores, unit_scores, head_ratio: float = 0.25, unit_ratio: float = 0.25):
+    """Drop the lowest scoring `head_ratio` heads and `unit_ratio` units of every layer.
+
+    Returns the per-layer `attention_heads_list` and `linear_units_list` for encoder_conf.
+    """
+    heads_list, units_list = [], []
+    for layer, h_score, u_score in zip(encoder_layers(model.encoder), head_scores, unit_scores):
+        n_heads = max(1, int(round(h_score.numel() * (1 - head_ratio))))
+        n_units = max(1, int(round(u_score.numel() * (1 - unit_ratio))))
+        if n_heads < h_score.numel():
+            prune_attention_heads(layer.self_attn, h_score.topk(n_heads).indices)
+        if n_units < u_score.numel():
+            prune_feed_forward(layer.feed_forward, u_score.topk(n_units).indices)
+        heads_list.append(layer.self_attn.h)
+        units_list.append(layer.feed_forward.w_1.out_features)
+    return heads_list, units_list
+
+
+def save_pruned_model(model, model_dir: str, output_dir: str, encoder_conf_update: Dict):
+    """Copy `model_dir` to `output_dir` with an updated config.yaml and the pruned model.pt,
+    so that `SenseVoiceSmall.from_pretrained(output_dir)` rebuilds the pruned shapes."""
+    os.makedirs(output_dir, exist_ok=True)
+    for name in os.listdir(model_dir):
+        src = os.path.join(model_dir, name)
+        if name in ("model.pt", "config.yaml") or name.endswith(".onnx") or not os.path.isfile(src):
+            continue
+        shutil.copy(src, os.path.join(output_dir, name))
+
+    with open(os.path.join(model_dir, "config.yaml"), "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    config.setdefault("encoder_conf", {}).update(encoder_conf_update)
+    with open(os.path.join(output_dir, "config.yaml"), "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+
+    torch.save(model.state_dict(), os.path.join(output_dir, "model.pt"))
+    return output_dir
@@ -0,0 +1,108 @@
+# -*- encoding: utf-8 -*-
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+from onnxruntime.quantization import CalibrationDataReader
+
+
+class ManifestCalibrationReader(CalibrationDataReader):
+    """Feeds fbank features of the audio listed in a `data/train_example.jsonl`
+    style manifest to the ORT calibrator, one utterance per batch, with the
+    language prompt taken from `text_language` when present."""
+
+    def __init__(
+        self,
+        manifest: str,
+        model_dir: str,
+        lid_dict: Dict[str, int],
+        textnorm_id: int,
+        limit: int = 100,
+    ):
+        import librosa
+
+        from utils.frontend import WavFrontend
+        from utils.infer_utils import read_yaml
+
+        config = read_yaml(os.path.join(model_dir, "config.yaml"))
+        frontend = WavFrontend(
+            **{**config["frontend_conf"], "cmvn_file": os.path.join(model_dir, "am.mvn")}
+        )
+        self.items: List[Dict[str, np.ndarray]] = []
+        with open(manifest, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                waveform, _ = librosa.load(item["source"], sr=frontend.opts.frame_opts.samp_freq)
+                speech, _ = frontend.fbank(waveform)
+                feat, feat_len = frontend.lfr_cmvn(speech)
+                language = item.get("text_language", "").strip("<|>")
+                self.items.append(
+                    {
+                        "speech": feat[None].astype(np.float32),
+                        "speech_lengths": np.array([feat_len], dtype=np.int32),
+                        "language": np.array([lid_dict.get(language, 0)], dtype=np.int32),
+                        "textnorm": np.array([textnorm_id], dtype=np.int32),
+                    }
+                )
+                if len(self.items) >= limit:
+                    break
+        if not self.items:
+            raise ValueError(f"no calibration audio in {manifest}")
+        self.index = 0
+
+    def get_next(self):
+        if self.index >= len(self.items):
+            return None
+        self.index += 1
+        return self.items[self.index - 1]
+
+    def rewind(self):
+        self.index = 0
+
+
+def quantize_static_qdq(
+    model_path: str,
+    output_path: str,
+    reader: CalibrationDataReader,
+    per_channel: bool = True,
+    calibrate_method: str = "MinMax",
+    op_types: List[str] = ("MatMul", "Conv"),
+    exclude_ctc: bool = True,
+):
+    """Static int8 QDQ quantization of an exported SenseVoice graph.
+
+    Activations get calibrated ranges instead of the per-call min/max of
+    dynamic quantization. The attention/FFN MatMuls and the FSMN depthwise
+    Conv are quantized, weights per channel. The CTC output projection stays
+    fp32 by default since its logits drive the decision.
+    """
+    import onnx
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    prepared_path = output_path.replace(".onnx", "_prep.onnx")
+    quant_pre_process(model_path, prepared_path, skip_symbolic_shape=True)
+    nodes_to_exclude = []
+    if exclude_ctc:
+        nodes_to_exclude = [n.name for n in onnx.load(prepared_path).graph.node if "ctc" in n.name]
+    try:
+        quantize_static(
+            model_input=prepared_path,
+            model_output=output_path,
+            calibration_data_reader=reader,
+            quant_format=QuantFormat.QDQ,
+            op_types_to_quantize=list(op_types),
+            per_channel=per_channel,
+            reduce_range=False,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            nodes_to_exclude=nodes_to_exclude,
+            calibrate_method=getattr(CalibrationMethod, calibrate_method),
+            extra_options={"WeightSymmetric": True, "ActivationSymmetric": False},
+        )
+    finally:
+        os.remove(prepared_path)
+    return output_path
@@ -0,0 +1,148 @@
+# -*- encoding: utf-8 -*-
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from typing import Dict, List
+
+
+class AsyncResultWriter:
+    """Background writer for inference results under `output_dir`.
+
+    Keeps the `DatadirWriter` text layout (`{output_dir}/{subdir}/text` with
+    "key text" lines) and can also write `{subdir}/result.jsonl` with timestamps.
+    Records go through a bounded queue to a writer thread, which appends them
+    in batches, fsyncs every `fsync_interval` seconds and flushes on `close()`
+    (also registered at exit), so decoding does not wait on the filesystem.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        max_queue: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 0.5,
+        fsync_interval: float = 5.0,
+        jsonl: bool = False,
+    ):
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.jsonl = jsonl
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.files: Dict[str, object] = {}
+        self.error = None
+        self.written = 0
+        self._closed = False
+        self._last_fsync = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="AsyncResultWriter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, key: str, result: dict, subdir: str = "1best_recog"):
+        """Queue one result; blocks only when the queue is full.
+
+        The lines are rendered here, so callers may modify `result` afterwards.
+        """
+        if self._closed:
+            raise RuntimeError("result writer is closed")
+        text_line = f"{key} {result['text']}\n"
+        json_line = None
+        if self.jsonl:
+            json_line = json.dumps({"key": key, **result}, ensure_ascii=False) + "\n"
+        self._put((subdir, text_line, json_line))
+
+    def _put(self, item):
+        # a dead writer thread no longer drains the queue, so never block on it
+        while True:
+            if self.error is not None:
+                raise RuntimeError("result writer failed") from self.error
+            if not self._thread.is_alive():
+                raise RuntimeError("result writer thread has stopped")
+            try:
+                self.queue.put(item, timeout=self.flush_interval)
+                return
+            except queue.Full:
+                continue
+
+    def _file(self, subdir: str, name: str):
+        path = os.path.join(self.output_dir, subdir, name)
+        if path not in self.files:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # truncated on first use like DatadirWriter, appended by later batches
+            self.files[path] = open(path, "w", encoding="utf-8")
+        return self.files[path]
+
+    def _write_batch(self, records: List[tuple]):
+        text_lines, json_lines = {}, {}
+        for subdir, text_line, json_line in records:
+            text_lines.setdefault(subdir, []).append(text_line)
+            if json_line is not None:
+                json_lines.setdefault(subdir, []).append(json_line)
+        for subdir, lines in text_lines.items():
+            self._file(subdir, "text").write("".join(lines))
+        for subdir, lines in json_lines.items():
+            self._file(subdir, "result.jsonl").write("".join(lines))
+        self.written += len(records)
+
+    def _sync(self, fsync: bool):
+        for f in self.files.values():
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        if fsync:
+            self._last_fsync = time.monotonic()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            records = []
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+                if item is None:
+                    stop = True
+                else:
+                    records.append(item)
+                while not stop and len(records) < self.batch_size:
+                    item = self.queue.get_nowait()
+                    if item is None:
+                        stop = True
+                    else:
+                        records.append(item)
+            except queue.Empty:
+                pass
+            try:
+                if records:
+                    self._write_batch(records)
+                fsync = stop or time.monotonic() - self._last_fsync >= self.fsync_interval
+                self._sync(fsync)
+            except Exception as e:
+                self.error = e
+                return
+
+    def close(self):
+        """Flush and fsync everything queued so far and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        while self._thread.is_alive():
+            try:
+                self.queue.put(None, timeout=self.flush_interval)
+                break
+            except queue.Full:
+                continue
+        self._thread.join()
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+        if self.error is not None:
+            raise RuntimeError("result writer failed") from self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -12,14 +12,20 @@ import torch
 import torchaudio
 
 
-from funasr import AutoModel
+from utils.backends import create_backend
 
+# SENSEVOICE_BACKEND: automodel (default, with VAD), torch, onnx, onnx_int8 or auto
 model = "iic/SenseVoiceSmall"
-model = AutoModel(model=model,
-				  vad_model="iic/speech_fsmn_vad_zh-cn-16k-common-pytorch",
-				  vad_kwargs={"max_single_segment_time": 30000},
-				  trust_remote_code=True,
-				  )
+backend = os.getenv("SENSEVOICE_BACKEND", "automodel")
+backend_kwargs = {}
+if backend == "automodel":
+	# the AutoModel arguments webui.py always used: trust_remote_code without remote_code
+	backend_kwargs = {"vad_model": "iic/speech_fsmn_vad_zh-cn-16k-common-pytorch", "trust_remote_code": True}
+model = create_backend(backend, model,
+					   device=os.getenv("SENSEVOICE_DEVICE", "cuda:0" if torch.cuda.is_available() else "cpu"),
+					   tier=os.getenv("SENSEVOICE_ACCURACY_TIER", "fp32"),
+					   **backend_kwargs,
+					   )
 
 import re
 
@@ -164,11 +170,10 @@ def model_inference(input_wav, language, fs=16000):
 	
 	merge_vad = True #False if selected_task == "ASR" else True
 	print(f"language: {language}, merge_vad: {merge_vad}")
-	text = model.generate(input=input_wav,
-						  cache={},
-						  language=language,
-						  use_itn=True,
-						  batch_size_s=60, merge_vad=merge_vad)
+	text = model.infer_batch([input_wav],
+							 language=language,
+							 use_itn=True,
+							 batch_size_s=60, merge_vad=merge_vad)
 	
 	print(text)
 	text = text[0]["text"]